@@ -0,0 +1,347 @@
+from typing import List, Optional
+from dataclasses import dataclass
+import threading
+import numpy as np
+from sqlalchemy import and_, event, select
+from sqlalchemy.orm import Session, aliased
+from models import db, Stock, Indicator, PriceBar, PriceBarVersion
+
+TRADING_DAYS_PER_YEAR = 252
+ANALYTICS_DEFAULT_WINDOW = 60
+ANALYTICS_MAX_WINDOW = 2520
+UNKNOWN_SECTOR = "Unknown"
+
+
+@dataclass
+class PriceMatrix:
+    """Daily closes aligned on a symbol x date grid, NaN where a stock has no bar."""
+    stock_ids: np.ndarray
+    symbols: np.ndarray
+    dates: np.ndarray
+    closes: np.ndarray
+    _log_returns: Optional[np.ndarray] = None
+
+    @property
+    def log_returns(self) -> np.ndarray:
+        """symbol x (date - 1) log returns, NaN where either close is missing."""
+        if self._log_returns is None:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                self._log_returns = np.diff(np.log(self.closes), axis=1)
+        return self._log_returns
+
+    def rows(self, symbols: Optional[List[str]] = None) -> np.ndarray:
+        """Row indices of the given symbols (all rows if None).
+
+        Raises:
+            ValueError: if a symbol has no price history
+        """
+        if symbols is None:
+            return np.arange(len(self.symbols))
+        positions = {symbol: i for i, symbol in enumerate(self.symbols.tolist())}
+        unknown = [symbol for symbol in symbols if symbol not in positions]
+        if unknown:
+            raise ValueError(f"No price history for: {', '.join(unknown)}.")
+        return np.array([positions[symbol] for symbol in symbols], dtype=np.int64)
+
+
+# The matrix is rebuilt when the shared price bar version differs from the one it was
+# built at, and dropped right after this process commits new bars
+_cache = {"key": None, "matrix": None}
+_cache_lock = threading.Lock()
+
+
+def clear_price_matrix() -> None:
+    """Drops the matrix of this process, it is rebuilt on the next request."""
+    with _cache_lock:
+        _cache["key"] = None
+        _cache["matrix"] = None
+
+
+def invalidate_price_matrix_on_commit() -> None:
+    """Bumps the shared price bar version in the current transaction, so every process
+    rebuilds its matrix once the bars are committed. Invalidating before the commit
+    would let a concurrent request cache the old bars as current. The caller commits.
+    """
+    if db.session.info.get("price_bars_changed"):
+        return
+    bumped = (
+        db.session.query(PriceBarVersion)
+        .filter_by(id=1)
+        .update({PriceBarVersion.version: PriceBarVersion.version + 1}, synchronize_session=False)
+    )
+    if not bumped:
+        db.session.add(PriceBarVersion(id=1, version=1))
+    db.session.info["price_bars_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session) -> None:
+    if session.info.pop("price_bars_changed", False):
+        clear_price_matrix()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session) -> None:
+    session.info.pop("price_bars_changed", None)
+
+
+def load_price_matrix() -> PriceMatrix:
+    query = select(PriceBar.stock_id, Stock.symbol, PriceBar.date, PriceBar.close).join(
+        Stock, Stock.id == PriceBar.stock_id
+    )
+    result = db.session.connection().execute(query)
+    rows = result.cursor.fetchall()
+    result.close()
+    if not rows:
+        return PriceMatrix(
+            stock_ids=np.empty(0, dtype=np.int64),
+            symbols=np.empty(0, dtype=object),
+            dates=np.empty(0, dtype=object),
+            closes=np.empty((0, 0)),
+        )
+
+    stock_ids, symbols, dates, closes = zip(*rows)
+    stock_index, first_rows, row_of = np.unique(
+        np.array(stock_ids, dtype=np.int64), return_index=True, return_inverse=True
+    )
+    date_index, column_of = np.unique(np.array(dates, dtype=object), return_inverse=True)
+
+    matrix = np.full((len(stock_index), len(date_index)), np.nan)
+    matrix[row_of, column_of] = np.array(closes, dtype=np.float64)
+    return PriceMatrix(
+        stock_ids=stock_index,
+        symbols=np.array(symbols, dtype=object)[first_rows],
+        dates=date_index,
+        closes=matrix,
+    )
+
+
+def price_matrix() -> PriceMatrix:
+    """The cached price matrix, rebuilt only after new bars arrived."""
+    version = db.session.query(PriceBarVersion.version).filter_by(id=1).scalar()
+    with _cache_lock:
+        if _cache["matrix"] is None or _cache["key"] != version:
+            _cache["matrix"] = load_price_matrix()
+            _cache["key"] = version
+        return _cache["matrix"]
+
+
+def check_window(window: int) -> int:
+    if not 2 <= window <= ANALYTICS_MAX_WINDOW:
+        raise ValueError(f"Window must be between 2 and {ANALYTICS_MAX_WINDOW}.")
+    return window
+
+
+def to_json_matrix(values: np.ndarray) -> list:
+    """Rounded nested lists with None for NaN, converted in bulk rather than per value."""
+    rounded = np.round(values, 6).astype(object)
+    rounded[np.isnan(values)] = None
+    return rounded.tolist()
+
+
+def to_json_value(value: float) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), 6)
+
+
+def correlation(
+    symbols: Optional[List[str]] = None,
+    window: int = ANALYTICS_DEFAULT_WINDOW,
+    min_periods: Optional[int] = None,
+) -> dict:
+    """Correlation matrix of daily log returns over the trailing window. Every pair uses
+    the days on which both stocks traded; pairs with fewer than min_periods such days
+    are null.
+    """
+    check_window(window)
+    min_periods = min_periods or max(2, window // 2)
+    matrix = price_matrix()
+    rows = matrix.rows(symbols)
+    returns = matrix.log_returns[rows, -window:]
+
+    # Pairwise complete sums as matrix products over a 0/1 presence mask
+    present = (~np.isnan(returns)).astype(np.float64)
+    x = np.where(present > 0, returns, 0.0)
+    n = present @ present.T
+    sum_x = x @ present.T  # sum of x_i over the days shared with j
+    sum_xx = (x * x) @ present.T
+    sum_xy = x @ x.T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = sum_xy - sum_x * sum_x.T / n
+        var_x = sum_xx - sum_x ** 2 / n
+        corr = cov / np.sqrt(var_x * var_x.T)
+    corr[n < min_periods] = np.nan
+    np.clip(corr, -1.0, 1.0, out=corr)
+
+    return {
+        "symbols": matrix.symbols[rows].tolist(),
+        "window": window,
+        "matrix": to_json_matrix(corr),
+    }
+
+
+def rolling_volatility(returns: np.ndarray, window: int) -> np.ndarray:
+    """Annualized rolling standard deviation of each row, NaN until window - 1 returns
+    are present. Computed from cumulative sums, missing returns are skipped."""
+    present = ~np.isnan(returns)
+    x = np.where(present, returns, 0.0)
+
+    def rolling_sum(values):
+        cumulative = np.cumsum(values, axis=1)
+        cumulative = np.concatenate([np.zeros((len(values), 1)), cumulative], axis=1)
+        return cumulative[:, window:] - cumulative[:, :-window]
+
+    n = rolling_sum(present.astype(np.float64))
+    sum_x = rolling_sum(x)
+    sum_xx = rolling_sum(x * x)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance = (sum_xx - sum_x ** 2 / n) / (n - 1)
+    variance[n < max(2, window - 1)] = np.nan
+    return np.sqrt(np.maximum(variance, 0.0)) * np.sqrt(TRADING_DAYS_PER_YEAR)
+
+
+def volatility(
+    symbols: Optional[List[str]] = None, window: int = 20, include_series: bool = False
+) -> dict:
+    check_window(window)
+    matrix = price_matrix()
+    rows = matrix.rows(symbols)
+    returns = matrix.log_returns[rows]
+    if returns.shape[1] < window:
+        series = np.full((len(rows), 0), np.nan)
+    else:
+        series = rolling_volatility(returns, window)
+
+    results = []
+    for i, symbol in enumerate(matrix.symbols[rows].tolist()):
+        result = {
+            "symbol": symbol,
+            "volatility": to_json_value(series[i, -1]) if series.shape[1] else None,
+        }
+        if include_series:
+            result["series"] = {
+                date: value
+                for date, value in zip(
+                    matrix.dates[window:].tolist(), to_json_matrix(series[i : i + 1])[0]
+                )
+                if value is not None
+            }
+        results.append(result)
+    return {"window": window, "stocks": results}
+
+
+def forward_fill(values: np.ndarray) -> np.ndarray:
+    """Replaces each NaN with the last value before it in its row."""
+    present = ~np.isnan(values)
+    last_index = np.where(present, np.arange(values.shape[1]), 0)
+    np.maximum.accumulate(last_index, axis=1, out=last_index)
+    return values[np.arange(len(values))[:, None], last_index]
+
+
+def drawdowns(symbols: Optional[List[str]] = None) -> dict:
+    """Maximum and current drawdown from the running peak of each stock's closes."""
+    matrix = price_matrix()
+    rows = matrix.rows(symbols)
+    closes = forward_fill(matrix.closes[rows])
+    results = []
+    if closes.shape[1]:
+        # fmax skips the NaNs before a stock's first bar
+        peaks = np.fmax.accumulate(closes, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            drawdown = closes / peaks - 1.0
+        filled = np.where(np.isnan(drawdown), 0.0, drawdown)
+        trough = np.argmin(filled, axis=1)
+        # The peak of the deepest drawdown is the last close at or before the trough
+        # that equals the running peak
+        at_peak = closes == peaks
+        peak_columns = np.where(at_peak, np.arange(closes.shape[1]), -1)
+        peak = np.maximum.accumulate(peak_columns, axis=1)[np.arange(len(rows)), trough]
+
+        for i, symbol in enumerate(matrix.symbols[rows].tolist()):
+            has_drawdown = filled[i, trough[i]] < 0
+            results.append(
+                {
+                    "symbol": symbol,
+                    "max_drawdown": round(float(filled[i, trough[i]]), 6),
+                    "current_drawdown": to_json_value(drawdown[i, -1]),
+                    "peak_date": matrix.dates[peak[i]] if has_drawdown else None,
+                    "trough_date": matrix.dates[trough[i]] if has_drawdown else None,
+                }
+            )
+    return {"stocks": results}
+
+
+def sector_aggregates(window: int = 20) -> dict:
+    """Per sector: number of stocks, median PERatio, total market capitalization and
+    market cap weighted return over the trailing window of closes."""
+    check_window(window)
+    matrix = price_matrix()
+
+    pe = aliased(Indicator)
+    cap = aliased(Indicator)
+    sector = aliased(Indicator)
+    query = (
+        select(Stock.id, sector.value, pe.numeric_value, cap.numeric_value)
+        .outerjoin(sector, and_(sector.stock_id == Stock.id, sector.indicator_type == "Sector"))
+        .outerjoin(pe, and_(pe.stock_id == Stock.id, pe.indicator_type == "PERatio"))
+        .outerjoin(
+            cap, and_(cap.stock_id == Stock.id, cap.indicator_type == "MarketCapitalization")
+        )
+        .order_by(Stock.id)
+    )
+    stocks = db.session.execute(query).all()
+    if not stocks:
+        return {"window": window, "sectors": []}
+
+    # A stock with several rows of one indicator type keeps the first one
+    stock_ids, first_rows = np.unique(
+        np.array([row[0] for row in stocks], dtype=np.int64), return_index=True
+    )
+    stocks = [stocks[i] for i in first_rows.tolist()]
+    sector_names, sector_codes = np.unique(
+        np.array([row[1] or UNKNOWN_SECTOR for row in stocks], dtype=object), return_inverse=True
+    )
+    pe_ratios = np.array([row[2] for row in stocks], dtype=np.float64)
+    market_caps = np.array([row[3] for row in stocks], dtype=np.float64)
+
+    # Trailing return of each stock, NaN without enough history
+    returns = np.full(len(stocks), np.nan)
+    if matrix.closes.shape[1] > window:
+        closes = forward_fill(matrix.closes)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            trailing = closes[:, -1] / closes[:, -window - 1] - 1.0
+        found = np.isin(stock_ids, matrix.stock_ids)
+        returns[found] = trailing[np.searchsorted(matrix.stock_ids, stock_ids[found])]
+
+    n_sectors = len(sector_names)
+    weighted = ~np.isnan(returns) & ~np.isnan(market_caps)
+    cap_sum = np.bincount(
+        sector_codes, weights=np.nan_to_num(market_caps), minlength=n_sectors
+    )
+    weighted_cap = np.bincount(
+        sector_codes[weighted], weights=market_caps[weighted], minlength=n_sectors
+    )
+    weighted_return = np.bincount(
+        sector_codes[weighted], weights=market_caps[weighted] * returns[weighted], minlength=n_sectors
+    )
+    counts = np.bincount(sector_codes, minlength=n_sectors)
+
+    # Group the P/E ratios by sector for the medians
+    order = np.argsort(sector_codes, kind="stable")
+    boundaries = np.searchsorted(sector_codes[order], np.arange(n_sectors + 1))
+
+    results = []
+    for j, name in enumerate(sector_names.tolist()):
+        sector_pe = pe_ratios[order[boundaries[j] : boundaries[j + 1]]]
+        sector_pe = sector_pe[~np.isnan(sector_pe)]
+        results.append(
+            {
+                "sector": name,
+                "stocks": int(counts[j]),
+                "median_pe_ratio": round(float(np.median(sector_pe)), 4) if len(sector_pe) else None,
+                "market_capitalization": float(cap_sum[j]),
+                "cap_weighted_return": (
+                    round(float(weighted_return[j] / weighted_cap[j]), 6) if weighted_cap[j] > 0 else None
+                ),
+            }
+        )
+    return {"window": window, "sectors": results}
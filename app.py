@@ -1,10 +1,32 @@
+import os
 from flask import Flask
-from config import setup_db, app
+from analytics import clear_price_matrix
+from config import configure_database, db, load_alert_rules, setup_db
 from routes import register_routes_auth
+from stock_utils.barStore import intraday_store
 
-setup_db()
 
-register_routes_auth(app)
+def create_app() -> Flask:
+    """Application factory, used by `python app.py` and by gunicorn (see gunicorn.conf.py)."""
+    app = Flask(__name__)
+    configure_database(app)
+    setup_db(app)
+    intraday_store.load_all()
+    register_routes_auth(app)
+    return app
+
+
+def load_worker_state(app: Flask) -> None:
+    """Rebuilds the in-memory state of this process from the database and the intraday
+    files, e.g. in a gunicorn worker that was forked after the master had started."""
+    with app.app_context():
+        load_alert_rules()
+        db.session.remove()
+    clear_price_matrix()
+    intraday_store.clear()
+    intraday_store.load_all()
+
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+    # Werkzeug development server, use gunicorn in production
+    create_app().run(host="0.0.0.0", port=int(os.getenv("PORT", "5000")))
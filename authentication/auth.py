@@ -1,13 +1,28 @@
 import json
+import threading
+import time
 from flask import request, _request_ctx_stack
 from functools import wraps
 from jose import jwt
 from urllib.request import urlopen
+from authentication.limits import rate_limiter
 
 
 AUTH0_DOMAIN = "zzs.eu.auth0.com"
 ALGORITHMS = ["RS256"]
 API_AUDIENCE = "stock-monitor-api"
+# Auth0 signing keys rarely rotate, fetching them for every request costs a round trip
+JWKS_TTL = 3600
+# Unknown key ids refetch the keys at most this often, so forged tokens cannot force a fetch each
+JWKS_MIN_REFRESH = 60
+# A slow Auth0 must not hold up authenticated requests for long
+JWKS_TIMEOUT = 5
+
+_jwks = None
+_jwks_fetched_at = 0.0
+_jwks_refreshing = False
+_jwks_lock = threading.Lock()
+_jwks_ready = threading.Condition(_jwks_lock)
 
 
 class AuthError(Exception):
@@ -76,9 +91,71 @@ def check_permissions(permission, payload):
     return True
 
 
+def refresh_jwks():
+    """Fetches the signing keys outside the lock. If the fetch fails the cached keys
+    stay in use and the fetch is retried after JWKS_MIN_REFRESH seconds. Whatever
+    happens, the refresh ends and waiting callers are woken up.
+    """
+    global _jwks, _jwks_fetched_at, _jwks_refreshing
+    jwks = None
+    try:
+        jsonurl = urlopen(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json", timeout=JWKS_TIMEOUT)
+        jwks = json.loads(jsonurl.read())
+    except Exception as e:
+        print(f"Fetching the signing keys failed: {e}")
+    finally:
+        with _jwks_ready:
+            if jwks is not None:
+                _jwks = jwks
+                _jwks_fetched_at = time.monotonic()
+            else:
+                _jwks_fetched_at = time.monotonic() - JWKS_TTL + JWKS_MIN_REFRESH
+            _jwks_refreshing = False
+            _jwks_ready.notify_all()
+
+
+def jwks_unavailable():
+    return AuthError(
+        {
+            "code": "jwks_unavailable",
+            "description": "Unable to fetch the signing keys.",
+        },
+        503,
+    )
+
+
+def get_jwks(refresh=False):
+    """Returns the cached signing keys. Expired keys are refreshed in the background
+    and keep being served meanwhile; only a caller without any keys (or with a token
+    naming an unknown key) waits for the fetch, and at most JWKS_TIMEOUT seconds for
+    a fetch another request started. One fetch runs at a time.
+    """
+    global _jwks_refreshing
+    with _jwks_ready:
+        if _jwks is None and _jwks_refreshing:
+            _jwks_ready.wait_for(lambda: not _jwks_refreshing, timeout=JWKS_TIMEOUT)
+            if _jwks is None:
+                raise jwks_unavailable()
+        age = time.monotonic() - _jwks_fetched_at
+        expired = age > JWKS_TTL or (refresh and age > JWKS_MIN_REFRESH)
+        if _jwks is not None and (_jwks_refreshing or not expired):
+            return _jwks
+        _jwks_refreshing = True
+        cached = _jwks
+
+    if cached is not None and not refresh:
+        threading.Thread(target=refresh_jwks, daemon=True).start()
+        return cached
+
+    refresh_jwks()
+    with _jwks_lock:
+        if _jwks is None:
+            raise jwks_unavailable()
+        return _jwks
+
+
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
-    jwks = json.loads(jsonurl.read())
+    jwks = get_jwks()
     unverified_header = jwt.get_unverified_header(token)
     rsa_key = {}
     if "kid" not in unverified_header:
@@ -87,6 +164,10 @@ def verify_decode_jwt(token):
             {"code": "invalid_header", "description": "Authorization malformed."}, 401
         )
 
+    if all(key["kid"] != unverified_header["kid"] for key in jwks["keys"]):
+        # The keys may have been rotated since they were cached
+        jwks = get_jwks(refresh=True)
+
     for key in jwks["keys"]:
         if key["kid"] == unverified_header["kid"]:
             rsa_key = {
@@ -147,6 +228,7 @@ def requires_auth(permission=""):
             token = get_token_auth_header()
             payload = verify_decode_jwt(token)
             check_permissions(permission, payload)
+            rate_limiter.check(payload.get("sub", ""), permission)
             return f(*args, **kwargs)
 
         return wrapper
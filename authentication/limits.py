@@ -0,0 +1,204 @@
+from typing import Dict, Optional, Tuple
+from collections import OrderedDict
+from functools import wraps
+import json
+import math
+import os
+import threading
+import time
+from flask import Response
+
+# Token bucket per JWT subject and permission: (tokens per second, burst)
+DEFAULT_RATE_LIMIT = (10.0, 20)
+RATE_LIMITS: Dict[str, Tuple[float, int]] = {
+    "get:stocks": (20.0, 40),
+    "get:alerts": (20.0, 40),
+    "get:portfolios": (5.0, 10),
+    # Writes that fan out to the upstream providers
+    "post:indicators": (1 / 60, 2),
+    "post:stocks": (10 / 60, 5),
+    "patch:stocks": (5.0, 10),
+}
+# e.g. RATE_LIMITS='{"post:stocks": [0.5, 5]}'
+RATE_LIMITS.update(
+    {permission: tuple(limit) for permission, limit in json.loads(os.getenv("RATE_LIMITS", "{}")).items()}
+)
+RATE_LIMIT_MAX_CLIENTS = 10_000
+
+# Requests running and waiting per expensive route: (max running, max waiting)
+CONCURRENCY_LIMITS: Dict[str, Tuple[int, int]] = {
+    "add_indicator": (1, 1),
+    "add_stock": (2, 1),
+    "get_export": (1, 1),
+    "get_correlation": (2, 1),
+    "get_sector_analytics": (2, 1),
+    "get_portfolio_valuation": (2, 1),
+}
+# Waiting requests hold a worker thread too, so all expensive routes together may only
+# occupy all but one of the WEB_THREADS of a worker (see gunicorn.conf.py), which keeps
+# one thread free for cheap reads
+EXPENSIVE_THREADS = max(1, int(os.getenv("WEB_THREADS", "4")) - 1)
+# How long a request waits in the queue of an expensive route before it gets a 503
+ADMISSION_WAIT_SECONDS = float(os.getenv("ADMISSION_WAIT_SECONDS", "2"))
+
+
+class LimitError(Exception):
+    """Raised when a request is rejected by a limiter; answered with `Retry-After`."""
+
+    def __init__(self, error, status_code, retry_after: float):
+        self.error = error
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def try_acquire(self) -> Optional[float]:
+        """Takes a token. Returns None on success, otherwise the seconds until a token is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return None
+        return (1.0 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets per (subject, permission). The least recently used buckets are
+    dropped beyond `max_clients`, which at worst hands a full bucket to an idle client.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, int]], max_clients: int = RATE_LIMIT_MAX_CLIENTS):
+        self.limits = limits
+        self.max_clients = max_clients
+        self.buckets: "OrderedDict[Tuple[str, str], TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, subject: str, permission: str) -> None:
+        """Raises:
+            LimitError: 429 if the subject has used up its budget for the permission
+        """
+        key = (subject, permission)
+        with self._lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(*self.limits.get(permission, DEFAULT_RATE_LIMIT))
+                self.buckets[key] = bucket
+                if len(self.buckets) > self.max_clients:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+            retry_after = bucket.try_acquire()
+        if retry_after is not None:
+            raise LimitError(
+                {"code": "rate_limited", "description": f"Too many '{permission}' requests."},
+                429,
+                retry_after,
+            )
+
+
+class ConcurrencyLimiter:
+    """Runs at most `max_running` requests at once, lets up to `max_waiting` more wait
+    for `wait_seconds`, and rejects the rest right away, so a burst of expensive requests
+    cannot occupy every worker thread.
+    """
+
+    def __init__(self, max_running: int, max_waiting: int, wait_seconds: float = ADMISSION_WAIT_SECONDS):
+        self.max_running = max_running
+        self.max_waiting = max_waiting
+        self.wait_seconds = wait_seconds
+        self.waiting = 0
+        self.average_duration = 1.0
+        self._slots = threading.BoundedSemaphore(max_running)
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> float:
+        # Time until the queue ahead has drained, from the average request duration
+        return self.average_duration * (self.waiting + 1) / self.max_running
+
+    def acquire(self) -> None:
+        """Raises:
+            LimitError: 503 if the queue is full or no slot frees up in time
+        """
+        if self._slots.acquire(blocking=False):
+            return
+        with self._lock:
+            if self.waiting >= self.max_waiting:
+                raise self.overloaded()
+            self.waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=self.wait_seconds)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if not acquired:
+            raise self.overloaded()
+
+    def release(self, duration: Optional[float] = None) -> None:
+        """Frees the slot, `duration` is how long the request held it."""
+        if duration is not None:
+            with self._lock:
+                self.average_duration = 0.8 * self.average_duration + 0.2 * duration
+        self._slots.release()
+
+    def overloaded(self) -> LimitError:
+        return LimitError(
+            {"code": "overloaded", "description": "Too many concurrent requests, try again later."},
+            503,
+            self.retry_after(),
+        )
+
+
+rate_limiter = RateLimiter(RATE_LIMITS)
+concurrency_limiters = {
+    name: ConcurrencyLimiter(max_running, max_waiting)
+    for name, (max_running, max_waiting) in CONCURRENCY_LIMITS.items()
+}
+expensive_threads = ConcurrencyLimiter(EXPENSIVE_THREADS, 0)
+
+
+def limit_concurrency(name: str):
+    """Admits the view through the concurrency limiter of `name`, if it has one.
+    A streamed response keeps its slot until the stream is closed.
+    """
+
+    def limit_concurrency_decorator(f):
+        limiter = concurrency_limiters.get(name)
+        if limiter is None:
+            return f
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            expensive_threads.acquire()
+            try:
+                limiter.acquire()
+            except LimitError:
+                expensive_threads.release()
+                raise
+            start = time.monotonic()
+
+            def release():
+                duration = time.monotonic() - start
+                limiter.release(duration)
+                expensive_threads.release(duration)
+
+            try:
+                response = f(*args, **kwargs)
+            except BaseException:
+                release()
+                raise
+            if isinstance(response, Response) and response.is_streamed:
+                response.call_on_close(release)
+            else:
+                release()
+            return response
+
+        return wrapper
+
+    return limit_concurrency_decorator
@@ -0,0 +1,621 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from flask import Flask
+from sqlalchemy import text
+from models import db, Stock, Indicator
+from stock_utils.alertEngine import AlertEngine, AlertNotifier, ThresholdRule
+
+
+def create_bench_app():
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    return app
+
+
+def use_sqlite_file(app, database_file):
+    # flask_sqlalchemy 2.4 cannot rewrite file URLs with SQLAlchemy 1.4, so the
+    # file is opened through a creator behind a plain "sqlite://" URL
+    import sqlite3
+    from sqlalchemy.pool import QueuePool
+
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "creator": lambda: sqlite3.connect(database_file, check_same_thread=False),
+        "poolclass": QueuePool,
+    }
+
+
+def create_bench_server_app():
+    """App factory for gunicorn in bench_wsgi_throughput, with routes but no auth."""
+    from config import configure_database
+    from routes import register_routes
+
+    app = Flask(__name__)
+    configure_database(app, "sqlite://")
+    use_sqlite_file(app, os.environ["BENCH_DATABASE_FILE"])
+    register_routes(app)
+    return app
+
+
+def fill_universe(n_symbols, rng):
+    """Adds n_symbols stocks with a handful of numeric and text indicators each."""
+    sectors = ["TECHNOLOGY", "ENERGY", "FINANCE", "HEALTHCARE", "INDUSTRIALS"]
+    for i in range(n_symbols):
+        stock = Stock(symbol=f"S{i}", current_price=rng.uniform(5.0, 500.0))
+        db.session.add(stock)
+        values = {
+            "PERatio": f"{rng.uniform(3.0, 80.0):.2f}",
+            "PEGRatio": f"{rng.uniform(0.1, 5.0):.2f}",
+            "MarketCapitalization": str(int(rng.uniform(1e8, 3e12))),
+            "Beta": f"{rng.uniform(0.2, 2.5):.3f}",
+            "DividendYield": f"{rng.uniform(0.0, 0.08):.4f}",
+            "EPS": f"{rng.uniform(-5.0, 20.0):.2f}",
+            "BookValue": f"{rng.uniform(1.0, 100.0):.2f}",
+            "RevenuePerShareTTM": f"{rng.uniform(1.0, 200.0):.2f}",
+            "SharesOutstanding": str(int(rng.uniform(1e7, 1e10))),
+            "Sector": rng.choice(sectors),
+        }
+        for indicator_type, value in values.items():
+            db.session.add(
+                Indicator(
+                    stock=stock,
+                    indicator_type=indicator_type,
+                    value=value,
+                    latest_trading_day="2024-01-01",
+                )
+            )
+    db.session.commit()
+    # Collect planner statistics, as autovacuum would on PostgreSQL
+    db.session.execute(text("ANALYZE"))
+
+
+class CountingNotifier(AlertNotifier):
+    def __init__(self):
+        self.count = 0
+
+    def notify(self, event):
+        self.count += 1
+
+
+def bench_alert_engine(n_rules=100_000, n_symbols=1_000, n_updates=200_000):
+    """100k price rules spread over 1k symbols, fed with a random walk of prices."""
+    rng = random.Random(42)
+    symbols = [f"SYM{i}" for i in range(n_symbols)]
+    prices = {symbol: 100.0 for symbol in symbols}
+
+    notifier = CountingNotifier()
+    engine = AlertEngine(notifier)
+
+    start = time.perf_counter()
+    for rule_id in range(n_rules):
+        engine.add_rule(
+            ThresholdRule(
+                rule_id=rule_id,
+                symbol=rng.choice(symbols),
+                indicator_type="current_price",
+                operator=rng.choice((">", "<")),
+                threshold=rng.uniform(50.0, 150.0),
+                hysteresis=rng.uniform(0.0, 2.0),
+            )
+        )
+    load_seconds = time.perf_counter() - start
+
+    updates = []
+    for _ in range(n_updates):
+        symbol = rng.choice(symbols)
+        prices[symbol] *= 1.0 + rng.gauss(0.0, 0.01)
+        updates.append((symbol, prices[symbol]))
+
+    start = time.perf_counter()
+    for symbol, price in updates:
+        engine.update(symbol, "current_price", price)
+    update_seconds = time.perf_counter() - start
+
+    print(
+        f"alert engine: {n_rules} rules loaded in {load_seconds:.2f}s, "
+        f"{n_updates / update_seconds:,.0f} updates/s, {notifier.count} alerts fired"
+    )
+
+
+def bench_screener(n_symbols=5_000, repeat=20):
+    """Screener query over a 5k symbol universe with 10 indicators per symbol."""
+    from screener import screen_stocks
+
+    app = create_bench_app()
+    with app.app_context():
+        db.create_all()
+        fill_universe(n_symbols, random.Random(7))
+
+        expression = "PERatio<30 AND Sector=TECHNOLOGY AND MarketCapitalization>1e11"
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = screen_stocks(expression, sort="-MarketCapitalization", limit=50)
+        elapsed = (time.perf_counter() - start) / repeat
+
+        print(
+            f"screener: {n_symbols} symbols, {result['total']} matches, "
+            f"{elapsed * 1000:.1f} ms per query"
+        )
+        db.session.remove()
+        db.drop_all()
+
+
+class StubAlphaVantageHandler(BaseHTTPRequestHandler):
+    """Answers OVERVIEW and GLOBAL_QUOTE like Alpha Vantage after a fixed latency."""
+
+    latency = 0.05
+
+    def do_GET(self):
+        from stock_utils.dataFetcher import get_market_reference_date
+
+        time.sleep(self.latency)
+        params = parse_qs(urlparse(self.path).query)
+        symbol = params["symbol"][0]
+        if params["function"][0] == "GLOBAL_QUOTE":
+            data = {"Global Quote": {"01. symbol": symbol, "07. latest trading day": get_market_reference_date()}}
+        else:
+            data = {"Symbol": symbol, "PERatio": "25.1", "PEGRatio": "1.3", "200DayMovingAverage": "120.5"}
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    # The default listen backlog of 5 drops concurrent connects and adds 1s retries
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def start_stub_server():
+    server = StubServer(("127.0.0.1", 0), StubAlphaVantageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_async_fetch(n_symbols=20, indicators=("PERatio", "PEGRatio", "200DayMovingAverage")):
+    """symbol x indicator fan-out against a local Alpha Vantage stub with 50 ms latency."""
+    from stock_utils import dataFetcher
+    from stock_utils.asyncFetcher import AsyncFetchEngine
+
+    server = start_stub_server()
+    dataFetcher.RAPIDAPI_BASE_URL = f"http://127.0.0.1:{server.server_port}/query"
+    pairs = [(f"S{i}", indicator) for i in range(n_symbols) for indicator in indicators]
+
+    dataFetcher.indicatorDataSet.clear()
+    start = time.perf_counter()
+    for symbol, indicator in pairs:
+        dataFetcher.get_fundamental_data(symbol, indicator)
+    sequential_seconds = time.perf_counter() - start
+
+    dataFetcher.indicatorDataSet.clear()
+    engine = AsyncFetchEngine(max_concurrency=n_symbols)
+    start = time.perf_counter()
+    results = engine.fetch_fundamentals(pairs)
+    concurrent_seconds = time.perf_counter() - start
+    server.shutdown()
+
+    failed = sum(1 for result in results.values() if not result.is_success)
+    print(
+        f"async fetch: {len(pairs)} pairs, sequential {sequential_seconds:.2f}s, "
+        f"fetch engine {concurrent_seconds:.2f}s, {failed} failed"
+    )
+
+
+def bench_wsgi_throughput(workers=1, threads=4, clients=32, seconds=5.0, n_symbols=500):
+    """GET /stocks/<symbol> through gunicorn with gunicorn.conf.py on a SQLite file."""
+    import requests
+    from config import rebuild_stock_snapshots
+
+    database_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+    app = create_bench_app()
+    use_sqlite_file(app, database_file)
+    with app.app_context():
+        db.create_all()
+        fill_universe(n_symbols, random.Random(3))
+        rebuild_stock_snapshots()
+        db.session.remove()
+
+    port = 5099
+    env = dict(
+        os.environ,
+        BENCH_DATABASE_FILE=database_file,
+        PORT=str(port),
+        WEB_WORKERS=str(workers),
+        WEB_THREADS=str(threads),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--access-logfile", os.devnull,
+         "benchmark:create_bench_server_app()"],
+        env=env,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(100):
+            try:
+                requests.get(f"{base_url}/stocks", timeout=1)
+                break
+            except requests.exceptions.ConnectionError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError("gunicorn did not start.")
+
+        stop_at = time.perf_counter() + seconds
+
+        def client(seed):
+            rng = random.Random(seed)
+            session = requests.Session()
+            count = 0
+            while time.perf_counter() < stop_at:
+                session.get(f"{base_url}/stocks/S{rng.randrange(n_symbols)}").raise_for_status()
+                count += 1
+            return count
+
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            total = sum(executor.map(client, range(clients)))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(
+        f"wsgi: gunicorn {workers} workers x {threads} threads, {clients} clients, "
+        f"{total / seconds:,.0f} requests/s"
+    )
+
+
+def bench_portfolio_valuation(n_portfolios=1_000, n_holdings=500, n_symbols=2_000):
+    """Values 1,000 portfolios x 500 holdings in one call."""
+    from models import Portfolio, Position
+    from portfolio import value_portfolios
+
+    rng = random.Random(11)
+    app = create_bench_app()
+    with app.app_context():
+        db.create_all()
+        fill_universe(n_symbols, rng)
+        db.session.execute(
+            Portfolio.__table__.insert(),
+            [{"id": i + 1, "name": f"P{i}"} for i in range(n_portfolios)],
+        )
+        db.session.execute(
+            Position.__table__.insert(),
+            [
+                {
+                    "portfolio_id": i + 1,
+                    "stock_id": stock_id,
+                    "quantity": rng.randint(1, 1000),
+                    "cost_basis": rng.uniform(5.0, 500.0),
+                }
+                for i in range(n_portfolios)
+                for stock_id in rng.sample(range(1, n_symbols + 1), n_holdings)
+            ],
+        )
+        db.session.commit()
+
+        start = time.perf_counter()
+        result = value_portfolios()
+        elapsed = time.perf_counter() - start
+
+        print(
+            f"portfolio valuation: {len(result['portfolios'])} portfolios x {n_holdings} holdings "
+            f"in {elapsed * 1000:.0f} ms"
+        )
+        db.session.remove()
+        db.drop_all()
+
+
+def bench_analytics(n_symbols=1_000, n_days=252, repeat=5):
+    """Correlation matrix of 1,000 symbols over a year of daily bars, cold and cached."""
+    import analytics
+    from models import PriceBar
+
+    rng = random.Random(5)
+    app = create_bench_app()
+    with app.app_context():
+        db.create_all()
+        fill_universe(n_symbols, rng)
+        dates = [f"{2023 + day // 300}-{day // 25 % 12 + 1:02d}-{day % 25 + 1:02d}" for day in range(n_days)]
+        bars = []
+        for stock_id in range(1, n_symbols + 1):
+            close = rng.uniform(5.0, 500.0)
+            for date in dates:
+                close *= 1.0 + rng.gauss(0.0, 0.02)
+                bars.append({"stock_id": stock_id, "date": date, "close": close})
+        db.session.execute(PriceBar.__table__.insert(), bars)
+        analytics.invalidate_price_matrix_on_commit()
+        db.session.commit()
+
+        start = time.perf_counter()
+        analytics.correlation(window=n_days - 1)
+        cold_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            analytics.correlation(window=n_days - 1)
+        cached_seconds = (time.perf_counter() - start) / repeat
+
+        print(
+            f"analytics: {n_symbols} x {n_days} correlation, cold {cold_seconds * 1000:.0f} ms, "
+            f"cached matrix {cached_seconds * 1000:.0f} ms"
+        )
+        db.session.remove()
+        db.drop_all()
+
+
+def bench_export(n_symbols=20_000):
+    """Streams 200k indicator rows through GET /export in every format."""
+    import tracemalloc
+    from routes import register_routes
+
+    app = create_bench_app()
+    register_routes(app)
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        fill_universe(n_symbols, random.Random(13))
+
+    def stream(export_format):
+        start = time.perf_counter()
+        response = client.get("/export", query_string={"format": export_format}, buffered=False)
+        chunks = iter(response.response)
+        size = len(next(chunks))
+        first_chunk_seconds = time.perf_counter() - start
+        for chunk in chunks:
+            size += len(chunk)
+        response.close()
+        return size, first_chunk_seconds, time.perf_counter() - start
+
+    for export_format in ("csv", "ndjson", "parquet"):
+        size, first_chunk_seconds, elapsed = stream(export_format)
+        # Second pass only to measure memory, tracemalloc slows the export down
+        tracemalloc.start()
+        stream(export_format)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(
+            f"export {export_format}: {n_symbols * 10} rows, {size / 1e6:.1f} MB, first chunk after "
+            f"{first_chunk_seconds * 1000:.0f} ms, total {elapsed:.2f}s, peak {peak / 1e6:.1f} MB traced"
+        )
+
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def bench_intraday(n_symbols=500, n_days=5, repeat=1_000):
+    """One minute bars of 500 symbols over a week, fetched in overlapping batches of 100."""
+    import numpy as np
+    from stock_utils.barStore import IntradayBarStore
+
+    rng = np.random.default_rng(17)
+    store = IntradayBarStore(directory=tempfile.mkdtemp())
+    # 390 bars per session from 09:30, exchange local seconds
+    session = np.arange(390) * 60 + 9 * 3600 + 30 * 60
+    ts = np.concatenate([19_723 * 86400 + day * 86400 + session for day in range(n_days)])
+    symbols = [f"S{i}" for i in range(n_symbols)]
+
+    start = time.perf_counter()
+    for symbol in symbols:
+        close = 100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.001, len(ts))))
+        values = np.vstack([close, close * 1.001, close * 0.999, close, rng.integers(100, 10_000, len(ts))])
+        for batch_start in range(0, len(ts), 80):
+            batch = slice(batch_start, batch_start + 100)
+            store.ingest(symbol, ts[batch], values[:, batch])
+    ingest_seconds = time.perf_counter() - start
+
+    timings = {}
+    for interval in ("5m", "1h"):
+        start = time.perf_counter()
+        for i in range(repeat):
+            store.bars(symbols[i % n_symbols], interval)
+        timings[interval] = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for i in range(repeat):
+        store.session(symbols[i % n_symbols]).vwap()
+    timings["vwap"] = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    store.save_all()
+    IntradayBarStore(directory=store.directory).load_all()
+    persist_seconds = time.perf_counter() - start
+
+    print(
+        f"intraday: {n_symbols} symbols x {len(ts)} bars ingested in {ingest_seconds:.2f}s, "
+        + ", ".join(f"{name} {seconds * 1e6:.0f} us" for name, seconds in timings.items())
+        + f", save and load {persist_seconds:.2f}s"
+    )
+
+
+def bench_symbol_directory(n_symbols=12_000, repeat=100_000):
+    """Validation and prefix search over a listing of 12k symbols."""
+    import io
+    import string
+    from stock_utils.symbolDirectory import SymbolDirectory
+
+    rng = random.Random(19)
+    symbols = {"".join(rng.choices(string.ascii_uppercase, k=rng.randint(1, 5))) for _ in range(n_symbols)}
+    listing = "symbol,name,exchange,assetType,ipoDate,delistingDate,status\n" + "".join(
+        f"{symbol},{symbol} Corp,NYSE,Stock,2000-01-01,null,Active\n" for symbol in symbols
+    )
+    directory = SymbolDirectory()
+    directory._loaded_file = True
+    start = time.perf_counter()
+    directory.load(io.StringIO(listing))
+    load_seconds = time.perf_counter() - start
+
+    queries = [rng.choice(string.ascii_uppercase) + rng.choice(string.ascii_uppercase) for _ in range(repeat)]
+    start = time.perf_counter()
+    for query in queries:
+        directory.rejection(query)
+    validate_seconds = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for query in queries:
+        directory.search(query[0], 10)
+    search_seconds = (time.perf_counter() - start) / repeat
+
+    print(
+        f"symbol directory: {len(symbols)} symbols loaded in {load_seconds * 1000:.0f} ms, "
+        f"validation {validate_seconds * 1e6:.1f} us, prefix search {search_seconds * 1e6:.1f} us"
+    )
+
+
+def bench_change_feed(n_symbols=2_000, n_changes=100, n_log=100_000):
+    """Client sync after 100 price changes: full re-download versus the change feed."""
+    from config import compact_change_log, rebuild_stock_snapshots
+    from models import ChangeLog
+    from routes import register_routes
+
+    rng = random.Random(23)
+    app = create_bench_app()
+    register_routes(app)
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        fill_universe(n_symbols, rng)
+        rebuild_stock_snapshots()
+    since = client.get("/changes").get_json()["next"]
+    for _ in range(n_changes):
+        client.patch(f"/stocks/S{rng.randrange(n_symbols)}", json={"current_price": rng.uniform(5.0, 500.0)})
+
+    start = time.perf_counter()
+    for symbol in client.get("/stocks").get_json():
+        client.get(f"/stocks/{symbol}")
+    full_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    page = client.get("/changes", query_string={"since": since}).get_json()
+    feed_seconds = time.perf_counter() - start
+
+    with app.app_context():
+        db.session.execute(
+            ChangeLog.__table__.insert(),
+            [
+                {"action": "stock_repriced", "symbol": f"S{rng.randrange(n_symbols)}", "value": "1.0",
+                 "changed_at": datetime.utcnow()}
+                for _ in range(n_log)
+            ],
+        )
+        start = time.perf_counter()
+        removed = compact_change_log(n_log)
+        db.session.commit()
+        compact_seconds = time.perf_counter() - start
+        db.session.remove()
+        db.drop_all()
+
+    print(
+        f"change feed: {n_symbols} symbols, full sync {full_seconds:.2f}s, "
+        f"{len(page['changes'])} changes via feed {feed_seconds * 1000:.1f} ms, "
+        f"compacting {n_log} entries removed {removed} in {compact_seconds:.2f}s"
+    )
+
+
+def bench_derived_ratios(n_symbols=5_000):
+    """Reprices 5k stocks and recomputes PERatio, MarketCapitalization etc. for all of them."""
+    from config import apply_derived_ratios, rebuild_stock_snapshots
+
+    rng = random.Random(29)
+    app = create_bench_app()
+    with app.app_context():
+        db.create_all()
+        fill_universe(n_symbols, rng)
+        rebuild_stock_snapshots()
+        db.session.execute(
+            Stock.__table__.update().values(current_price=Stock.current_price * 1.01)
+        )
+
+        start = time.perf_counter()
+        changes = apply_derived_ratios()
+        db.session.commit()
+        elapsed = time.perf_counter() - start
+
+        print(
+            f"derived ratios: {n_symbols} stocks repriced, {len(changes)} ratios updated "
+            f"in {elapsed * 1000:.0f} ms"
+        )
+        db.session.remove()
+        db.drop_all()
+
+
+def bench_admission_control(threads=4, abusive_requests=40, cheap_requests=200, work_seconds=0.2):
+    """Latency of a cheap route while one client floods an expensive route, on a pool of
+    `threads` request threads like one gunicorn worker, with and without admission control."""
+    from flask import jsonify
+    from authentication import limits
+    from authentication.limits import ConcurrencyLimiter, LimitError, limit_concurrency
+    from routes import handle_limit_error
+
+    def expensive():
+        time.sleep(work_seconds)
+        return jsonify({"message": "done"})
+
+    def cheap():
+        return jsonify({"message": "ok"})
+
+    for admission in (False, True):
+        limits.expensive_threads = ConcurrencyLimiter(threads - 1, 0)
+        limits.concurrency_limiters["bench_expensive"] = ConcurrencyLimiter(2, 1, wait_seconds=work_seconds)
+        app = Flask(__name__)
+        app.register_error_handler(LimitError, handle_limit_error)
+        view = limit_concurrency("bench_expensive")(expensive) if admission else expensive
+        app.route("/expensive")(view)
+        app.route("/cheap")(cheap)
+        client = app.test_client()
+
+        def timed_get(path):
+            submitted = time.perf_counter()
+
+            def run():
+                status = client.get(path).status_code
+                return status, time.perf_counter() - submitted
+
+            return run
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            abusive = [pool.submit(timed_get("/expensive")) for _ in range(abusive_requests)]
+            cheap_calls = []
+            for _ in range(cheap_requests):
+                cheap_calls.append(pool.submit(timed_get("/cheap")))
+                time.sleep(0.002)
+            cheap_latencies = sorted(future.result()[1] for future in cheap_calls)
+            statuses = [future.result()[0] for future in abusive]
+
+        print(
+            f"admission control {'on' if admission else 'off'}: cheap route "
+            f"p50 {cheap_latencies[len(cheap_latencies) // 2] * 1000:.1f} ms, "
+            f"p99 {cheap_latencies[int(len(cheap_latencies) * 0.99)] * 1000:.1f} ms; "
+            f"expensive route {statuses.count(200)} served, {statuses.count(503)} rejected"
+        )
+        del limits.concurrency_limiters["bench_expensive"]
+    limits.expensive_threads = ConcurrencyLimiter(limits.EXPENSIVE_THREADS, 0)
+
+
+if __name__ == "__main__":
+    bench_alert_engine()
+    bench_screener()
+    bench_async_fetch()
+    bench_wsgi_throughput()
+    bench_portfolio_valuation()
+    bench_analytics()
+    bench_export()
+    bench_intraday()
+    bench_symbol_directory()
+    bench_change_feed()
+    bench_derived_ratios()
+    bench_admission_control()
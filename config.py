@@ -1,10 +1,31 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from dotenv import load_dotenv
+from datetime import datetime, timedelta
 import os
-from stock_utils.priceFetcher import get_stock_price
-from stock_utils.dataFetcher import get_fundamental_data
-from models import db, Stock, Indicator
+import threading
+import pytz
+from stock_utils.marketData import market_data
+from stock_utils.asyncFetcher import fetch_engine
+from stock_utils.dataFetcher import StockFundamentals, StockPriceResult
+from stock_utils.alertEngine import alert_engine, ThresholdRule, PRICE_INDICATOR
+from stock_utils.barStore import intraday_store
+from models import (
+    db,
+    Stock,
+    Indicator,
+    AlertRule,
+    StockSnapshot,
+    Portfolio,
+    Position,
+    PriceBar,
+    ChangeLog,
+)
+from sqlalchemy import case, delete, event, func, select, text
+from sqlalchemy.orm import Session, aliased
+from stock_utils.priceFetcher import PriceHistoryResult
+import analytics
+from ratios import refresh_derived_ratios
 
 load_dotenv()
 
@@ -16,40 +37,342 @@ database_path = (
     f"postgresql://{database_user}:{database_password}@{database_host}/{database_name}"
 )
 
-app = Flask(__name__)
+# Concurrency of one server process, see gunicorn.conf.py
+web_threads = int(os.getenv("WEB_THREADS", "4"))
+
+
+def engine_options(database_uri: str) -> dict:
+    """Connection pool settings sized for the request threads of one worker process."""
+    if database_uri.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": web_threads,  # one connection per request thread
+        "max_overflow": max(2, web_threads // 2),  # headroom for background writers
+        "pool_timeout": 10,  # fail fast instead of queueing behind a stuck request
+        "pool_pre_ping": True,  # drop connections the server closed meanwhile
+        "pool_recycle": 1800,  # recycle before idle timeouts of managed databases
+    }
+
 
-app.config["SQLALCHEMY_DATABASE_URI"] = database_path
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+def configure_database(app: Flask, database_uri: str = database_path) -> None:
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_uri)
 
-# Initialize SQLAlchemy
-db.init_app(app)
+    # Initialize SQLAlchemy
+    db.init_app(app)
 
-def setup_db():
+
+def setup_db(app: Flask):
     with app.app_context():
         db.drop_all()  # Drop all tables
         db.create_all()  # Create all tables
+        load_alert_rules()  # restore the in-memory alert index
         initialize_sample_data()  # add dummy stock data
+        # Close pooled connections so that forked server workers open their own
+        db.session.remove()
+        db.engine.dispose()
+
+
+# Every this many changes, entries older than the latest CHANGE_LOG_RETENTION are compacted
+CHANGE_LOG_RETENTION = int(os.getenv("CHANGE_LOG_RETENTION", "100000"))
+CHANGE_LOG_COMPACT_EVERY = 1000
+# Rows per multi-row INSERT ... RETURNING
+CHANGE_LOG_INSERT_BATCH = 500
+CHANGE_LOG_LOCK_ID = 0x5EC0C4A6
+
+
+def record_change(action: str, symbol: str, indicator_type: str = None, value=None) -> None:
+    """Appends a change log entry. The caller commits, so the entry is committed
+    together with the change it describes.
+    """
+    record_changes([(action, symbol, indicator_type, value)])
+
+
+def record_changes(changes: list) -> None:
+    """Appends (action, symbol, indicator_type, value) entries, taking the last seq from
+    the INSERT itself. The caller commits. When the entries cross a CHANGE_LOG_COMPACT_EVERY boundary, the
+    log is compacted in the background once the caller's transaction has committed.
+    """
+    if not changes:
+        return
+    if db.engine.dialect.name == "postgresql":
+        # Serialize writers until commit, so sequence numbers become visible in order
+        # and a client reading since=<seq> never skips a later committed lower seq
+        db.session.execute(
+            text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": CHANGE_LOG_LOCK_ID}
+        )
+    rows = [
+        {
+            "action": action,
+            "symbol": symbol,
+            "indicator_type": indicator_type,
+            "value": None if value is None else str(value),
+        }
+        for action, symbol, indicator_type, value in changes
+    ]
+    if db.engine.dialect.full_returning:
+        last_seq = 0
+        for start in range(0, len(rows), CHANGE_LOG_INSERT_BATCH):
+            insert = ChangeLog.__table__.insert().values(rows[start : start + CHANGE_LOG_INSERT_BATCH])
+            last_seq = max(seq for (seq,) in db.session.execute(insert.returning(ChangeLog.seq)))
+    else:
+        # SQLite has no RETURNING here, but knows the rowid it inserted last on this connection
+        db.session.execute(ChangeLog.__table__.insert(), rows)
+        last_seq = db.session.execute(text("SELECT last_insert_rowid()")).scalar()
+    if last_seq // CHANGE_LOG_COMPACT_EVERY > (last_seq - len(changes)) // CHANGE_LOG_COMPACT_EVERY:
+        db.session.info["compact_change_log_before"] = last_seq - CHANGE_LOG_RETENTION
+
+
+@event.listens_for(Session, "after_commit")
+def _compact_change_log_after_commit(session) -> None:
+    before_seq = session.info.pop("compact_change_log_before", None)
+    if before_seq is not None and before_seq > 0:
+        threading.Thread(
+            target=compact_change_log_in_background,
+            args=(session.get_bind(), before_seq),
+            daemon=True,
+        ).start()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_compaction_after_rollback(session) -> None:
+    session.info.pop("compact_change_log_before", None)
+
+
+def compact_change_log_in_background(engine, before_seq: int) -> None:
+    """Compacts in its own transaction, outside the request that crossed the boundary and
+    without the writer lock: only entries well behind the head are deleted."""
+    try:
+        with engine.begin() as connection:
+            removed = compact_change_log(before_seq, connection)
+        print(f"{removed} change log entries up to seq {before_seq} compacted.")
+    except Exception as e:
+        print(f"Error while compacting the change log: {e}")
+
+
+def compact_change_log(before_seq: int, connection=None) -> int:
+    """Deletes the entries up to before_seq that a later entry supersedes, so a client
+    syncing from any seq still ends up with the same state. Runs on the given
+    connection, or else in the session, whose caller commits.
+
+    Everything of a stock before its latest deletion is superseded by the deletion,
+    which is kept as a tombstone. Of the rest, the latest entry per indicator is kept,
+    and per stock the latest stock_added next to the latest repricing, so a client
+    resuming from a compacted position still learns that the stock exists.
+    """
+    if before_seq <= 0:
+        return 0
+    execute = connection.execute if connection is not None else db.session.execute
+    deletion = aliased(ChangeLog)
+    deleted_seq = (
+        select(func.max(deletion.seq))
+        .where(
+            deletion.seq <= before_seq,
+            deletion.action == "stock_deleted",
+            deletion.symbol == ChangeLog.symbol,
+        )
+        .scalar_subquery()
+    )
+    removed = execute(
+        delete(ChangeLog.__table__).where(ChangeLog.seq <= before_seq, ChangeLog.seq < deleted_seq)
+    ).rowcount
+
+    lifecycle = case(
+        (ChangeLog.action.in_(["stock_added", "stock_deleted"]), ChangeLog.action), else_=None
+    )
+    latest = (
+        select(func.max(ChangeLog.seq))
+        .where(ChangeLog.seq <= before_seq)
+        .group_by(ChangeLog.symbol, ChangeLog.indicator_type, lifecycle)
+    )
+    return removed + execute(
+        delete(ChangeLog.__table__).where(ChangeLog.seq <= before_seq, ChangeLog.seq.not_in(latest))
+    ).rowcount
 
 
-def add_stock_to_database(symbol: str) -> Stock:
-    current_price = get_stock_price(symbol)
-    if current_price is None:
-        print(f"Error: Could not retrieve price for {symbol}.")
+def get_changes(since: int = 0, limit: int = 500) -> list:
+    return (
+        ChangeLog.query.filter(ChangeLog.seq > since)
+        .order_by(ChangeLog.seq)
+        .limit(limit)
+        .all()
+    )
+
+
+def apply_derived_ratios(stock_ids=None) -> list:
+    """Recomputes the derived ratios of the given stocks (all if None) from their current
+    prices and logs the changed ones. The caller commits and then passes the returned
+    changes to notify_indicator_changes.
+    """
+    changes = refresh_derived_ratios(stock_ids)
+    record_changes(
+        [("indicator_upserted", symbol, indicator_type, value) for symbol, indicator_type, value in changes]
+    )
+    return changes
+
+
+def notify_indicator_changes(changes: list) -> None:
+    for symbol, indicator_type, value in changes:
+        alert_engine.update(symbol, indicator_type, value)
+
+
+def add_stock_to_database(symbol: str, price_result: StockPriceResult = None) -> Stock:
+    if price_result is None:
+        price_result = market_data.get_price(symbol)
+    if not price_result.is_success:
+        print(f"Error: Could not retrieve price for {symbol}. {price_result.error_message}")
         return None
+    current_price = price_result.price
 
     stock = Stock(symbol=symbol, current_price=current_price)
     try:
         db.session.add(stock)
-        db.session.commit()  # Commit to generate an ID for the stock
+        db.session.flush()  # Flush to generate an ID for the stock
+        upsert_stock_snapshot(stock)
+        record_price_bar(stock)
+        record_change("stock_added", symbol, value=current_price)
+        db.session.commit()
         print(f"Stock {symbol} added to database with ID {stock.id}.")
+        alert_engine.update(symbol, PRICE_INDICATOR, current_price)
         return stock
     except Exception as e:
         print(f"Error while adding stock to database: {e}")
         db.session.rollback()
         return None
 
-def add_indicator_to_stock(stock: Stock, indicator_type: str) -> Indicator:
-    fundamental_data_result = get_fundamental_data(stock.symbol, indicator_type)
+def last_session_date() -> str:
+    """Today in exchange time, or the Friday before on a weekend (holidays are not known)."""
+    today = datetime.now(pytz.timezone("US/Eastern"))
+    if today.weekday() >= 5:
+        today -= timedelta(days=today.weekday() - 4)
+    return today.strftime("%Y-%m-%d")
+
+
+def record_price_bar(stock: Stock) -> PriceBar:
+    """Folds the current price of a stock into the daily bar of the latest session, so
+    a price written on a weekend does not add a bar (and a NaN column for every other
+    stock) on a day without trading. The caller commits.
+    """
+    date = last_session_date()
+    price = stock.current_price
+    bar = PriceBar.query.filter_by(stock_id=stock.id, date=date).first()
+    if bar is None:
+        bar = PriceBar(stock_id=stock.id, date=date, open=price, high=price, low=price)
+        db.session.add(bar)
+    bar.high = max(bar.high if bar.high is not None else price, price)
+    bar.low = min(bar.low if bar.low is not None else price, price)
+    bar.close = price
+    analytics.invalidate_price_matrix_on_commit()
+    return bar
+
+
+def add_price_history_to_stock(
+    stock: Stock, history_result: PriceHistoryResult = None, period: str = "1y"
+) -> int:
+    """Stores daily bars of a stock, skipping dates that already have a bar."""
+    if history_result is None:
+        history_result = market_data.get_price_history(stock.symbol, period)
+    if not history_result.is_success:
+        print(history_result.error_message)
+        return 0
+
+    known_dates = {
+        date for (date,) in db.session.query(PriceBar.date).filter_by(stock_id=stock.id)
+    }
+    bars = [
+        PriceBar(
+            stock_id=stock.id,
+            date=date,
+            open=open_price,
+            high=high,
+            low=low,
+            close=close,
+            volume=volume,
+        )
+        for date, open_price, high, low, close, volume in history_result.bars
+        if date not in known_dates
+    ]
+
+    try:
+        db.session.add_all(bars)
+        analytics.invalidate_price_matrix_on_commit()
+        db.session.commit()
+        print(f"{len(bars)} price bars added to database for stock ID {stock.id}.")
+        return len(bars)
+    except Exception as e:
+        print(f"Error while adding price history to database: {e}")
+        db.session.rollback()
+        return 0
+
+
+def refresh_intraday_bars(symbol: str) -> None:
+    """Adds today's one minute bars of a symbol from yfinance to the intraday store, at
+    most once per INTRADAY_REFRESH_SECONDS. A failed fetch or ingest keeps the stored bars.
+    """
+    if not intraday_store.claim_fetch(symbol):
+        return
+    history_result = market_data.get_intraday_history(symbol)
+    if not history_result.is_success:
+        print(history_result.error_message)
+        return
+    try:
+        intraday_store.ingest_rows(symbol, history_result.bars)
+    except (TypeError, ValueError, OSError) as e:
+        print(f"Error while storing intraday bars of {symbol}: {e}")
+
+
+def upsert_stock_snapshot(stock: Stock) -> StockSnapshot:
+    """Creates or refreshes the snapshot row of a stock. The caller commits."""
+    snapshot = StockSnapshot.query.get(stock.id)
+    if snapshot is None:
+        snapshot = StockSnapshot(stock_id=stock.id, indicator_values={})
+        db.session.add(snapshot)
+    snapshot.symbol = stock.symbol
+    snapshot.current_price = stock.current_price
+    return snapshot
+
+
+def set_snapshot_indicator(
+    stock: Stock, indicator_type: str, value: str, latest_trading_day: str
+) -> None:
+    """Writes one indicator value into the snapshot row of a stock. The caller commits."""
+    snapshot = upsert_stock_snapshot(stock)
+    # Assign a new dict so that SQLAlchemy detects the change of the JSON column
+    snapshot.indicator_values = {**snapshot.indicator_values, indicator_type: value}
+    snapshot.latest_trading_day = latest_trading_day
+
+
+def remove_snapshot_indicator(indicator_type: str) -> None:
+    """Drops an indicator type from all snapshot rows. The caller commits."""
+    for snapshot in StockSnapshot.query.all():
+        if indicator_type in snapshot.indicator_values:
+            snapshot.indicator_values = {
+                key: value
+                for key, value in snapshot.indicator_values.items()
+                if key != indicator_type
+            }
+
+
+def rebuild_stock_snapshots() -> int:
+    """Recomputes every snapshot row from the Stock and Indicator tables."""
+    StockSnapshot.query.delete()
+    stocks = Stock.query.all()
+    for stock in stocks:
+        upsert_stock_snapshot(stock)
+        for indicator in stock.indicators:
+            set_snapshot_indicator(
+                stock, indicator.indicator_type, indicator.value, indicator.latest_trading_day
+            )
+    db.session.commit()
+    return len(stocks)
+
+
+def add_indicator_to_stock(
+    stock: Stock, indicator_type: str, fundamental_data_result: StockFundamentals = None
+) -> Indicator:
+    if fundamental_data_result is None:
+        fundamental_data_result = market_data.get_fundamentals(stock.symbol, indicator_type)
     if fundamental_data_result.error_message is not None:
         print(fundamental_data_result.error_message)
         return None
@@ -64,25 +387,42 @@ def add_indicator_to_stock(stock: Stock, indicator_type: str) -> Indicator:
         print(f"Error: Time stamp for {latest_trading_day} is None.")
         return None
 
-    indicator = Indicator(
-        stock_id=stock.id,
-        indicator_type=indicator_type,
-        value=indicator_value,
-        latest_trading_day=latest_trading_day,
-    )
-
     try:
-        db.session.add(indicator)
+        # Upsert: a stock has one row per indicator type, refreshed in place
+        indicator = (
+            Indicator.query.filter_by(stock_id=stock.id, indicator_type=indicator_type)
+            .order_by(Indicator.id.desc())
+            .first()
+        )
+        if indicator is None:
+            indicator = Indicator(stock_id=stock.id, indicator_type=indicator_type)
+            db.session.add(indicator)
+        indicator.value = indicator_value
+        indicator.latest_trading_day = latest_trading_day
+        set_snapshot_indicator(stock, indicator_type, indicator_value, latest_trading_day)
+        record_change("indicator_upserted", stock.symbol, indicator_type, indicator_value)
         db.session.commit()
         print(
-            f"Indicator {indicator_type} added to database for stock ID {stock.id}."
+            f"Indicator {indicator_type} stored in database for stock ID {stock.id}."
         )
+        alert_engine.update(stock.symbol, indicator_type, indicator_value)
         return indicator
     except Exception as e:
         print(f"Error while adding indicator to database: {e}")
         db.session.rollback()
         return None
 
+def add_indicators_to_stock(stock: Stock, indicator_types) -> list:
+    """Adds several indicators to one stock, fetching them as one batch before writing."""
+    results = fetch_engine.fetch_fundamentals(
+        [(stock.symbol, indicator_type) for indicator_type in indicator_types]
+    )
+    return [
+        add_indicator_to_stock(stock, indicator_type, results[(stock.symbol, indicator_type)])
+        for indicator_type in indicator_types
+    ]
+
+
 def add_indicator_to_all_stocks(indicator_type: str) -> bool:
     try:
         stocks = Stock.query.all()
@@ -91,10 +431,15 @@ def add_indicator_to_all_stocks(indicator_type: str) -> bool:
             print("No stocks found in the database.")
             return False
 
-        # Iterate through each stock and add the indicator
+        # Fetch the indicator for all stocks concurrently, then write them one by one
+        results = fetch_engine.fetch_fundamentals(
+            [(stock.symbol, indicator_type) for stock in stocks]
+        )
         for stock in stocks:
             # Attempt to add the indicator to the current stock
-            if not add_indicator_to_stock(stock, indicator_type):
+            if not add_indicator_to_stock(
+                stock, indicator_type, results[(stock.symbol, indicator_type)]
+            ):
                 # If adding the indicator fails, log the error
                 print(f"Failed to add indicator {indicator_type} to stock {stock.symbol}.")
                 return False
@@ -108,15 +453,116 @@ def add_indicator_to_all_stocks(indicator_type: str) -> bool:
         return False
 
 
+def to_threshold_rule(alert_rule: AlertRule) -> ThresholdRule:
+    return ThresholdRule(
+        rule_id=alert_rule.id,
+        symbol=alert_rule.stock.symbol,
+        indicator_type=alert_rule.indicator_type,
+        operator=alert_rule.operator,
+        threshold=alert_rule.threshold,
+        hysteresis=alert_rule.hysteresis,
+    )
+
+
+def seed_alert_values(stock: Stock) -> None:
+    alert_engine.seed(stock.symbol, PRICE_INDICATOR, stock.current_price)
+    for indicator in stock.indicators:
+        alert_engine.seed(stock.symbol, indicator.indicator_type, indicator.value)
+
+
+def load_alert_rules() -> int:
+    """Rebuilds the in-memory alert index from the database. Rules that are already
+    satisfied are armed silently, so a restart does not repeat old alerts.
+    """
+    alert_engine.clear()
+    for stock in Stock.query.all():
+        seed_alert_values(stock)
+
+    alert_rules = AlertRule.query.all()
+    for alert_rule in alert_rules:
+        alert_engine.add_rule(to_threshold_rule(alert_rule), notify=False)
+    return len(alert_rules)
+
+
+def add_alert_rule_to_stock(
+    stock: Stock, indicator_type: str, operator: str, threshold: float, hysteresis: float = 0.0
+) -> AlertRule:
+    alert_rule = AlertRule(
+        stock_id=stock.id,
+        indicator_type=indicator_type,
+        operator=operator,
+        threshold=threshold,
+        hysteresis=hysteresis,
+    )
+
+    try:
+        db.session.add(alert_rule)
+        db.session.commit()
+        print(f"Alert rule {alert_rule.id} added to database for stock ID {stock.id}.")
+    except Exception as e:
+        print(f"Error while adding alert rule to database: {e}")
+        db.session.rollback()
+        return None
+
+    seed_alert_values(stock)
+    alert_engine.add_rule(to_threshold_rule(alert_rule))
+    return alert_rule
+
+
+def add_portfolio_to_database(name: str, positions: list) -> Portfolio:
+    """Adds a portfolio with positions given as dicts with symbol, quantity and cost_basis.
+    All symbols must already exist in the database.
+    """
+    symbols = {position["symbol"] for position in positions}
+    stocks = {stock.symbol: stock for stock in Stock.query.filter(Stock.symbol.in_(symbols))}
+    missing = symbols - set(stocks)
+    if missing:
+        print(f"Error: Stocks {', '.join(sorted(missing))} are not in the database.")
+        return None
+
+    portfolio = Portfolio(name=name)
+    try:
+        db.session.add(portfolio)
+        db.session.flush()  # Flush to generate an ID for the portfolio
+        db.session.add_all(
+            Position(
+                portfolio_id=portfolio.id,
+                stock_id=stocks[position["symbol"]].id,
+                quantity=float(position["quantity"]),
+                cost_basis=float(position["cost_basis"]),
+            )
+            for position in positions
+        )
+        db.session.commit()
+        print(f"Portfolio {name} added to database with ID {portfolio.id}.")
+        return portfolio
+    except Exception as e:
+        print(f"Error while adding portfolio to database: {e}")
+        db.session.rollback()
+        return None
+
+
 def initialize_sample_data() -> bool:
 
     symbols = ["NVDA", "AMD"]
     indicators = ["PERatio","PEGRatio", "200DayMovingAverage"]
 
+    # Fetch every price and every symbol x indicator pair concurrently up front
+    price_results = fetch_engine.fetch_prices(symbols)
+    history_results = fetch_engine.map(
+        market_data.get_price_history, [(symbol,) for symbol in symbols]
+    )
+    fundamental_results = fetch_engine.fetch_fundamentals(
+        [(symbol, indicator) for symbol in symbols for indicator in indicators]
+    )
+
     for symbol in symbols:
-        stock  = add_stock_to_database(symbol)
+        stock  = add_stock_to_database(symbol, price_results[symbol])
         if stock is None:
             return False
+        add_price_history_to_stock(stock, history_results[symbols.index(symbol)])
 
         for indicator in indicators:
-            indicator_return = add_indicator_to_stock(stock, indicator)
+            indicator_return = add_indicator_to_stock(
+                stock, indicator, fundamental_results[(symbol, indicator)]
+            )
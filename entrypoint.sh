@@ -12,5 +12,4 @@ done
 
 echo "PostgreSQL is up and running."
 
-FLASK_APP=app.py
-exec python app.py
+exec gunicorn -c gunicorn.conf.py "app:create_app()"
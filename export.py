@@ -0,0 +1,164 @@
+from typing import Iterator, List, Optional
+from datetime import datetime
+import csv
+import io
+import json
+from sqlalchemy import and_, select
+from models import db, Stock, Indicator
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+EXPORT_COLUMNS = [
+    "symbol",
+    "current_price",
+    "indicator_type",
+    "value",
+    "numeric_value",
+    "latest_trading_day",
+]
+EXPORT_CHUNK_SIZE = 5000
+
+
+def check_date(value: Optional[str], name: str) -> Optional[str]:
+    if value is None:
+        return None
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"'{name}' must be a date in the format YYYY-MM-DD.")
+    return value
+
+
+def export_query(
+    indicator_types: Optional[List[str]] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+):
+    """One row per stock and indicator. Without an indicator filter, stocks without
+    indicators are included with empty indicator columns.
+    """
+    conditions = [Indicator.stock_id == Stock.id]
+    if indicator_types:
+        conditions.append(Indicator.indicator_type.in_(indicator_types))
+    # Dates are stored as YYYY-MM-DD strings, so they compare in order
+    if since:
+        conditions.append(Indicator.latest_trading_day >= since)
+    if until:
+        conditions.append(Indicator.latest_trading_day <= until)
+
+    query = select(
+        Stock.symbol,
+        Stock.current_price,
+        Indicator.indicator_type,
+        Indicator.value,
+        Indicator.numeric_value,
+        Indicator.latest_trading_day,
+    )
+    if indicator_types or since or until:
+        query = query.join(Indicator, and_(*conditions))
+    else:
+        query = query.outerjoin(Indicator, and_(*conditions))
+    return query.order_by(Stock.id, Indicator.indicator_type)
+
+
+def iter_chunks(query, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[list]:
+    """Yields lists of rows from a server side cursor, so only one chunk is held
+    in memory at a time (psycopg2 uses a named cursor for stream_results).
+    """
+    connection = db.session.connection().execution_options(stream_results=True)
+    result = connection.execute(query)
+    try:
+        # Rows are passed on as they are: the streaming result already buffers the first
+        # rows of the cursor, so they cannot be read from the DBAPI cursor directly
+        for rows in result.partitions(chunk_size):
+            yield rows
+    finally:
+        result.close()
+
+
+def csv_stream(chunks: Iterator[list]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    for rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+def ndjson_stream(chunks: Iterator[list]) -> Iterator[str]:
+    encode = json.JSONEncoder().encode
+    for rows in chunks:
+        yield "".join(encode(dict(zip(EXPORT_COLUMNS, row))) + "\n" for row in rows)
+
+
+def parquet_stream(chunks: Iterator[list]) -> Iterator[bytes]:
+    """Writes every chunk as one Parquet row group and yields the bytes written so far."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [
+            ("symbol", pa.string()),
+            ("current_price", pa.float64()),
+            ("indicator_type", pa.string()),
+            ("value", pa.string()),
+            ("numeric_value", pa.float64()),
+            ("latest_trading_day", pa.string()),
+        ]
+    )
+    buffer = io.BytesIO()
+
+    def drain() -> bytes:
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    writer = pq.ParquetWriter(buffer, schema)
+    for rows in chunks:
+        columns = list(zip(*rows))
+        batch = pa.record_batch(
+            [pa.array(column, type=schema.field(i).type) for i, column in enumerate(columns)],
+            schema=schema,
+        )
+        writer.write_batch(batch)
+        yield drain()
+    writer.close()
+    yield drain()
+
+
+def export_rows(
+    export_format: str,
+    indicator_types: Optional[List[str]] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> Iterator:
+    """Checks the arguments and returns a generator of the encoded export.
+
+    Raises:
+        ValueError: if the format or a date is invalid, or Parquet is requested
+            without pyarrow installed
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Format must be one of: {', '.join(EXPORT_FORMATS)}.")
+    check_date(since, "since")
+    check_date(until, "until")
+    if export_format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError("Parquet export requires the optional 'pyarrow' package.")
+
+    chunks = iter_chunks(export_query(indicator_types, since, until), chunk_size)
+    if export_format == "csv":
+        return csv_stream(chunks)
+    if export_format == "ndjson":
+        return ndjson_stream(chunks)
+    return parquet_stream(chunks)
@@ -0,0 +1,46 @@
+# gunicorn settings for serving the app in production:
+#   gunicorn -c gunicorn.conf.py "app:create_app()"
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# One worker process serving WEB_THREADS requests at a time. The alert engine, the
+# price matrix cache, the intraday bar store, the symbol directory and the rate limits
+# live in process memory and are not shared between workers: with more than one
+# worker, an alert rule or a price update handled by one worker never reaches the
+# others. Only raise WEB_WORKERS once that state has moved to the database.
+# config.py sizes the SQLAlchemy pool of the worker from WEB_THREADS.
+workers = int(os.getenv("WEB_WORKERS", "1"))
+threads = int(os.getenv("WEB_THREADS", "4"))
+worker_class = "gthread"
+
+# Create the app (and reset the sample database) once in the master, then fork
+preload_app = True
+
+# On SIGTERM workers stop accepting connections and get this long to finish
+# the requests in flight before they are killed
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+# Upstream calls are bounded by UPSTREAM_DEADLINE, so a request should never hang this long
+timeout = int(os.getenv("WEB_TIMEOUT", "60"))
+keepalive = 5
+
+# Recycle workers now and then so that slow leaks cannot build up. A new worker is
+# forked from the master's startup state, which post_worker_init rebuilds
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "10000"))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+
+
+def post_worker_init(worker):
+    # Replace the state inherited from the master with the current one
+    from app import load_worker_state
+
+    load_worker_state(worker.wsgi)
+
+
+def worker_exit(server, worker):
+    # Intraday bars are saved by the worker that collected them, the master has none
+    from stock_utils.barStore import intraday_store
+
+    intraday_store.save_all()
@@ -1,16 +1,113 @@
+import math
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import validates
 
 db = SQLAlchemy()
 
+
+def to_numeric(value):
+    """Returns the value as float, or None for non numeric values like 'Technology' or 'None'."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
 class Stock(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    symbol = db.Column(db.String(10), nullable=False)
+    symbol = db.Column(db.String(10), nullable=False, index=True)
     current_price = db.Column(db.Float, nullable=False)
     indicators = db.relationship('Indicator', backref='stock', lazy=True)
+    alert_rules = db.relationship('AlertRule', backref='stock', lazy=True)
+    snapshot = db.relationship('StockSnapshot', backref='stock', uselist=False, lazy=True)
 
 class Indicator(db.Model):
+    __table_args__ = (
+        db.Index('ix_indicator_type_numeric_value', 'indicator_type', 'numeric_value'),
+        db.Index('ix_indicator_type_value', 'indicator_type', 'value'),
+        db.Index('ix_indicator_stock_id_type', 'stock_id', 'indicator_type'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     stock_id = db.Column(db.Integer, db.ForeignKey('stock.id'), nullable=False)
     indicator_type = db.Column(db.String(50), nullable=False)
     value = db.Column(db.String(50), nullable=False)
+    # value parsed as float so that the screener can compare and sort numerically
+    numeric_value = db.Column(db.Float, nullable=True)
     latest_trading_day = db.Column(db.String(50), nullable=False)
+
+    @validates('value')
+    def validate_value(self, key, value):
+        self.numeric_value = to_numeric(value)
+        return value
+
+class AlertRule(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    stock_id = db.Column(db.Integer, db.ForeignKey('stock.id'), nullable=False)
+    indicator_type = db.Column(db.String(50), nullable=False)
+    operator = db.Column(db.String(2), nullable=False)
+    threshold = db.Column(db.Float, nullable=False)
+    hysteresis = db.Column(db.Float, nullable=False, default=0.0)
+
+class StockSnapshot(db.Model):
+    """Denormalized dashboard row: one per stock with all of its indicator values,
+    kept up to date by the write paths so that reads need no pivoting.
+    """
+    __tablename__ = 'stock_snapshot'
+
+    stock_id = db.Column(db.Integer, db.ForeignKey('stock.id'), primary_key=True)
+    symbol = db.Column(db.String(10), nullable=False, index=True)
+    current_price = db.Column(db.Float, nullable=False)
+    indicator_values = db.Column(db.JSON, nullable=False, default=dict)
+    latest_trading_day = db.Column(db.String(50), nullable=True)
+
+class Portfolio(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    positions = db.relationship('Position', backref='portfolio', lazy=True)
+
+class Position(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    portfolio_id = db.Column(db.Integer, db.ForeignKey('portfolio.id'), nullable=False, index=True)
+    stock_id = db.Column(db.Integer, db.ForeignKey('stock.id'), nullable=False, index=True)
+    quantity = db.Column(db.Float, nullable=False)
+    # average purchase price per share
+    cost_basis = db.Column(db.Float, nullable=False)
+
+class PriceBar(db.Model):
+    """Daily OHLCV bar of a stock."""
+    __table_args__ = (db.UniqueConstraint('stock_id', 'date'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    stock_id = db.Column(db.Integer, db.ForeignKey('stock.id'), nullable=False)
+    date = db.Column(db.String(10), nullable=False, index=True)  # YYYY-MM-DD
+    open = db.Column(db.Float, nullable=True)
+    high = db.Column(db.Float, nullable=True)
+    low = db.Column(db.Float, nullable=True)
+    close = db.Column(db.Float, nullable=False)
+    volume = db.Column(db.Float, nullable=True)
+
+class PriceBarVersion(db.Model):
+    """Single row counter that every price bar write bumps in its transaction, so each
+    process can tell with a primary key lookup whether its price matrix is stale.
+    """
+    __tablename__ = 'price_bar_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class ChangeLog(db.Model):
+    """Sequenced record of stock and indicator changes, written in the same transaction
+    as the change itself, for clients that sync incrementally.
+    """
+    __tablename__ = 'change_log'
+
+    seq = db.Column(db.Integer, primary_key=True)
+    # stock_added, stock_repriced, stock_deleted, indicator_upserted, indicator_deleted
+    action = db.Column(db.String(20), nullable=False)
+    symbol = db.Column(db.String(10), nullable=False)
+    indicator_type = db.Column(db.String(50), nullable=True)
+    value = db.Column(db.String(50), nullable=True)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,144 @@
+from typing import List, Optional
+from itertools import chain
+import numpy as np
+from sqlalchemy import and_, select
+from models import db, Stock, Indicator, Portfolio, Position
+
+UNKNOWN_SECTOR = "Unknown"
+
+
+def load_positions(portfolio_ids: Optional[List[int]] = None):
+    """Loads the positions of the given portfolios (all if None) as an array with
+    columns portfolio_id, stock_id, quantity and cost_basis, plus the rows of all
+    stocks with their price and sector. One query each.
+    """
+    position_query = select(
+        Position.portfolio_id, Position.stock_id, Position.quantity, Position.cost_basis
+    )
+    if portfolio_ids is not None:
+        position_query = position_query.where(Position.portfolio_id.in_(portfolio_ids))
+    # Plain DBAPI tuples straight from the cursor, SQLAlchemy Row objects are far
+    # slower to convert for hundreds of thousands of positions
+    result = db.session.connection().execute(position_query)
+    rows = result.cursor.fetchall()
+    result.close()
+    positions = np.fromiter(
+        chain.from_iterable(rows), dtype=np.float64, count=4 * len(rows)
+    ).reshape(-1, 4)
+    # Group the rows by portfolio here rather than with an ORDER BY in the database
+    positions = positions[np.argsort(positions[:, 0], kind="stable")]
+
+    stock_query = select(Stock.id, Stock.symbol, Stock.current_price, Indicator.value).outerjoin(
+        Indicator, and_(Indicator.stock_id == Stock.id, Indicator.indicator_type == "Sector")
+    ).order_by(Stock.id)
+    stocks = db.session.execute(stock_query).all()
+
+    return positions, stocks
+
+
+def value_portfolios(portfolio_ids: Optional[List[int]] = None, include_positions: bool = False) -> dict:
+    """Market value, cost, unrealized P&L, position weights and sector exposure of
+    many portfolios at once, computed on NumPy arrays instead of per holding.
+    """
+    positions, stocks = load_positions(portfolio_ids)
+    portfolio_query = Portfolio.query.order_by(Portfolio.id)
+    if portfolio_ids is not None:
+        portfolio_query = portfolio_query.filter(Portfolio.id.in_(portfolio_ids))
+    names = {portfolio.id: portfolio.name for portfolio in portfolio_query}
+
+    # Stock lookup tables, indexed by position in the sorted stock id array.
+    # A stock with several Sector rows keeps the first one.
+    stock_ids, first_rows = np.unique(
+        np.array([row[0] for row in stocks], dtype=np.int64), return_index=True
+    )
+    stocks = [stocks[i] for i in first_rows.tolist()]
+    symbols = np.array([row[1] for row in stocks], dtype=object)
+    prices = np.array([row[2] for row in stocks], dtype=np.float64)
+    sector_names, sector_codes = np.unique(
+        np.array([row[3] or UNKNOWN_SECTOR for row in stocks], dtype=object), return_inverse=True
+    )
+
+    portfolio_index, portfolio_inverse = np.unique(
+        positions[:, 0].astype(np.int64), return_inverse=True
+    )
+    stock_index = np.searchsorted(stock_ids, positions[:, 1].astype(np.int64))
+    quantity = positions[:, 2]
+    cost_basis = positions[:, 3]
+    n_portfolios = len(portfolio_index)
+
+    market_value = quantity * prices[stock_index]
+    cost = quantity * cost_basis
+    pnl = market_value - cost
+
+    total_value = np.bincount(portfolio_inverse, weights=market_value, minlength=n_portfolios)
+    total_cost = np.bincount(portfolio_inverse, weights=cost, minlength=n_portfolios)
+    total_pnl = total_value - total_cost
+
+    position_total = total_value[portfolio_inverse]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weight = np.where(position_total != 0, market_value / position_total, 0.0)
+        pnl_pct = np.where(total_cost != 0, total_pnl / total_cost, 0.0)
+
+    # Portfolio x sector matrix of weights
+    n_sectors = len(sector_names)
+    exposure = np.bincount(
+        portfolio_inverse * n_sectors + sector_codes[stock_index],
+        weights=weight,
+        minlength=n_portfolios * n_sectors,
+    ).reshape(n_portfolios, n_sectors)
+
+    # Row ranges of each portfolio, positions are sorted by portfolio id
+    boundaries = np.searchsorted(portfolio_inverse, np.arange(n_portfolios + 1))
+
+    results = []
+    for i, portfolio_id in enumerate(portfolio_index.tolist()):
+        result = {
+            "id": portfolio_id,
+            "name": names.get(portfolio_id),
+            "market_value": round(float(total_value[i]), 2),
+            "cost_basis": round(float(total_cost[i]), 2),
+            "unrealized_pnl": round(float(total_pnl[i]), 2),
+            "unrealized_pnl_pct": round(float(pnl_pct[i]), 6),
+            "sector_exposure": {
+                sector_names[j]: round(float(exposure[i, j]), 6)
+                for j in np.flatnonzero(exposure[i]).tolist()
+            },
+        }
+        if include_positions:
+            rows = slice(boundaries[i], boundaries[i + 1])
+            result["positions"] = [
+                {
+                    "symbol": symbol,
+                    "quantity": q,
+                    "price": p,
+                    "market_value": round(v, 2),
+                    "unrealized_pnl": round(u, 2),
+                    "weight": round(w, 6),
+                }
+                for symbol, q, p, v, u, w in zip(
+                    symbols[stock_index[rows]].tolist(),
+                    quantity[rows].tolist(),
+                    prices[stock_index[rows]].tolist(),
+                    market_value[rows].tolist(),
+                    pnl[rows].tolist(),
+                    weight[rows].tolist(),
+                )
+            ]
+        results.append(result)
+
+    # Portfolios without positions
+    for portfolio_id in sorted(set(names) - set(portfolio_index.tolist())):
+        results.append(
+            {
+                "id": portfolio_id,
+                "name": names[portfolio_id],
+                "market_value": 0.0,
+                "cost_basis": 0.0,
+                "unrealized_pnl": 0.0,
+                "unrealized_pnl_pct": 0.0,
+                "sector_exposure": {},
+                **({"positions": []} if include_positions else {}),
+            }
+        )
+
+    return {"portfolios": results}
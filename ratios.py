@@ -0,0 +1,117 @@
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+from sqlalchemy import select
+from models import db, Stock, Indicator, StockSnapshot
+from stock_utils.dataFetcher import indicatorDataSet
+
+
+class DerivedRatio(NamedTuple):
+    denominator: str  # fundamental the ratio is derived from
+    compute: Callable[[np.ndarray, np.ndarray], np.ndarray]  # (price, fundamental) -> ratio
+    valid: Callable[[np.ndarray], np.ndarray]  # fundamental values the ratio is defined for
+    format: str
+
+
+# Price dependent indicators and how to derive them from the price and a fundamental
+# that only changes with the quarterly reports
+DERIVED_RATIOS: Dict[str, DerivedRatio] = {
+    "PERatio": DerivedRatio("EPS", np.divide, lambda eps: eps > 0, "{:.2f}"),
+    "TrailingPE": DerivedRatio("EPS", np.divide, lambda eps: eps > 0, "{:.2f}"),
+    "PriceToBookRatio": DerivedRatio("BookValue", np.divide, lambda book: book > 0, "{:.2f}"),
+    "PriceToSalesRatioTTM": DerivedRatio(
+        "RevenuePerShareTTM", np.divide, lambda revenue: revenue > 0, "{:.2f}"
+    ),
+    "MarketCapitalization": DerivedRatio(
+        "SharesOutstanding", np.multiply, lambda shares: shares > 0, "{:.0f}"
+    ),
+    "DividendYield": DerivedRatio(
+        "DividendPerShare",
+        lambda price, dividend: dividend / price,
+        lambda dividend: dividend >= 0,
+        "{:.4f}",
+    ),
+}
+DENOMINATORS = sorted({ratio.denominator for ratio in DERIVED_RATIOS.values()})
+
+
+def cached_fundamental(symbol: str, indicator_type: str) -> float:
+    """A fundamental from the cached OVERVIEW payload, NaN if it is not there."""
+    try:
+        return float(indicatorDataSet[symbol][indicator_type])
+    except (KeyError, TypeError, ValueError):
+        return np.nan
+
+
+def refresh_derived_ratios(stock_ids: Optional[List[int]] = None) -> List[Tuple[str, str, str]]:
+    """Recomputes the derived ratios that stocks already track from their current price
+    and their stored (or cached OVERVIEW) fundamentals, for all stocks at once.
+
+    Updates the indicator rows and the snapshot rows; the caller commits. Returns
+    (symbol, indicator_type, value) of every changed indicator.
+    """
+    db.session.flush()  # read the prices that the caller has just set
+    stock_query = select(Stock.id, Stock.symbol, Stock.current_price).order_by(Stock.id)
+    indicator_query = select(
+        Indicator.id, Indicator.stock_id, Indicator.indicator_type, Indicator.numeric_value
+    ).where(Indicator.indicator_type.in_(list(DERIVED_RATIOS) + DENOMINATORS))
+    if stock_ids is not None:
+        stock_query = stock_query.where(Stock.id.in_(stock_ids))
+        indicator_query = indicator_query.where(Indicator.stock_id.in_(stock_ids))
+    stocks = db.session.execute(stock_query).all()
+    indicators = db.session.execute(indicator_query).all()
+    if not stocks or not indicators:
+        return []
+
+    ids = np.array([row[0] for row in stocks], dtype=np.int64)
+    symbols = [row[1] for row in stocks]
+    prices = np.array([row[2] for row in stocks], dtype=np.float64)
+
+    row_ids = np.array([row[0] for row in indicators], dtype=np.int64)
+    row_stock = np.searchsorted(ids, np.array([row[1] for row in indicators], dtype=np.int64))
+    row_types = np.array([row[2] for row in indicators], dtype=object)
+    row_values = np.array([row[3] for row in indicators], dtype=np.float64)
+
+    # Fundamentals per stock, from the indicator table or else the OVERVIEW cache
+    fundamentals = {}
+    for indicator_type in DENOMINATORS:
+        values = np.full(len(ids), np.nan)
+        rows = row_types == indicator_type
+        values[row_stock[rows]] = row_values[rows]
+        for i in np.flatnonzero(np.isnan(values)).tolist():
+            values[i] = cached_fundamental(symbols[i], indicator_type)
+        fundamentals[indicator_type] = values
+
+    updates = []
+    snapshot_updates: Dict[int, Dict[str, str]] = {}
+    changes = []
+    for indicator_type, ratio in DERIVED_RATIOS.items():
+        rows = np.flatnonzero(row_types == indicator_type)
+        if len(rows) == 0:
+            continue
+        fundamental = fundamentals[ratio.denominator]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            derived = ratio.compute(prices, fundamental)
+            defined = ratio.valid(fundamental) & np.isfinite(derived) & (prices > 0)
+
+        stock_rows = row_stock[rows]
+        new_values = derived[stock_rows]
+        # Rows whose value moved, those that round to the stored value are skipped below
+        changed = defined[stock_rows] & ~np.isclose(new_values, row_values[rows], rtol=1e-6, atol=0)
+        for row, stock_index, value in zip(
+            rows[changed].tolist(), stock_rows[changed].tolist(), new_values[changed].tolist()
+        ):
+            text = ratio.format.format(value)
+            if float(text) == row_values[row]:
+                continue
+            updates.append({"id": int(row_ids[row]), "value": text, "numeric_value": float(text)})
+            snapshot_updates.setdefault(int(ids[stock_index]), {})[indicator_type] = text
+            changes.append((symbols[stock_index], indicator_type, text))
+
+    if updates:
+        db.session.bulk_update_mappings(Indicator, updates)
+        for snapshot in StockSnapshot.query.filter(StockSnapshot.stock_id.in_(snapshot_updates)):
+            # Assign a new dict so that SQLAlchemy detects the change of the JSON column
+            snapshot.indicator_values = {
+                **snapshot.indicator_values, **snapshot_updates[snapshot.stock_id]
+            }
+    return changes
@@ -1,38 +1,79 @@
-from flask import render_template, jsonify, request
+from flask import Response, render_template, jsonify, request, stream_with_context
 from authentication.auth import AuthError, requires_auth
+from authentication.limits import LimitError, limit_concurrency
 from config import (
     Stock,
     Indicator,
     add_indicator_to_all_stocks,
     db,
     add_stock_to_database,
-    add_indicator_to_stock,
+    add_indicators_to_stock,
+    AlertRule,
+    StockSnapshot,
+    upsert_stock_snapshot,
+    remove_snapshot_indicator,
+    add_alert_rule_to_stock,
+    alert_engine,
+    PRICE_INDICATOR,
+    market_data,
+    Portfolio,
+    Position,
+    add_portfolio_to_database,
+    PriceBar,
+    record_price_bar,
+    add_price_history_to_stock,
+    refresh_intraday_bars,
+    record_change,
+    record_changes,
+    get_changes,
+    apply_derived_ratios,
+    notify_indicator_changes,
 )
+from stock_utils.alertEngine import ALERT_OPERATORS
+from screener import screen_stocks, SCREENER_DEFAULT_LIMIT
+from portfolio import value_portfolios
+import analytics
+from export import EXPORT_FORMATS, export_rows
+from stock_utils.resilience import resilience_stats
+from stock_utils.barStore import intraday_store
+from stock_utils.symbolDirectory import symbol_directory, SYMBOL_SEARCH_LIMIT
+import numpy as np
 
 def load_stock_data():
-    stocks = Stock.query.all()
+    snapshots = StockSnapshot.query.order_by(StockSnapshot.stock_id).all()
     indicator_header = set()
-    for stock in stocks:
-        for indicator in stock.indicators:
-            indicator_header.add(indicator.indicator_type)
+    for snapshot in snapshots:
+        indicator_header.update(snapshot.indicator_values)
     indicator_header = sorted(indicator_header)
 
-    return stocks, indicator_header
+    return snapshots, indicator_header
 
 
 def index():
-    stocks, indicator_header = load_stock_data()
+    snapshots, indicator_header = load_stock_data()
     return render_template(
-        "index.html", stocks=stocks, indicator_header=indicator_header
+        "index.html", stocks=snapshots, indicator_header=indicator_header
     )
 
 
 def get_stocks():
-    stocks = Stock.query.all()
-    stock_list = [stock.symbol for stock in stocks]
+    symbols = db.session.query(StockSnapshot.symbol).order_by(StockSnapshot.stock_id).all()
+    stock_list = [symbol for (symbol,) in symbols]
     return jsonify(stock_list)
 
 
+def get_symbols():
+    try:
+        limit = max(1, min(int(request.args.get("limit", SYMBOL_SEARCH_LIMIT)), 100))
+    except ValueError:
+        return jsonify({"error": "Limit must be an integer."}), 400
+
+    prefix = request.args.get("prefix", "")
+    if not prefix:
+        return jsonify({"error": "A prefix is required."}), 400
+    return jsonify(symbol_directory.search(prefix, limit))
+
+
 def get_indicators():
     indicators = Indicator.query.all()
     indicator_set = {indicator.indicator_type for indicator in indicators}
@@ -41,22 +82,185 @@ def get_indicators():
 
 
 def get_stock_by_symbol(symbol):
-    stock = Stock.query.filter_by(symbol=symbol).first()
-    if not stock:
+    snapshot = StockSnapshot.query.filter_by(symbol=symbol).first()
+    if not snapshot:
         return jsonify({"error": "Stock not found"}), 404
 
     stock_info = {
-        "id": stock.id,
-        "symbol": stock.symbol,
-        "current_price": stock.current_price,
+        "id": snapshot.stock_id,
+        "symbol": snapshot.symbol,
+        "current_price": snapshot.current_price,
     }
-
-    for indicator in stock.indicators:
-        stock_info[indicator.indicator_type] = indicator.value
+    stock_info.update(snapshot.indicator_values)
 
     return jsonify(stock_info)
 
 
+def get_export():
+    export_format = request.args.get("format", "csv").lower()
+    indicators = request.args.get("indicators")
+    indicator_types = [i.strip() for i in indicators.split(",") if i.strip()] if indicators else None
+    try:
+        rows = export_rows(
+            export_format,
+            indicator_types=indicator_types,
+            since=request.args.get("since"),
+            until=request.args.get("until"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return Response(
+        stream_with_context(rows),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f"attachment; filename=stocks.{export_format}"},
+    )
+
+
+def get_intraday(symbol):
+    symbol = symbol.upper()
+    since = request.args.get("since")
+    try:
+        limit = int(request.args["limit"]) if "limit" in request.args else None
+        if limit is not None and limit < 1:
+            return jsonify({"error": "Limit must be a positive integer."}), 400
+        since_ts = int(np.datetime64(since, "s").astype(np.int64)) if since else None
+        if Stock.query.filter_by(symbol=symbol).first() is not None:
+            refresh_intraday_bars(symbol)
+        bars = intraday_store.bars(symbol, request.args.get("interval", "1m"), since=since_ts)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if bars is None:
+        return jsonify({"error": f"No intraday bars for '{symbol}'."}), 404
+
+    session = intraday_store.session(symbol)
+    if limit is not None:
+        bars = bars.since(int(bars.ts[-limit])) if limit < len(bars) else bars
+    return jsonify(
+        {
+            "symbol": symbol,
+            "interval": request.args.get("interval", "1m"),
+            "vwap": session.vwap(),
+            "bars": bars.to_list(),
+        }
+    )
+
+
+def get_changes_feed():
+    try:
+        since = int(request.args.get("since", 0))
+        limit = min(max(int(request.args.get("limit", 500)), 1), 5000)
+    except ValueError:
+        return jsonify({"error": "Since and limit must be integers."}), 400
+
+    # One extra row tells whether there are more changes after this page
+    changes = get_changes(since, limit + 1)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    return jsonify(
+        {
+            "changes": [
+                {
+                    "seq": change.seq,
+                    "action": change.action,
+                    "symbol": change.symbol,
+                    "indicator_type": change.indicator_type,
+                    "value": change.value,
+                    "changed_at": change.changed_at.isoformat(),
+                }
+                for change in changes
+            ],
+            "next": changes[-1].seq if changes else since,
+            "has_more": has_more,
+        }
+    )
+
+
+def get_providers():
+    return jsonify(market_data.health())
+
+
+def get_resilience():
+    return jsonify(resilience_stats())
+
+
+def get_screener():
+    try:
+        limit = int(request.args.get("limit", SCREENER_DEFAULT_LIMIT))
+        page = int(request.args.get("page", 1))
+    except ValueError:
+        return jsonify({"error": "Limit and page must be integers."}), 400
+
+    try:
+        result = screen_stocks(
+            request.args.get("filter", ""),
+            sort=request.args.get("sort"),
+            limit=limit,
+            page=page,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return (
+            jsonify({"error": "An unexpected error occurred. Please try again later."}),
+            500,
+        )
+
+    return jsonify(result)
+
+
+def analytics_symbols():
+    symbols = request.args.get("symbols")
+    if not symbols:
+        return None
+    return [symbol.strip().upper() for symbol in symbols.split(",") if symbol.strip()]
+
+
+def analytics_response(compute, **int_args):
+    """Runs an analytics function with the symbols and integer query parameters."""
+    try:
+        kwargs = {
+            name: int(request.args.get(name, default))
+            for name, default in int_args.items()
+            if request.args.get(name, default) is not None
+        }
+    except ValueError:
+        return jsonify({"error": f"{', '.join(int_args)} must be integers."}), 400
+
+    try:
+        return jsonify(compute(**kwargs))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+def get_correlation():
+    return analytics_response(
+        lambda **kwargs: analytics.correlation(analytics_symbols(), **kwargs),
+        window=analytics.ANALYTICS_DEFAULT_WINDOW,
+        min_periods=None,
+    )
+
+
+def get_volatility():
+    include_series = request.args.get("series", "false").lower() == "true"
+    return analytics_response(
+        lambda **kwargs: analytics.volatility(
+            analytics_symbols(), include_series=include_series, **kwargs
+        ),
+        window=20,
+    )
+
+
+def get_drawdowns():
+    return analytics_response(lambda: analytics.drawdowns(analytics_symbols()))
+
+
+def get_sector_analytics():
+    return analytics_response(analytics.sector_aggregates, window=20)
+
+
 def add_indicator():
     try:
         data = request.get_json()
@@ -100,10 +304,15 @@ def delete_indicator(indicator_type):
         if not indicators:
             return jsonify({"error": f"Indicator '{indicator_type}' not found."}), 404
 
+        symbols = [indicator.stock.symbol for indicator in indicators]
+        record_changes([("indicator_deleted", symbol, indicator_type, None) for symbol in symbols])
         for indicator in indicators:
             db.session.delete(indicator)
 
+        remove_snapshot_indicator(indicator_type)
         db.session.commit()
+        for symbol in symbols:
+            alert_engine.forget(symbol, indicator_type)
         return (
             jsonify(
                 {
@@ -132,13 +341,28 @@ def add_stock():
         if existing_stock:
             return jsonify({"error": f"Stock '{symbol}' already exists."}), 400
 
-        stock = add_stock_to_database(symbol)
+        rejection = symbol_directory.rejection(symbol)
+        if rejection:
+            return jsonify({"error": rejection}), 400
+
+        price_result = market_data.get_price(symbol)
+        if price_result.not_found:
+            return jsonify({"error": f"Stock '{symbol}' cannot be found."}), 404
+        if not price_result.is_success:
+            return (
+                jsonify({"error": f"The price of '{symbol}' is not available. Please try again later."}),
+                503,
+            )
+
+        stock = add_stock_to_database(symbol, price_result)
+        if stock is None:
+            return jsonify({"error": f"Stock '{symbol}' could not be added."}), 500
         indicator_set = {
             indicator.indicator_type for indicator in Indicator.query.all()
         }
 
-        for indicator in indicator_set:
-            add_indicator_to_stock(stock, indicator)
+        add_indicators_to_stock(stock, sorted(indicator_set))
+        add_price_history_to_stock(stock)
 
         return (
             jsonify(
@@ -165,8 +389,16 @@ def delete_stock(symbol):
             return jsonify({"error": f"Stock '{symbol}' not found."}), 404
 
         Indicator.query.filter_by(stock_id=stock.id).delete()
+        AlertRule.query.filter_by(stock_id=stock.id).delete()
+        Position.query.filter_by(stock_id=stock.id).delete()
+        PriceBar.query.filter_by(stock_id=stock.id).delete()
+        analytics.invalidate_price_matrix_on_commit()
+        StockSnapshot.query.filter_by(stock_id=stock.id).delete()
         db.session.delete(stock)
+        record_change("stock_deleted", symbol)
         db.session.commit()
+        alert_engine.remove_symbol(symbol)
+        intraday_store.remove_symbol(symbol)
 
         return (
             jsonify(
@@ -192,10 +424,19 @@ def update_stock(symbol):
             return jsonify({"error": f"Stock '{symbol}' not found."}), 404
 
         data = request.get_json()
+        previous_price = stock.current_price
         if "current_price" in data:
             stock.current_price = data["current_price"]
 
+        upsert_stock_snapshot(stock)
+        record_price_bar(stock)
+        # Like the derived ratios, only a price that actually moved is logged
+        if stock.current_price != previous_price:
+            record_change("stock_repriced", symbol, value=stock.current_price)
+        ratio_changes = apply_derived_ratios([stock.id])
         db.session.commit()
+        alert_engine.update(symbol, PRICE_INDICATOR, stock.current_price)
+        notify_indicator_changes(ratio_changes)
         return (
             jsonify(
                 {
@@ -213,6 +454,176 @@ def update_stock(symbol):
             500,
         )
 
+def alert_rule_to_dict(alert_rule):
+    return {
+        "id": alert_rule.id,
+        "symbol": alert_rule.stock.symbol,
+        "indicator_type": alert_rule.indicator_type,
+        "operator": alert_rule.operator,
+        "threshold": alert_rule.threshold,
+        "hysteresis": alert_rule.hysteresis,
+        "armed": alert_engine.is_armed(alert_rule.id),
+    }
+
+
+def get_alerts():
+    alert_rules = AlertRule.query.all()
+    return jsonify([alert_rule_to_dict(alert_rule) for alert_rule in alert_rules])
+
+
+def add_alert():
+    try:
+        data = request.get_json()
+        required = ("symbol", "indicator_type", "operator", "threshold")
+        if not data or any(key not in data for key in required):
+            return (
+                jsonify({"error": f"Fields {', '.join(required)} are required."}),
+                400,
+            )
+
+        operator = data["operator"]
+        if operator not in ALERT_OPERATORS:
+            return jsonify({"error": f"Operator '{operator}' is not supported."}), 400
+
+        try:
+            threshold = float(data["threshold"])
+            hysteresis = float(data.get("hysteresis", 0.0))
+        except (TypeError, ValueError):
+            return jsonify({"error": "Threshold and hysteresis must be numbers."}), 400
+
+        symbol = data["symbol"]
+        stock = Stock.query.filter_by(symbol=symbol).first()
+        if not stock:
+            return jsonify({"error": f"Stock '{symbol}' not found."}), 404
+
+        alert_rule = add_alert_rule_to_stock(
+            stock, data["indicator_type"], operator, threshold, hysteresis
+        )
+        if alert_rule is None:
+            return jsonify({"error": "Failed to add alert rule."}), 500
+
+        return (
+            jsonify(
+                {
+                    "message": f"Alert rule added to stock '{symbol}' successfully.",
+                    "alert": alert_rule_to_dict(alert_rule),
+                }
+            ),
+            201,
+        )
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return (
+            jsonify({"error": "An unexpected error occurred. Please try again later."}),
+            500,
+        )
+
+
+def delete_alert(alert_id):
+    try:
+        alert_rule = AlertRule.query.get(alert_id)
+        if not alert_rule:
+            return jsonify({"error": f"Alert rule '{alert_id}' not found."}), 404
+
+        db.session.delete(alert_rule)
+        db.session.commit()
+        alert_engine.remove_rule(alert_id)
+
+        return (
+            jsonify({"message": f"Alert rule '{alert_id}' deleted successfully."}),
+            200,
+        )
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return (
+            jsonify({"error": "An unexpected error occurred. Please try again later."}),
+            500,
+        )
+
+def add_portfolio():
+    try:
+        data = request.get_json()
+        if not data or "name" not in data or "positions" not in data:
+            return jsonify({"error": "Portfolio name and positions are required."}), 400
+
+        positions = data["positions"]
+        required = ("symbol", "quantity", "cost_basis")
+        if not isinstance(positions, list) or any(
+            not isinstance(position, dict) or any(key not in position for key in required)
+            for position in positions
+        ):
+            return (
+                jsonify({"error": f"Every position requires {', '.join(required)}."}),
+                400,
+            )
+
+        portfolio = add_portfolio_to_database(data["name"], positions)
+        if portfolio is None:
+            return jsonify({"error": "Failed to add portfolio."}), 400
+
+        return (
+            jsonify(
+                {
+                    "message": f"Portfolio '{portfolio.name}' added successfully.",
+                    "id": portfolio.id,
+                }
+            ),
+            201,
+        )
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return (
+            jsonify({"error": "An unexpected error occurred. Please try again later."}),
+            500,
+        )
+
+
+def get_portfolio_valuation():
+    ids = request.args.get("ids")
+    try:
+        portfolio_ids = [int(i) for i in ids.split(",")] if ids else None
+    except ValueError:
+        return jsonify({"error": "Portfolio ids must be integers."}), 400
+
+    include_positions = request.args.get("positions", "false").lower() in ("1", "true")
+    return jsonify(value_portfolios(portfolio_ids, include_positions))
+
+
+def delete_portfolio(portfolio_id):
+    try:
+        portfolio = Portfolio.query.get(portfolio_id)
+        if not portfolio:
+            return jsonify({"error": f"Portfolio '{portfolio_id}' not found."}), 404
+
+        Position.query.filter_by(portfolio_id=portfolio.id).delete()
+        db.session.delete(portfolio)
+        db.session.commit()
+
+        return (
+            jsonify({"message": f"Portfolio '{portfolio_id}' deleted successfully."}),
+            200,
+        )
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return (
+            jsonify({"error": "An unexpected error occurred. Please try again later."}),
+            500,
+        )
+
+def handle_auth_error(e):
+    return jsonify({"error": e.error["description"], "code": e.error["code"]}), e.status_code
+
+
+def handle_limit_error(e):
+    response = jsonify({"error": e.error["description"], "code": e.error["code"]})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, e.status_code
+
+
 # for unit test without authentication
 def register_routes(app):
     app.route("/")(index)
@@ -224,8 +635,28 @@ def register_routes(app):
     app.route("/stocks/<symbol>", methods=["PATCH"])(update_stock)
     app.route("/indicators/<indicator_type>", methods=["DELETE"])(delete_indicator)
     app.route("/stocks/<symbol>", methods=["DELETE"])(delete_stock)
+    app.route("/screener", methods=["GET"])(get_screener)
+    app.route("/symbols", methods=["GET"])(get_symbols)
+    app.route("/changes", methods=["GET"])(get_changes_feed)
+    app.route("/providers", methods=["GET"])(get_providers)
+    app.route("/resilience", methods=["GET"])(get_resilience)
+    app.route("/alerts", methods=["GET"])(get_alerts)
+    app.route("/alerts", methods=["POST"])(add_alert)
+    app.route("/alerts/<int:alert_id>", methods=["DELETE"])(delete_alert)
+    app.route("/portfolios", methods=["POST"])(add_portfolio)
+    app.route("/portfolios/valuation", methods=["GET"])(get_portfolio_valuation)
+    app.route("/portfolios/<int:portfolio_id>", methods=["DELETE"])(delete_portfolio)
+    app.route("/export", methods=["GET"])(get_export)
+    app.route("/stocks/<symbol>/intraday", methods=["GET"])(get_intraday)
+    app.route("/analytics/correlation", methods=["GET"])(get_correlation)
+    app.route("/analytics/volatility", methods=["GET"])(get_volatility)
+    app.route("/analytics/drawdowns", methods=["GET"])(get_drawdowns)
+    app.route("/analytics/sectors", methods=["GET"])(get_sector_analytics)
 
 def register_routes_auth(app):
+    app.register_error_handler(AuthError, handle_auth_error)
+    app.register_error_handler(LimitError, handle_limit_error)
+
     app.route("/", endpoint='index')(index)
     app.route("/stocks", methods=["GET"], endpoint='get_stocks')(get_stocks)
     app.route("/indicators", methods=["GET"], endpoint='get_indicators')(get_indicators)
@@ -233,11 +664,20 @@ def register_routes_auth(app):
     app.route("/stocks/<symbol>", methods=["GET"], endpoint='get_stock_by_symbol')(
         requires_auth("get:stocks")(get_stock_by_symbol)
     )
+    app.route("/symbols", methods=["GET"], endpoint='get_symbols')(get_symbols)
+    app.route("/changes", methods=["GET"], endpoint='get_changes_feed')(
+        requires_auth("get:stocks")(get_changes_feed)
+    )
+    app.route("/providers", methods=["GET"], endpoint='get_providers')(get_providers)
+    app.route("/resilience", methods=["GET"], endpoint='get_resilience')(get_resilience)
+    app.route("/screener", methods=["GET"], endpoint='get_screener')(
+        requires_auth("get:stocks")(get_screener)
+    )
     app.route("/indicators", methods=["POST"], endpoint='add_indicator')(
-        requires_auth("post:indicators")(add_indicator)
+        requires_auth("post:indicators")(limit_concurrency("add_indicator")(add_indicator))
     )
     app.route("/stocks", methods=["POST"], endpoint='add_stock')(
-        requires_auth("post:stocks")(add_stock)
+        requires_auth("post:stocks")(limit_concurrency("add_stock")(add_stock))
     )
     app.route("/stocks/<symbol>", methods=["PATCH"], endpoint='update_stock')(
         requires_auth("patch:stocks")(update_stock)
@@ -248,3 +688,39 @@ def register_routes_auth(app):
     app.route("/stocks/<symbol>", methods=["DELETE"], endpoint='delete_stock')(
         requires_auth("delete:stocks")(delete_stock)
     )
+    app.route("/alerts", methods=["GET"], endpoint='get_alerts')(
+        requires_auth("get:alerts")(get_alerts)
+    )
+    app.route("/alerts", methods=["POST"], endpoint='add_alert')(
+        requires_auth("post:alerts")(add_alert)
+    )
+    app.route("/alerts/<int:alert_id>", methods=["DELETE"], endpoint='delete_alert')(
+        requires_auth("delete:alerts")(delete_alert)
+    )
+    app.route("/portfolios", methods=["POST"], endpoint='add_portfolio')(
+        requires_auth("post:portfolios")(add_portfolio)
+    )
+    app.route("/portfolios/valuation", methods=["GET"], endpoint='get_portfolio_valuation')(
+        requires_auth("get:portfolios")(limit_concurrency("get_portfolio_valuation")(get_portfolio_valuation))
+    )
+    app.route("/portfolios/<int:portfolio_id>", methods=["DELETE"], endpoint='delete_portfolio')(
+        requires_auth("delete:portfolios")(delete_portfolio)
+    )
+    app.route("/stocks/<symbol>/intraday", methods=["GET"], endpoint='get_intraday')(
+        requires_auth("get:stocks")(get_intraday)
+    )
+    app.route("/export", methods=["GET"], endpoint='get_export')(
+        requires_auth("get:stocks")(limit_concurrency("get_export")(get_export))
+    )
+    app.route("/analytics/correlation", methods=["GET"], endpoint='get_correlation')(
+        requires_auth("get:stocks")(limit_concurrency("get_correlation")(get_correlation))
+    )
+    app.route("/analytics/volatility", methods=["GET"], endpoint='get_volatility')(
+        requires_auth("get:stocks")(get_volatility)
+    )
+    app.route("/analytics/drawdowns", methods=["GET"], endpoint='get_drawdowns')(
+        requires_auth("get:stocks")(get_drawdowns)
+    )
+    app.route("/analytics/sectors", methods=["GET"], endpoint='get_sector_analytics')(
+        requires_auth("get:stocks")(limit_concurrency("get_sector_analytics")(get_sector_analytics))
+    )
@@ -0,0 +1,170 @@
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Union
+from sqlalchemy import exists, func
+from sqlalchemy.orm import aliased
+from models import db, Stock, Indicator
+from stock_utils.dataFetcher import indicatorTypeSet
+from stock_utils.alertEngine import PRICE_INDICATOR
+
+SCREENER_DEFAULT_LIMIT = 50
+SCREENER_MAX_LIMIT = 500
+
+# Fields stored as columns on Stock rather than as Indicator rows
+STOCK_FIELDS = {PRICE_INDICATOR: Stock.current_price, "symbol": Stock.symbol}
+
+PREDICATE_PATTERN = re.compile(r"^\s*(\w+)\s*(<=|>=|!=|=|<|>)\s*(.+?)\s*$")
+AND_PATTERN = re.compile(r"\s+AND\s+", re.IGNORECASE)
+
+
+@dataclass
+class Predicate:
+    field: str
+    operator: str
+    value: Union[float, str]
+
+
+def parse_filter(expression: str) -> List[Predicate]:
+    """Parses an expression like 'PERatio<30 AND Sector=Technology' into predicates.
+
+    Raises:
+        ValueError: if a predicate is malformed or references an unknown field
+    """
+    predicates = []
+    if not expression or not expression.strip():
+        return predicates
+
+    for part in AND_PATTERN.split(expression.strip()):
+        match = PREDICATE_PATTERN.match(part)
+        if not match:
+            raise ValueError(f"Invalid filter expression '{part}'.")
+
+        field, operator, raw_value = match.groups()
+        check_field(field)
+        raw_value = raw_value.strip("'\"")
+        try:
+            value = float(raw_value)
+        except ValueError:
+            if operator not in ("=", "!="):
+                raise ValueError(f"Operator '{operator}' requires a numeric value in '{part}'.")
+            value = raw_value
+        predicates.append(Predicate(field, operator, value))
+
+    return predicates
+
+
+def check_field(field: str) -> None:
+    if field not in indicatorTypeSet and field not in STOCK_FIELDS:
+        raise ValueError(f"Unknown screener field '{field}'.")
+
+
+def compare(column, operator: str, value):
+    if operator == "<":
+        return column < value
+    if operator == "<=":
+        return column <= value
+    if operator == ">":
+        return column > value
+    if operator == ">=":
+        return column >= value
+    if operator == "!=":
+        return column != value
+    return column == value
+
+
+def screen_stocks(
+    expression: str,
+    sort: Optional[str] = None,
+    limit: int = SCREENER_DEFAULT_LIMIT,
+    page: int = 1,
+) -> dict:
+    """Compiles the filter expression into one SQL query over Stock and Indicator.
+
+    Every referenced indicator type becomes an aliased join on Indicator, matched
+    by (stock_id, indicator_type) to the newest row, and compared on the indexed
+    numeric_value or value column, so the database does the filtering, sorting and
+    paging and every stock appears once.
+    """
+    predicates = parse_filter(expression)
+    limit = max(1, min(limit, SCREENER_MAX_LIMIT))
+    page = max(1, page)
+
+    descending = bool(sort) and sort.startswith("-")
+    sort_field = sort.lstrip("-+") if sort else None
+    if sort_field:
+        check_field(sort_field)
+
+    fields = []
+    for name in [p.field for p in predicates] + ([sort_field] if sort_field else []):
+        if name not in STOCK_FIELDS and name not in fields:
+            fields.append(name)
+    filtered = {p.field for p in predicates}
+
+    aliases = {}
+    query = db.session.query(Stock.symbol, Stock.current_price).select_from(Stock)
+    for name in fields:
+        alias = aliased(Indicator)
+        aliases[name] = alias
+        # Only the newest row of a (stock, indicator type), so older duplicates
+        # cannot repeat a stock in the results
+        newer = aliased(Indicator)
+        superseded = exists().where(
+            (newer.stock_id == alias.stock_id)
+            & (newer.indicator_type == name)
+            & (newer.id > alias.id)
+        )
+        on_clause = (alias.stock_id == Stock.id) & (alias.indicator_type == name) & ~superseded
+        # A filtered indicator must exist; a sort-only one may be missing
+        if name in filtered:
+            query = query.join(alias, on_clause)
+        else:
+            query = query.outerjoin(alias, on_clause)
+        query = query.add_columns(alias.value)
+
+    for predicate in predicates:
+        if predicate.field in STOCK_FIELDS:
+            column = STOCK_FIELDS[predicate.field]
+        elif isinstance(predicate.value, float):
+            column = aliases[predicate.field].numeric_value
+        else:
+            column = aliases[predicate.field].value
+        query = query.filter(compare(column, predicate.operator, predicate.value))
+
+    if sort_field:
+        if sort_field in STOCK_FIELDS:
+            sort_column = STOCK_FIELDS[sort_field]
+        else:
+            sort_column = aliases[sort_field].numeric_value
+        query = query.order_by(
+            sort_column.is_(None), sort_column.desc() if descending else sort_column
+        )
+    query = query.order_by(Stock.symbol)
+
+    # The total row count comes back with every row, so paging needs no second query
+    # unless the page lies past the end
+    rows = (
+        query.add_columns(func.count().over().label("total"))
+        .limit(limit)
+        .offset((page - 1) * limit)
+        .all()
+    )
+    if rows:
+        total = rows[0][-1]
+    elif page > 1:
+        total = query.order_by(None).count()
+    else:
+        total = 0
+
+    results = []
+    for row in rows:
+        result = {"symbol": row[0], PRICE_INDICATOR: row[1]}
+        for index, name in enumerate(fields):
+            result[name] = row[2 + index]
+        results.append(result)
+
+    return {
+        "results": results,
+        "page": page,
+        "limit": limit,
+        "total": total,
+    }
@@ -0,0 +1,313 @@
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+import threading
+import requests
+
+# Pseudo indicator type used for rules on Stock.current_price
+PRICE_INDICATOR = "current_price"
+
+ALERT_OPERATORS = (">", ">=", "<", "<=")
+
+INF = float("inf")
+
+
+@dataclass
+class ThresholdRule:
+    rule_id: int
+    symbol: str
+    indicator_type: str
+    operator: str
+    threshold: float
+    hysteresis: float = 0.0
+
+    def is_satisfied(self, value: float) -> bool:
+        if self.operator == ">":
+            return value > self.threshold
+        if self.operator == ">=":
+            return value >= self.threshold
+        if self.operator == "<":
+            return value < self.threshold
+        return value <= self.threshold
+
+    @property
+    def rearm_level(self) -> float:
+        # An "above" rule re-arms once the value falls back below threshold - hysteresis,
+        # a "below" rule once it climbs back above threshold + hysteresis
+        if self.operator in (">", ">="):
+            return self.threshold - self.hysteresis
+        return self.threshold + self.hysteresis
+
+
+@dataclass
+class AlertEvent:
+    rule_id: int
+    symbol: str
+    indicator_type: str
+    operator: str
+    threshold: float
+    value: float
+    previous_value: Optional[float] = None
+    triggered_at: str = field(
+        default_factory=lambda: datetime.utcnow().isoformat(timespec="seconds")
+    )
+
+
+class AlertNotifier:
+    def notify(self, event: AlertEvent) -> None:
+        raise NotImplementedError
+
+
+class LogNotifier(AlertNotifier):
+    def notify(self, event: AlertEvent) -> None:
+        print(
+            f"Alert {event.rule_id}: {event.symbol} {event.indicator_type} "
+            f"{event.operator} {event.threshold} (value {event.value})."
+        )
+
+
+class WebhookNotifier(AlertNotifier):
+    """Posts every alert event as JSON to the given URL. Delivery is best effort,
+    failures are only logged so a slow receiver cannot break a write path.
+    """
+
+    def __init__(self, url: str, timeout: float = 2.0):
+        self.url = url
+        self.timeout = timeout
+
+    def notify(self, event: AlertEvent) -> None:
+        try:
+            requests.post(self.url, json=event.__dict__, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            print(f"Error while delivering alert {event.rule_id}: {e}")
+
+
+class _SortedRules:
+    """Rule ids kept sorted by a float key, so that all rules whose key lies
+    between two values can be found by bisection.
+    """
+
+    def __init__(self):
+        self.keys: List[float] = []
+        self.ids: List[int] = []
+
+    def add(self, key: float, rule_id: int) -> None:
+        index = bisect_right(self.keys, key)
+        self.keys.insert(index, key)
+        self.ids.insert(index, rule_id)
+
+    def remove(self, key: float, rule_id: int) -> None:
+        index = bisect_left(self.keys, key)
+        while index < len(self.keys) and self.keys[index] == key:
+            if self.ids[index] == rule_id:
+                del self.keys[index]
+                del self.ids[index]
+                return
+            index += 1
+
+    def between(
+        self, low: float, high: float, include_low: bool, include_high: bool
+    ) -> List[int]:
+        start = bisect_left(self.keys, low) if include_low else bisect_right(self.keys, low)
+        end = bisect_right(self.keys, high) if include_high else bisect_left(self.keys, high)
+        return self.ids[start:end]
+
+
+class _RuleBook:
+    """All rules of one (symbol, indicator_type) pair, indexed per operator by
+    threshold (for firing) and by re-arm level (for hysteresis).
+    """
+
+    def __init__(self):
+        self.thresholds = {op: _SortedRules() for op in ALERT_OPERATORS}
+        self.rearm_levels = {op: _SortedRules() for op in ALERT_OPERATORS}
+        self.size = 0
+
+    def add(self, rule: ThresholdRule) -> None:
+        self.thresholds[rule.operator].add(rule.threshold, rule.rule_id)
+        self.rearm_levels[rule.operator].add(rule.rearm_level, rule.rule_id)
+        self.size += 1
+
+    def remove(self, rule: ThresholdRule) -> None:
+        self.thresholds[rule.operator].remove(rule.threshold, rule.rule_id)
+        self.rearm_levels[rule.operator].remove(rule.rearm_level, rule.rule_id)
+        self.size -= 1
+
+    def crossed(self, old: Optional[float], new: float) -> List[int]:
+        """Rules whose condition became true when moving from old to new."""
+        if old is None:
+            return (
+                self.thresholds[">"].between(-INF, new, True, False)
+                + self.thresholds[">="].between(-INF, new, True, True)
+                + self.thresholds["<"].between(new, INF, False, True)
+                + self.thresholds["<="].between(new, INF, True, True)
+            )
+        if new > old:
+            return self.thresholds[">"].between(old, new, True, False) + self.thresholds[
+                ">="
+            ].between(old, new, False, True)
+        if new < old:
+            return self.thresholds["<"].between(new, old, False, True) + self.thresholds[
+                "<="
+            ].between(new, old, True, False)
+        return []
+
+    def rearmed(self, old: Optional[float], new: float) -> List[int]:
+        """Rules whose value moved back past their hysteresis band."""
+        if old is None or new == old:
+            return []
+        if new < old:
+            return self.rearm_levels[">"].between(new, old, True, False) + self.rearm_levels[
+                ">="
+            ].between(new, old, True, False)
+        return self.rearm_levels["<"].between(old, new, False, True) + self.rearm_levels[
+            "<="
+        ].between(old, new, False, True)
+
+
+class AlertEngine:
+    """In-memory threshold alert engine.
+
+    Rules are grouped by (symbol, indicator_type) and kept in sorted threshold lists,
+    so an update only looks at the rules lying between the previous and the new value.
+    Alerts are edge triggered: a rule fires once when its threshold is crossed and is
+    only armed again after the value moved back past threshold +/- hysteresis.
+    """
+
+    def __init__(self, notifier: Optional[AlertNotifier] = None):
+        self.notifier = notifier or LogNotifier()
+        self._lock = threading.Lock()
+        self._rules: Dict[int, ThresholdRule] = {}
+        self._books: Dict[Tuple[str, str], _RuleBook] = {}
+        self._last_values: Dict[Tuple[str, str], float] = {}
+        self._disarmed = set()
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rules.clear()
+            self._books.clear()
+            self._last_values.clear()
+            self._disarmed.clear()
+
+    def seed(self, symbol: str, indicator_type: str, value) -> None:
+        """Records a known value without evaluating any rule, unless a newer value
+        has already been seen.
+        """
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            self._last_values.setdefault((symbol, indicator_type), value)
+
+    def add_rule(self, rule: ThresholdRule, notify: bool = True) -> Optional[AlertEvent]:
+        """Registers a rule. If the last known value already satisfies it, the rule
+        is disarmed and, unless notify is False, fires right away.
+        """
+        if rule.operator not in ALERT_OPERATORS:
+            raise ValueError(f"Unsupported alert operator '{rule.operator}'.")
+
+        key = (rule.symbol, rule.indicator_type)
+        with self._lock:
+            if rule.rule_id in self._rules:
+                self._remove_rule(rule.rule_id)
+            self._rules[rule.rule_id] = rule
+            self._books.setdefault(key, _RuleBook()).add(rule)
+
+            last_value = self._last_values.get(key)
+            if last_value is None or not rule.is_satisfied(last_value):
+                return None
+            self._disarmed.add(rule.rule_id)
+            if not notify:
+                return None
+            event = self._event(rule, last_value, None)
+
+        self.notifier.notify(event)
+        return event
+
+    def remove_rule(self, rule_id: int) -> bool:
+        with self._lock:
+            return self._remove_rule(rule_id)
+
+    def remove_symbol(self, symbol: str) -> None:
+        with self._lock:
+            for rule_id in [r.rule_id for r in self._rules.values() if r.symbol == symbol]:
+                self._remove_rule(rule_id)
+            for key in [k for k in self._last_values if k[0] == symbol]:
+                del self._last_values[key]
+
+    def forget(self, symbol: str, indicator_type: str) -> None:
+        """Drops the last known value of a deleted indicator and re-arms its rules, so
+        a re-added indicator is evaluated like a new one."""
+        key = (symbol, indicator_type)
+        with self._lock:
+            self._last_values.pop(key, None)
+            for rule_id in [r.rule_id for r in self._rules.values() if (r.symbol, r.indicator_type) == key]:
+                self._disarmed.discard(rule_id)
+
+    def is_armed(self, rule_id: int) -> bool:
+        return rule_id not in self._disarmed
+
+    def update(self, symbol: str, indicator_type: str, value) -> List[AlertEvent]:
+        """Feeds a new price or indicator value into the engine and notifies every
+        rule it crossed. Non numeric values (e.g. 'Sector') are ignored.
+        """
+        try:
+            new_value = float(value)
+        except (TypeError, ValueError):
+            return []
+
+        key = (symbol, indicator_type)
+        events = []
+        with self._lock:
+            old_value = self._last_values.get(key)
+            self._last_values[key] = new_value
+
+            book = self._books.get(key)
+            if book is None:
+                return []
+
+            for rule_id in book.rearmed(old_value, new_value):
+                self._disarmed.discard(rule_id)
+
+            for rule_id in book.crossed(old_value, new_value):
+                if rule_id in self._disarmed:
+                    continue
+                self._disarmed.add(rule_id)
+                events.append(self._event(self._rules[rule_id], new_value, old_value))
+
+        for event in events:
+            self.notifier.notify(event)
+        return events
+
+    def _remove_rule(self, rule_id: int) -> bool:
+        rule = self._rules.pop(rule_id, None)
+        if rule is None:
+            return False
+        key = (rule.symbol, rule.indicator_type)
+        book = self._books[key]
+        book.remove(rule)
+        if book.size == 0:
+            del self._books[key]
+        self._disarmed.discard(rule_id)
+        return True
+
+    @staticmethod
+    def _event(rule: ThresholdRule, value: float, previous_value: Optional[float]) -> AlertEvent:
+        return AlertEvent(
+            rule_id=rule.rule_id,
+            symbol=rule.symbol,
+            indicator_type=rule.indicator_type,
+            operator=rule.operator,
+            threshold=rule.threshold,
+            value=value,
+            previous_value=previous_value,
+        )
+
+
+# Shared engine, fed by the price and indicator write paths in config.py
+alert_engine = AlertEngine()
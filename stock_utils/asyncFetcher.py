@@ -0,0 +1,132 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import os
+import threading
+import time
+from stock_utils.dataFetcher import StockFundamentals, StockPriceResult
+from stock_utils.marketData import market_data
+
+
+class AsyncRateLimiter:
+    """Token bucket shared by all tasks of the event loop."""
+
+    def __init__(self, calls_per_second: float, burst: Optional[int] = None):
+        self.rate = calls_per_second
+        self.capacity = burst or max(1, int(calls_per_second))
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+
+class AsyncFetchEngine:
+    """Fans out upstream calls on an asyncio event loop running in its own thread.
+
+    Sync code (e.g. Flask views) hands a batch to the loop and blocks until all of it
+    is done, so a batch takes about as long as its slowest call instead of the sum of
+    all calls. At most `max_concurrency` calls are in flight and, if `calls_per_second`
+    is set, they are spaced by a token bucket. The vendor clients (requests, yfinance)
+    are blocking, so each call itself runs in the loop's thread pool.
+    """
+
+    def __init__(self, max_concurrency: int = 8, calls_per_second: Optional[float] = None):
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = AsyncRateLimiter(calls_per_second) if calls_per_second else None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._start_lock = threading.Lock()
+
+    def reset(self) -> None:
+        """Forgets the event loop, e.g. in a forked worker where its thread is gone.
+        A new loop is started on the next call.
+        """
+        self._loop = None
+        self._semaphore = None
+        self._start_lock = threading.Lock()
+        if self.rate_limiter is not None:
+            self.rate_limiter._lock = None
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                loop.set_default_executor(
+                    ThreadPoolExecutor(
+                        max_workers=self.max_concurrency, thread_name_prefix="async-fetch"
+                    )
+                )
+                threading.Thread(
+                    target=loop.run_forever, name="async-fetch-loop", daemon=True
+                ).start()
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._loop = loop
+        return self._loop
+
+    def run(self, coroutine, timeout: Optional[float] = None):
+        """Runs a coroutine on the engine's loop and waits for its result."""
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result(timeout)
+
+    async def call(self, func: Callable, *args):
+        async with self._semaphore:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire()
+            return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def map(self, func: Callable, argument_list: Iterable[tuple]) -> list:
+        """Calls func once per argument tuple concurrently and returns results in order."""
+
+        async def gather():
+            return await asyncio.gather(*(self.call(func, *args) for args in argument_list))
+
+        return self.run(gather())
+
+    def fetch_prices(self, symbols: List[str]) -> Dict[str, StockPriceResult]:
+        results = self.map(market_data.get_price, [(symbol,) for symbol in symbols])
+        return dict(zip(symbols, results))
+
+    def fetch_fundamentals(
+        self, pairs: Iterable[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], StockFundamentals]:
+        """Fetches (symbol, indicator_type) pairs. Symbols run concurrently, the
+        indicators of one symbol run one after the other because the first call
+        fills the per-symbol OVERVIEW cache for the rest.
+        """
+        by_symbol: Dict[str, List[str]] = {}
+        for symbol, indicator_type in pairs:
+            by_symbol.setdefault(symbol, []).append(indicator_type)
+
+        def fetch_symbol(symbol: str) -> List[StockFundamentals]:
+            return [
+                market_data.get_fundamentals(symbol, indicator_type)
+                for indicator_type in by_symbol[symbol]
+            ]
+
+        symbols = list(by_symbol)
+        results = {}
+        for symbol, symbol_results in zip(symbols, self.map(fetch_symbol, [(s,) for s in symbols])):
+            for indicator_type, result in zip(by_symbol[symbol], symbol_results):
+                results[(symbol, indicator_type)] = result
+        return results
+
+
+calls_per_second = os.getenv("UPSTREAM_CALLS_PER_SECOND")
+
+fetch_engine = AsyncFetchEngine(
+    max_concurrency=int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "8")),
+    calls_per_second=float(calls_per_second) if calls_per_second else None,
+)
+os.register_at_fork(after_in_child=fetch_engine.reset)
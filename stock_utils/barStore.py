@@ -0,0 +1,310 @@
+from typing import Dict, Optional, Set
+from dataclasses import dataclass
+import atexit
+import os
+import threading
+import time
+import numpy as np
+
+# One trading day has 390 one minute bars, the default keeps about a week per symbol
+INTRADAY_CAPACITY = int(os.getenv("INTRADAY_CAPACITY", "2048"))
+INTRADAY_STORE_DIR = os.getenv("INTRADAY_STORE_DIR", "intraday_bars")
+# The intraday endpoint fetches the bars of a symbol from yfinance at most this often
+INTRADAY_REFRESH_SECONDS = float(os.getenv("INTRADAY_REFRESH_SECONDS", "60"))
+
+ROLLUP_INTERVALS = {"1m": 60, "5m": 300, "15m": 900, "1h": 3600}
+FIELDS = ("ts", "open", "high", "low", "close", "volume")
+
+# Regular session close, in seconds after midnight exchange time
+SESSION_CLOSE = 16 * 3600
+SECONDS_PER_DAY = 86400
+
+
+@dataclass
+class IntradayBars:
+    """Bars in time order. `ts` holds seconds since the epoch in exchange local time
+    (US/Eastern, as delivered by Alpha Vantage)."""
+    ts: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def since(self, ts: int) -> "IntradayBars":
+        start = np.searchsorted(self.ts, ts)
+        return IntradayBars(*(getattr(self, name)[start:] for name in FIELDS))
+
+    def rollup(self, interval: int) -> "IntradayBars":
+        """OHLCV bars of `interval` seconds, each stamped with the start of its bucket."""
+        if len(self) == 0 or interval == 60:
+            return self
+        buckets = self.ts - self.ts % interval
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+        ends = np.append(starts[1:], len(self)) - 1
+        return IntradayBars(
+            ts=buckets[starts],
+            open=self.open[starts],
+            high=np.maximum.reduceat(self.high, starts),
+            low=np.minimum.reduceat(self.low, starts),
+            close=self.close[ends],
+            volume=np.add.reduceat(self.volume, starts),
+        )
+
+    def vwap(self) -> Optional[float]:
+        """Volume weighted average of the typical price (high + low + close) / 3."""
+        total_volume = self.volume.sum()
+        if total_volume <= 0:
+            return None
+        typical = (self.high + self.low + self.close) / 3.0
+        return float(np.dot(typical, self.volume) / total_volume)
+
+    def to_list(self) -> list:
+        timestamps = np.datetime_as_string(self.ts.astype("datetime64[s]"), unit="s")
+        return [
+            {"time": t, "open": o, "high": h, "low": l, "close": c, "volume": v}
+            for t, o, h, l, c, v in zip(
+                timestamps.tolist(),
+                self.open.tolist(),
+                self.high.tolist(),
+                self.low.tolist(),
+                self.close.tolist(),
+                self.volume.tolist(),
+            )
+        ]
+
+
+class BarRing:
+    """Fixed capacity ring buffer of one symbol's one minute bars, kept in time order.
+    When it is full, the oldest bars are overwritten.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.ts = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((5, capacity), dtype=np.float64)  # open, high, low, close, volume
+        self.start = 0
+        self.size = 0
+
+    def last_ts(self) -> Optional[int]:
+        if self.size == 0:
+            return None
+        return int(self.ts[(self.start + self.size - 1) % self.capacity])
+
+    def bars(self) -> IntradayBars:
+        index = (self.start + np.arange(self.size)) % self.capacity
+        ts = self.ts[index]
+        values = self.values[:, index]
+        return IntradayBars(ts, *values)
+
+    def append(self, ts: np.ndarray, values: np.ndarray) -> None:
+        """Appends bars that are all newer than the last one."""
+        if len(ts) > self.capacity:
+            ts, values = ts[-self.capacity:], values[:, -self.capacity:]
+        index = (self.start + self.size + np.arange(len(ts))) % self.capacity
+        self.ts[index] = ts
+        self.values[:, index] = values
+        overflow = max(0, self.size + len(ts) - self.capacity)
+        self.start = (self.start + overflow) % self.capacity
+        self.size = min(self.capacity, self.size + len(ts))
+
+    def merge(self, ts: np.ndarray, values: np.ndarray) -> None:
+        """Merges sorted bars that overlap the stored ones. A bar fetched again replaces
+        the stored one, since the last bar of a fetch may still have been forming.
+        Only the stored bars from the first new timestamp on are touched.
+        """
+        index = (self.start + np.arange(self.size)) % self.capacity
+        overlap = np.searchsorted(self.ts[index], ts[0])
+        tail = index[overlap:]
+
+        all_ts = np.concatenate((self.ts[tail], ts))
+        all_values = np.concatenate((self.values[:, tail], values), axis=1)
+        order = np.argsort(all_ts, kind="stable")
+        all_ts, all_values = all_ts[order], all_values[:, order]
+        # Of equal timestamps the stable sort keeps the new bar last, keep only that one
+        keep = np.append(all_ts[1:] != all_ts[:-1], True)
+
+        self.size = overlap
+        self.append(all_ts[keep], all_values[:, keep])
+
+    def ingest(self, ts: np.ndarray, values: np.ndarray) -> None:
+        order = np.argsort(ts, kind="stable")
+        ts, values = ts[order], values[:, order]
+        last = self.last_ts()
+        if last is None or ts[0] > last:
+            self.append(ts, values)
+        else:
+            self.merge(ts, values)
+
+
+class IntradayBarStore:
+    """In-memory one minute bars per symbol, served with rollups to coarser intervals.
+
+    Bars are saved as one .npz file per symbol once a fetch contains bars after the
+    session close, and when the process exits, and are loaded again on start. Only
+    symbols with bars that were ingested since their last save or load are written, so
+    a process that merely loaded the files (like the gunicorn master) never overwrites
+    newer files of a worker with its older buffers.
+    """
+
+    def __init__(self, capacity: int = INTRADAY_CAPACITY, directory: Optional[str] = INTRADAY_STORE_DIR):
+        self.capacity = capacity
+        self.directory = directory
+        self.rings: Dict[str, BarRing] = {}
+        self.saved_days: Dict[str, int] = {}
+        self.unsaved: Set[str] = set()
+        self.fetched_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def ingest(self, symbol: str, ts: np.ndarray, values: np.ndarray, loaded: bool = False) -> None:
+        """Adds one minute bars: `ts` in seconds, `values` with rows open, high, low,
+        close and volume. Bars already stored are de-duplicated by timestamp."""
+        if len(ts) == 0:
+            return
+        with self._lock:
+            if symbol not in self.rings:
+                self.rings[symbol] = BarRing(self.capacity)
+            ring = self.rings[symbol]
+            ring.ingest(ts, values)
+            last_ts = ring.last_ts()
+            if not loaded:
+                self.unsaved.add(symbol)
+        self.save_if_session_closed(symbol, last_ts)
+
+    def claim_fetch(self, symbol: str, min_interval: float = INTRADAY_REFRESH_SECONDS) -> bool:
+        """True if the symbol was not fetched within `min_interval` seconds. The fetch is
+        claimed right away, so concurrent requests for a symbol fetch it once."""
+        now = time.monotonic()
+        with self._lock:
+            fetched_at = self.fetched_at.get(symbol)
+            if fetched_at is not None and now - fetched_at < min_interval:
+                return False
+            self.fetched_at[symbol] = now
+            return True
+
+    def ingest_rows(self, symbol: str, rows: list) -> None:
+        """Adds (time 'YYYY-MM-DD HH:MM:SS' in exchange time, open, high, low, close,
+        volume) rows, e.g. the one minute history of yfinance."""
+        if not rows:
+            return
+        times, *columns = zip(*rows)
+        ts = np.array(times, dtype="datetime64[s]").astype(np.int64)
+        self.ingest(symbol, ts, np.array(columns, dtype=np.float64))
+
+    def ingest_alpha_vantage(self, symbol: str, time_series: dict) -> None:
+        """Adds the bars of an Alpha Vantage 'Time Series (1min)' object."""
+        ts = np.array(list(time_series), dtype="datetime64[s]").astype(np.int64)
+        values = np.array(
+            [
+                (
+                    float(bar["1. open"]),
+                    float(bar["2. high"]),
+                    float(bar["3. low"]),
+                    float(bar["4. close"]),
+                    float(bar["5. volume"]),
+                )
+                for bar in time_series.values()
+            ],
+            dtype=np.float64,
+        ).reshape(-1, 5).T
+        self.ingest(symbol, ts, values)
+
+    def bars(self, symbol: str, interval: str = "1m", since: Optional[int] = None) -> Optional[IntradayBars]:
+        """Bars of a symbol rolled up to the interval, None if the symbol has no bars.
+
+        Raises:
+            ValueError: if the interval is not one of ROLLUP_INTERVALS
+        """
+        if interval not in ROLLUP_INTERVALS:
+            raise ValueError(f"Interval must be one of: {', '.join(ROLLUP_INTERVALS)}.")
+        with self._lock:
+            ring = self.rings.get(symbol)
+            if ring is None or ring.size == 0:
+                return None
+            bars = ring.bars()
+        if since is not None:
+            bars = bars.since(since)
+        return bars.rollup(ROLLUP_INTERVALS[interval])
+
+    def session(self, symbol: str) -> Optional[IntradayBars]:
+        """One minute bars of the symbol's latest trading day."""
+        bars = self.bars(symbol)
+        if bars is None:
+            return None
+        return bars.since(int(bars.ts[-1]) // SECONDS_PER_DAY * SECONDS_PER_DAY)
+
+    def remove_symbol(self, symbol: str) -> None:
+        with self._lock:
+            self.rings.pop(symbol, None)
+            self.saved_days.pop(symbol, None)
+            self.unsaved.discard(symbol)
+            self.fetched_at.pop(symbol, None)
+        if self.directory:
+            try:
+                os.remove(self.path(symbol))
+            except FileNotFoundError:
+                pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self.rings.clear()
+            self.saved_days.clear()
+            self.unsaved.clear()
+            self.fetched_at.clear()
+
+    def path(self, symbol: str) -> str:
+        return os.path.join(self.directory, f"{symbol}.npz")
+
+    def save_if_session_closed(self, symbol: str, last_ts: int) -> None:
+        day, seconds = divmod(last_ts, SECONDS_PER_DAY)
+        if self.directory and seconds >= SESSION_CLOSE - 60 and self.saved_days.get(symbol) != day:
+            self.save(symbol)
+            self.saved_days[symbol] = day
+
+    def save(self, symbol: str) -> None:
+        # Cleared before reading, so bars ingested meanwhile are saved next time
+        with self._lock:
+            self.unsaved.discard(symbol)
+        bars = self.bars(symbol)
+        if bars is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # Written next to the target and renamed, so other workers never read half a file
+        temporary_path = f"{self.path(symbol)}.{os.getpid()}.tmp.npz"
+        np.savez(temporary_path, **{name: getattr(bars, name) for name in FIELDS})
+        os.replace(temporary_path, self.path(symbol))
+
+    def save_all(self) -> None:
+        """Saves the symbols with bars that are not on disk yet."""
+        if not self.directory:
+            return
+        for symbol in list(self.unsaved):
+            try:
+                self.save(symbol)
+            except OSError as e:
+                self.unsaved.add(symbol)
+                print(f"Error while saving intraday bars of {symbol}: {e}")
+
+    def load_all(self) -> None:
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".npz") or ".tmp" in filename:
+                continue
+            try:
+                symbol = filename[: -len(".npz")]
+                with np.load(os.path.join(self.directory, filename)) as data:
+                    values = np.vstack([data[name] for name in FIELDS[1:]])
+                    # Already on disk, do not write it back right away
+                    if len(data["ts"]):
+                        self.saved_days[symbol] = int(data["ts"][-1]) // SECONDS_PER_DAY
+                    self.ingest(symbol, data["ts"], values, loaded=True)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Error while loading intraday bars from {filename}: {e}")
+
+
+intraday_store = IntradayBarStore()
+atexit.register(intraday_store.save_all)
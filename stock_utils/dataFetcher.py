@@ -7,6 +7,9 @@ import requests
 import json
 from datetime import datetime, timedelta
 import pytz
+from stock_utils.resilience import resilient_get
+from stock_utils.barStore import intraday_store
+from stock_utils.symbolDirectory import symbol_directory
 
 # Load environment variables from .env file
 env_path = Path(__file__).resolve().parent.parent / ".env"
@@ -20,7 +23,9 @@ if not api_key:
         "API key for RapidAPI is missing. Please set 'RAPIDAPI_KEY' in your environment."
     )
 
-RAPIDAPI_BASE_URL = "https://alpha-vantage.p.rapidapi.com/query"
+RAPIDAPI_BASE_URL = os.getenv(
+    "RAPIDAPI_BASE_URL", "https://alpha-vantage.p.rapidapi.com/query"
+)
 RAPIDAPI_HEADERS = {
     "x-rapidapi-host": "alpha-vantage.p.rapidapi.com",
     "x-rapidapi-key": api_key,
@@ -87,6 +92,8 @@ class StockFundamentals:
     value: Optional[Union[float, str, int]] = None
     latest_trading_day: Optional[str] = None
     error_message: Optional[str] = None
+    not_found: bool = False
+    rate_limited: bool = False
 
     @property
     def is_success(self) -> bool:
@@ -123,8 +130,11 @@ def get_latest_trading_day(symbol: str) -> str:
     params = {"function": "GLOBAL_QUOTE", "symbol": symbol, "datatype": "json"}
 
     try:
-        response = requests.get(
-            RAPIDAPI_BASE_URL, headers=RAPIDAPI_HEADERS, params=params
+        response = resilient_get(
+            f"alphavantage.{params['function']}",
+            RAPIDAPI_BASE_URL,
+            headers=RAPIDAPI_HEADERS,
+            params=params,
         )
         response.raise_for_status()
         data = response.json()
@@ -155,20 +165,26 @@ def get_fundamental_data(symbol: str, indicatorType: str) -> StockFundamentals:
         ):
             data = indicatorDataSet[symbol]
         else:
-            response = requests.get(
-                RAPIDAPI_BASE_URL, headers=RAPIDAPI_HEADERS, params=params
+            response = resilient_get(
+                f"alphavantage.{params['function']}",
+                RAPIDAPI_BASE_URL,
+                headers=RAPIDAPI_HEADERS,
+                params=params,
             )
             response.raise_for_status()
             data = response.json()
             indicatorDataSet[symbol] = data
 
         if "Error Message" in data:
+            symbol_directory.remember_invalid(symbol)
             return StockFundamentals(
-                error_message=f"Error: The symbol '{symbol}' cannot be found."
+                error_message=f"Error: The symbol '{symbol}' cannot be found.",
+                not_found=True,
             )
         if "Note" in data:
             return StockFundamentals(
-                error_message="API call frequency exceeded. Please wait and try again later."
+                error_message="API call frequency exceeded. Please wait and try again later.",
+                rate_limited=True,
             )
 
         try:
@@ -206,6 +222,8 @@ class StockPriceResult:
     price: Optional[float] = None
     last_refreshed_est: Optional[str] = None
     error_message: Optional[str] = None
+    not_found: bool = False
+    rate_limited: bool = False
 
     @property
     def is_success(self) -> bool:
@@ -221,19 +239,25 @@ def get_stock_price(symbol: str) -> StockPriceResult:
     }
 
     try:
-        response = requests.get(
-            RAPIDAPI_BASE_URL, headers=RAPIDAPI_HEADERS, params=params
+        response = resilient_get(
+            f"alphavantage.{params['function']}",
+            RAPIDAPI_BASE_URL,
+            headers=RAPIDAPI_HEADERS,
+            params=params,
         )
         response.raise_for_status()
         data = response.json()
 
         if "Error Message" in data:
+            symbol_directory.remember_invalid(symbol)
             return StockPriceResult(
-                error_message=f"Error: The symbol '{symbol}' cannot be found."
+                error_message=f"Error: The symbol '{symbol}' cannot be found.",
+                not_found=True,
             )
         if "Note" in data:
             return StockPriceResult(
-                error_message="API call frequency exceeded. Please wait and try again later."
+                error_message="API call frequency exceeded. Please wait and try again later.",
+                rate_limited=True,
             )
 
         try:
@@ -241,15 +265,32 @@ def get_stock_price(symbol: str) -> StockPriceResult:
             last_close = float(
                 data["Time Series (1min)"][last_refreshed_est]["4. close"]
             )
-            return StockPriceResult(
-                price=last_close, last_refreshed_est=last_refreshed_est
-            )
         except KeyError:
             return StockPriceResult(
                 error_message="Internal Error: Unexpected response structure."
             )
+
+        # Keep the whole series for intraday charts; a malformed bar must not fail the price
+        try:
+            intraday_store.ingest_alpha_vantage(symbol, data["Time Series (1min)"])
+        except (KeyError, TypeError, ValueError, OSError) as e:
+            print(f"Error while storing intraday bars of {symbol}: {e}")
+        return StockPriceResult(price=last_close, last_refreshed_est=last_refreshed_est)
     except requests.exceptions.RequestException as e:
         return StockPriceResult(error_message=f"Network Error: {str(e)}")
 
     except Exception as e:
         return StockPriceResult(error_message=f"Unexpected Error: {str(e)}")
+
+
+def get_listing_status() -> str:
+    """Fetches the CSV listing of all active symbols (LISTING_STATUS)."""
+    params = {"function": "LISTING_STATUS"}
+    response = resilient_get(
+        f"alphavantage.{params['function']}",
+        RAPIDAPI_BASE_URL,
+        headers=RAPIDAPI_HEADERS,
+        params=params,
+    )
+    response.raise_for_status()
+    return response.text
@@ -0,0 +1,388 @@
+from typing import Callable, Dict, List, Optional, Union
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+import os
+import threading
+import time
+import yfinance as yf
+from stock_utils import priceFetcher, dataFetcher
+from stock_utils.resilience import CircuitBreaker, UPSTREAM_DEADLINE, call_with_resilience
+from stock_utils.dataFetcher import (
+    StockFundamentals,
+    StockPriceResult,
+    get_market_reference_date,
+)
+from stock_utils.priceFetcher import PriceHistoryResult
+from stock_utils.symbolDirectory import symbol_directory
+
+MarketDataResult = Union[StockPriceResult, StockFundamentals, PriceHistoryResult]
+
+# Hedge delay used until a provider has enough samples for a p95
+DEFAULT_HEDGE_DELAY = 1.0
+LATENCY_WINDOW = 100
+MIN_LATENCY_SAMPLES = 10
+
+
+class ProviderHealth:
+    """Rolling latency window and call counters of one provider capability."""
+
+    def __init__(self):
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.successes = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, result: MarketDataResult) -> None:
+        with self._lock:
+            if is_final(result):
+                self.latencies.append(latency)
+                self.successes += 1
+            else:
+                self.failures += 1
+                self.last_error = result.error_message
+                if result.rate_limited:
+                    self.rate_limited += 1
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        with self._lock:
+            if len(self.latencies) < MIN_LATENCY_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def to_dict(self) -> dict:
+        p50 = self.percentile(0.50)
+        p95 = self.percentile(0.95)
+        return {
+            "successes": self.successes,
+            "failures": self.failures,
+            "rate_limited": self.rate_limited,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+def is_final(result: MarketDataResult) -> bool:
+    """A result is final if the provider answered, even if the answer is 'unknown symbol'.
+    In a race, 'unknown symbol' only ends the race when the first provider says so and
+    its answer is trusted for the capability."""
+    return result.is_success or result.not_found
+
+
+class MarketDataProvider:
+    name = "provider"
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self.health: Dict[str, ProviderHealth] = {}
+        self.default_hedge_delay = DEFAULT_HEDGE_DELAY
+
+    def get_price(self, symbol: str) -> StockPriceResult:
+        raise NotImplementedError
+
+    def get_fundamentals(self, symbol: str, indicator_type: str) -> StockFundamentals:
+        raise NotImplementedError
+
+    def get_price_history(self, symbol: str, period: str) -> PriceHistoryResult:
+        raise NotImplementedError
+
+    def get_intraday_history(self, symbol: str) -> PriceHistoryResult:
+        raise NotImplementedError
+
+    def supports_indicator(self, indicator_type: str) -> bool:
+        return True
+
+    def supports_history(self) -> bool:
+        return False
+
+    def health_of(self, capability: str) -> ProviderHealth:
+        if capability not in self.health:
+            self.health[capability] = ProviderHealth()
+        return self.health[capability]
+
+    def hedge_delay(self, capability: str) -> float:
+        p95 = self.health_of(capability).percentile(0.95)
+        return p95 if p95 is not None else self.default_hedge_delay
+
+
+class YahooFinanceProvider(MarketDataProvider):
+    name = "yfinance"
+
+    # yfinance Ticker.info keys for the Alpha Vantage OVERVIEW fields it also covers
+    FUNDAMENTAL_KEYS = {
+        "Sector": "sector",
+        "Industry": "industry",
+        "MarketCapitalization": "marketCap",
+        "PERatio": "trailingPE",
+        "TrailingPE": "trailingPE",
+        "ForwardPE": "forwardPE",
+        "PEGRatio": "pegRatio",
+        "BookValue": "bookValue",
+        "EPS": "trailingEps",
+        "DividendYield": "dividendYield",
+        "Beta": "beta",
+        "PriceToBookRatio": "priceToBook",
+        "PriceToSalesRatioTTM": "priceToSalesTrailing12Months",
+        "52WeekHigh": "fiftyTwoWeekHigh",
+        "52WeekLow": "fiftyTwoWeekLow",
+        "50DayMovingAverage": "fiftyDayAverage",
+        "200DayMovingAverage": "twoHundredDayAverage",
+        "SharesOutstanding": "sharesOutstanding",
+        "AnalystTargetPrice": "targetMeanPrice",
+    }
+
+    def get_price(self, symbol: str) -> StockPriceResult:
+        # The last close of a one day history, which tells an unknown symbol (no rows)
+        # apart from a failed request
+        history = self.get_price_history(symbol, "1d")
+        if not history.is_success:
+            return StockPriceResult(
+                error_message=f"Error: No price from yfinance for '{symbol}'.",
+                not_found=history.not_found,
+            )
+        return StockPriceResult(price=round(history.bars[-1][4], 2))
+
+    def get_price_history(self, symbol: str, period: str) -> PriceHistoryResult:
+        # An unknown symbol is an answer, it is neither retried nor held against the breaker
+        return call_with_resilience(
+            "yfinance.history",
+            lambda remaining: priceFetcher.get_price_history(symbol, period),
+            is_failure=lambda result: not result.is_success and not result.not_found,
+        )
+
+    def get_intraday_history(self, symbol: str) -> PriceHistoryResult:
+        return call_with_resilience(
+            "yfinance.history",
+            lambda remaining: priceFetcher.get_intraday_history(symbol),
+            is_failure=lambda result: not result.is_success and not result.not_found,
+        )
+
+    def supports_indicator(self, indicator_type: str) -> bool:
+        return indicator_type in self.FUNDAMENTAL_KEYS
+
+    def supports_history(self) -> bool:
+        return True
+
+    def get_fundamentals(self, symbol: str, indicator_type: str) -> StockFundamentals:
+        try:
+            info = call_with_resilience("yfinance.info", lambda remaining: yf.Ticker(symbol).info)
+            value = info.get(self.FUNDAMENTAL_KEYS[indicator_type])
+        except Exception as e:
+            return StockFundamentals(error_message=f"Unexpected Error: {str(e)}")
+        if value is None:
+            # yfinance answered, it just has no such value for this symbol. It is never the
+            # first fundamentals provider, so this does not end a race against Alpha Vantage
+            return StockFundamentals(
+                error_message=f"Error: No {indicator_type} from yfinance for '{symbol}'.",
+                not_found=True,
+            )
+        return StockFundamentals(
+            symbol=symbol,
+            indicator_type=indicator_type,
+            value=str(value),
+            latest_trading_day=get_market_reference_date(),
+        )
+
+
+class AlphaVantageProvider(MarketDataProvider):
+    name = "alphavantage"
+
+    def get_price(self, symbol: str) -> StockPriceResult:
+        return dataFetcher.get_stock_price(symbol)
+
+    def get_fundamentals(self, symbol: str, indicator_type: str) -> StockFundamentals:
+        return dataFetcher.get_fundamental_data(symbol, indicator_type)
+
+
+class MarketData:
+    """Routes price and fundamentals requests over an ordered list of providers.
+
+    Symbols that the symbol directory knows to be invalid are rejected before any
+    provider is asked, and a symbol no price provider knows is remembered there.
+
+    Providers with an open circuit breaker are skipped. The first remaining provider
+    is asked; if it fails the next one is asked right away, and if it has not answered
+    within its own p95 latency the next one is asked as a hedge. The first value that
+    arrives is returned, and the caller never waits longer than `deadline`. For
+    fundamentals, 'not found' is returned right away from the first provider of the
+    list. For prices, a 'not found' from any provider makes the next one be asked, and
+    is only returned once no provider has a value, so a symbol one source does not know
+    (or an empty answer during its outage) does not hide the price of another.
+    """
+
+    def __init__(
+        self,
+        price_providers: List[MarketDataProvider],
+        fundamental_providers: List[MarketDataProvider],
+        max_workers: int = 32,
+        deadline: float = UPSTREAM_DEADLINE,
+    ):
+        self.price_providers = price_providers
+        self.fundamental_providers = fundamental_providers
+        self.deadline = deadline
+        self.max_workers = max_workers
+        self.reset_executor()
+
+    def reset_executor(self) -> None:
+        """Starts a fresh thread pool, e.g. in a forked worker where the parent's threads are gone."""
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="market-data"
+        )
+
+    def get_price(self, symbol: str) -> StockPriceResult:
+        rejection = symbol_directory.rejection(symbol)
+        if rejection:
+            return StockPriceResult(error_message=rejection, not_found=True)
+        result = self._hedged(
+            self.price_providers,
+            "price",
+            lambda provider: provider.get_price(symbol),
+            StockPriceResult,
+            primary_not_found_is_final=False,
+        )
+        if result.not_found:
+            # No provider has a price, so later requests are rejected without asking them
+            symbol_directory.remember_invalid(symbol)
+        return result
+
+    def get_fundamentals(self, symbol: str, indicator_type: str) -> StockFundamentals:
+        if indicator_type not in dataFetcher.indicatorTypeSet:
+            return StockFundamentals(
+                error_message=f"Input indicator type '{indicator_type}' does not exist"
+            )
+        rejection = symbol_directory.rejection(symbol)
+        if rejection:
+            return StockFundamentals(error_message=rejection, not_found=True)
+        return self._hedged(
+            [p for p in self.fundamental_providers if p.supports_indicator(indicator_type)],
+            "fundamentals",
+            lambda provider: provider.get_fundamentals(symbol, indicator_type),
+            StockFundamentals,
+        )
+
+    def get_price_history(self, symbol: str, period: str = "1y") -> PriceHistoryResult:
+        rejection = symbol_directory.rejection(symbol)
+        if rejection:
+            return PriceHistoryResult(error_message=rejection, not_found=True)
+        return self._hedged(
+            [p for p in self.price_providers if p.supports_history()],
+            "history",
+            lambda provider: provider.get_price_history(symbol, period),
+            PriceHistoryResult,
+            primary_not_found_is_final=False,
+        )
+
+    def get_intraday_history(self, symbol: str) -> PriceHistoryResult:
+        rejection = symbol_directory.rejection(symbol)
+        if rejection:
+            return PriceHistoryResult(error_message=rejection, not_found=True)
+        return self._hedged(
+            [p for p in self.price_providers if p.supports_history()],
+            "intraday",
+            lambda provider: provider.get_intraday_history(symbol),
+            PriceHistoryResult,
+            primary_not_found_is_final=False,
+        )
+
+    def health(self) -> dict:
+        providers = {p.name: p for p in self.price_providers + self.fundamental_providers}
+        return {
+            name: {
+                "breaker": provider.breaker.state,
+                **{
+                    capability: health.to_dict()
+                    for capability, health in provider.health.items()
+                },
+            }
+            for name, provider in providers.items()
+        }
+
+    def _call(
+        self,
+        provider: MarketDataProvider,
+        capability: str,
+        fetch: Callable[[MarketDataProvider], MarketDataResult],
+        result_type,
+    ) -> MarketDataResult:
+        start = time.perf_counter()
+        try:
+            result = fetch(provider)
+        except Exception as e:
+            result = result_type(error_message=f"Unexpected Error: {str(e)}")
+        provider.health_of(capability).record(time.perf_counter() - start, result)
+
+        if is_final(result):
+            provider.breaker.record_success()
+        else:
+            provider.breaker.record_failure(rate_limited=result.rate_limited)
+        return result
+
+    def _hedged(
+        self,
+        providers: List[MarketDataProvider],
+        capability: str,
+        fetch: Callable[[MarketDataProvider], MarketDataResult],
+        result_type,
+        primary_not_found_is_final: bool = True,
+    ) -> MarketDataResult:
+        candidates = iter(providers)
+        pending: Dict[Future, MarketDataProvider] = {}
+        last_result = None
+        not_found_result = None
+
+        def launch_next() -> Optional[MarketDataProvider]:
+            for provider in candidates:
+                if provider.breaker.allow():
+                    future = self._executor.submit(self._call, provider, capability, fetch, result_type)
+                    pending[future] = provider
+                    return provider
+            return None
+
+        deadline_at = time.monotonic() + self.deadline
+        provider = launch_next()
+        while pending:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                # Late answers are still recorded in the provider health by _call
+                return result_type(
+                    error_message=f"Network Error: No {capability} answer within {self.deadline}s."
+                )
+            timeout = min(provider.hedge_delay(capability), remaining) if provider else remaining
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                answered_by = pending.pop(future)
+                result = future.result()
+                if result.is_success:
+                    return result
+                if result.not_found:
+                    # Only the first provider is authoritative about unknown symbols; another
+                    # provider may just lack the value, so the others keep racing
+                    if answered_by is providers[0] and primary_not_found_is_final:
+                        return result
+                    not_found_result = result
+                else:
+                    last_result = result
+            # Fall back on failure, hedge on timeout; once no provider is left just wait
+            if provider is not None:
+                provider = launch_next()
+
+        if not_found_result is not None:
+            return not_found_result
+        if last_result is not None:
+            return last_result
+        return result_type(error_message=f"Error: No {capability} provider is available.")
+
+
+# Both lists share the provider objects, so a rate limit seen on one capability
+# also opens the breaker for the other
+yahoo_finance = YahooFinanceProvider()
+alpha_vantage = AlphaVantageProvider()
+
+market_data = MarketData(
+    price_providers=[yahoo_finance, alpha_vantage],
+    fundamental_providers=[alpha_vantage, yahoo_finance],
+)
+os.register_at_fork(after_in_child=market_data.reset_executor)
@@ -1,5 +1,8 @@
 import yfinance as yf
-from typing import Optional
+import requests
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+from stock_utils.resilience import RETRYABLE_STATUS_CODES
 
 def get_stock_price(ticker_symbol: str) -> Optional[float]:
     """
@@ -30,3 +33,132 @@ def get_stock_price(ticker_symbol: str) -> Optional[float]:
     except Exception as e:
         print(f"Error: {e}")
         return None
+
+
+@dataclass
+class PriceHistoryResult:
+    # (date 'YYYY-MM-DD', open, high, low, close, volume) per trading day, oldest first,
+    # or per minute with the time 'YYYY-MM-DD HH:MM:SS' in exchange time
+    bars: List[Tuple[str, float, float, float, float, float]] = field(default_factory=list)
+    error_message: Optional[str] = None
+    not_found: bool = False
+    rate_limited: bool = False
+
+    @property
+    def is_success(self) -> bool:
+        return self.error_message is None
+
+
+class UpstreamSession(requests.Session):
+    """Session handed to yfinance that remembers why its last request failed.
+
+    yfinance swallows transport errors and answers both an unreachable Yahoo and an
+    unknown symbol with an empty frame; only this session can tell them apart.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.error: Optional[Exception] = None
+        self.status_code: Optional[int] = None
+
+    def request(self, *args, **kwargs):
+        try:
+            response = super().request(*args, **kwargs)
+        except requests.exceptions.RequestException as e:
+            self.error = e
+            raise
+        self.error = None
+        self.status_code = response.status_code
+        return response
+
+
+def empty_history_result(ticker_symbol: str, session: UpstreamSession, message: str) -> PriceHistoryResult:
+    """Classifies an empty yfinance frame. Transport errors are raised, so callers behind
+    call_with_resilience retry them and hold them against the breaker; a retryable
+    status is a failed result; only an answer from Yahoo itself means not found.
+    """
+    if session.error is not None:
+        raise session.error
+    if session.status_code in RETRYABLE_STATUS_CODES:
+        return PriceHistoryResult(
+            error_message=f"Error: Yahoo Finance answered {session.status_code} for {ticker_symbol}.",
+            rate_limited=session.status_code == 429,
+        )
+    # yfinance returns an empty frame for unknown and delisted symbols
+    return PriceHistoryResult(error_message=message, not_found=True)
+
+
+def get_price_history(ticker_symbol: str, period: str = "1y") -> PriceHistoryResult:
+    """
+    Fetches daily OHLCV bars for the given ticker symbol using the Yahoo Finance API.
+
+    :param ticker_symbol: Stock ticker symbol (e.g., 'AMD')
+    :param period: yfinance period string (e.g., '1mo', '1y', 'max')
+    :return: PriceHistoryResult with the bars, or an error message if no data is available.
+    :raises requests.exceptions.RequestException: if Yahoo Finance could not be reached
+    """
+    session = UpstreamSession()
+    try:
+        stock_history = yf.Ticker(ticker_symbol, session=session).history(period=period, interval="1d")
+        if stock_history.empty:
+            return empty_history_result(
+                ticker_symbol, session, f"No history available for {ticker_symbol}."
+            )
+
+        bars = [
+            (
+                day.strftime("%Y-%m-%d"),
+                float(row["Open"]),
+                float(row["High"]),
+                float(row["Low"]),
+                float(row["Close"]),
+                float(row["Volume"]),
+            )
+            for day, row in stock_history.iterrows()
+        ]
+        return PriceHistoryResult(bars=bars)
+
+    except requests.exceptions.RequestException:
+        raise
+    except Exception as e:
+        return PriceHistoryResult(error_message=f"Error: {e}")
+
+
+def get_intraday_history(ticker_symbol: str) -> PriceHistoryResult:
+    """
+    Fetches the one minute bars of the latest session for the given ticker symbol using the Yahoo Finance API.
+
+    :param ticker_symbol: Stock ticker symbol (e.g., 'AMD')
+    :return: PriceHistoryResult with the bars stamped in exchange time, or an error message if no data is available.
+    :raises requests.exceptions.RequestException: if Yahoo Finance could not be reached
+    """
+    session = UpstreamSession()
+    try:
+        stock_history = yf.Ticker(ticker_symbol, session=session).history(period="1d", interval="1m")
+        if stock_history.empty:
+            return empty_history_result(
+                ticker_symbol, session, f"No intraday bars available for {ticker_symbol}."
+            )
+        stock_history = stock_history.dropna(subset=["Close"])
+        if stock_history.empty:
+            return PriceHistoryResult(
+                error_message=f"No intraday bars available for {ticker_symbol}.", not_found=True
+            )
+
+        bars = [
+            (
+                minute.strftime("%Y-%m-%d %H:%M:%S"),
+                float(row["Open"]),
+                float(row["High"]),
+                float(row["Low"]),
+                float(row["Close"]),
+                float(row["Volume"]),
+            )
+            for minute, row in stock_history.iterrows()
+        ]
+        return PriceHistoryResult(bars=bars)
+
+    except requests.exceptions.RequestException:
+        raise
+    except Exception as e:
+        return PriceHistoryResult(error_message=f"Error: {e}")
@@ -0,0 +1,263 @@
+from typing import Callable, Dict, Optional
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import os
+import random
+import threading
+import time
+import requests
+
+# Longest time a caller waits for one upstream call, retries included
+UPSTREAM_DEADLINE = float(os.getenv("UPSTREAM_DEADLINE", "10"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.2"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "5"))
+# Retries may add at most this fraction of extra calls on top of the first attempts
+UPSTREAM_RETRY_BUDGET_RATIO = float(os.getenv("UPSTREAM_RETRY_BUDGET_RATIO", "0.2"))
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    pass
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failed calls (or immediately on a rate
+    limit) and rejects calls for `cooldown` seconds. Afterwards one trial call is let
+    through: success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self, rate_limited: bool = False) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_running = False
+            # A failed trial call (the breaker was open before) opens it again right away
+            reopen = self.opened_at is not None
+            if reopen or rate_limited or self.consecutive_failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+@dataclass
+class RetryPolicy:
+    max_retries: int = UPSTREAM_MAX_RETRIES
+    base_delay: float = UPSTREAM_BACKOFF_BASE
+    max_delay: float = UPSTREAM_BACKOFF_MAX
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter."""
+        return random.uniform(0.0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class RetryBudget:
+    """Every call deposits `ratio` tokens and every retry spends one, so retries
+    cannot multiply the load on an upstream that is already struggling.
+    """
+
+    def __init__(self, ratio: float = UPSTREAM_RETRY_BUDGET_RATIO, min_tokens: float = 10.0):
+        self.ratio = ratio
+        self.capacity = min_tokens
+        self.tokens = min_tokens
+        self._lock = threading.Lock()
+
+    def record_call(self) -> None:
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            return True
+
+
+class Endpoint:
+    """Circuit breaker and counters of one upstream endpoint."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.breaker = CircuitBreaker()
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.short_circuited = 0
+        self.deadline_exceeded = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "breaker": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retries,
+            "short_circuited": self.short_circuited,
+            "deadline_exceeded": self.deadline_exceeded,
+        }
+
+
+endpoints: Dict[str, Endpoint] = {}
+endpoints_lock = threading.Lock()
+retry_policy = RetryPolicy()
+retry_budget = RetryBudget()
+
+
+def get_endpoint(name: str) -> Endpoint:
+    with endpoints_lock:
+        if name not in endpoints:
+            endpoints[name] = Endpoint(name)
+        return endpoints[name]
+
+
+def resilience_stats() -> dict:
+    with endpoints_lock:
+        stats = {name: endpoint.to_dict() for name, endpoint in endpoints.items()}
+    return {"endpoints": stats, "retry_budget": round(retry_budget.tokens, 2)}
+
+
+def parse_retry_after(response: requests.Response) -> Optional[float]:
+    """Seconds to wait according to a Retry-After header (delta seconds or HTTP date)."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def call_with_resilience(
+    endpoint_name: str,
+    attempt: Callable[[float], object],
+    is_failure: Callable[[object], bool] = lambda result: False,
+    retry_after: Callable[[object], Optional[float]] = lambda result: None,
+    is_rate_limited: Callable[[object], bool] = lambda result: False,
+    deadline: Optional[float] = None,
+):
+    """Calls `attempt(remaining_seconds)` behind the endpoint's circuit breaker and
+    retries failed attempts (exceptions or results flagged by `is_failure`) with
+    jittered exponential backoff, or the server's Retry-After, while the deadline and
+    the retry budget allow it. The last failed result is returned, or the last
+    exception re-raised, once retrying stops.
+
+    The breaker sees one outcome per call, not per attempt: a failure (or rate limit)
+    is only recorded once retrying stops, so a call that is still being retried never
+    opens the breaker under itself. Any other exception is recorded as a failure and
+    re-raised without retrying.
+
+    Raises:
+        CircuitOpenError: if the endpoint's breaker is open
+        DeadlineExceeded: if no attempt could be started before the deadline
+    """
+    endpoint = get_endpoint(endpoint_name)
+    deadline_at = time.monotonic() + (deadline or UPSTREAM_DEADLINE)
+    retry_budget.record_call()
+
+    if not endpoint.breaker.allow():
+        endpoint.short_circuited += 1
+        raise CircuitOpenError(f"Circuit for '{endpoint_name}' is open.")
+
+    attempt_number = 0
+    while True:
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            endpoint.deadline_exceeded += 1
+            endpoint.breaker.record_failure()
+            raise DeadlineExceeded(f"Deadline for '{endpoint_name}' exceeded.")
+
+        endpoint.calls += 1
+        error = None
+        delay = None
+        rate_limited = False
+        try:
+            result = attempt(remaining)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = e
+        except Exception:
+            # Not retryable, but it still ends the call, e.g. a half-open trial
+            endpoint.failures += 1
+            endpoint.breaker.record_failure()
+            raise
+        else:
+            if not is_failure(result):
+                endpoint.breaker.record_success()
+                return result
+            rate_limited = is_rate_limited(result)
+            delay = retry_after(result)
+
+        endpoint.failures += 1
+        if delay is None:
+            delay = retry_policy.backoff(attempt_number)
+
+        give_up = (
+            attempt_number >= retry_policy.max_retries
+            or time.monotonic() + delay >= deadline_at
+            or not retry_budget.try_spend()
+        )
+        if give_up:
+            # Returns right away, a rate limit that cannot be waited out opens the breaker
+            endpoint.breaker.record_failure(rate_limited=rate_limited)
+            if error is not None:
+                raise error
+            return result
+
+        endpoint.retries += 1
+        attempt_number += 1
+        time.sleep(delay)
+
+
+def resilient_get(endpoint_name: str, url: str, deadline: Optional[float] = None, **kwargs):
+    """requests.get with a deadline, retries and a per endpoint circuit breaker.
+    Retryable status codes (429, 5xx) are returned as is once retrying stops, so
+    callers keep using raise_for_status().
+    """
+    return call_with_resilience(
+        endpoint_name,
+        lambda remaining: requests.get(url, timeout=remaining, **kwargs),
+        is_failure=lambda response: response.status_code in RETRYABLE_STATUS_CODES,
+        retry_after=parse_retry_after,
+        is_rate_limited=lambda response: response.status_code == 429,
+        deadline=deadline,
+    )
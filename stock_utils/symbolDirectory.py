@@ -0,0 +1,114 @@
+from typing import Dict, List, Optional, TextIO, Tuple
+from bisect import bisect_left
+import csv
+import os
+import threading
+import time
+
+# Alpha Vantage LISTING_STATUS snapshot: symbol,name,exchange,assetType,ipoDate,delistingDate,status
+SYMBOL_DIRECTORY_FILE = os.getenv(
+    "SYMBOL_DIRECTORY_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "listing_status.csv"),
+)
+# How long a symbol that a provider reported as unknown is rejected without asking again
+SYMBOL_NEGATIVE_TTL = float(os.getenv("SYMBOL_NEGATIVE_TTL", "86400"))
+SYMBOL_SEARCH_LIMIT = 20
+
+
+class SymbolDirectory:
+    """Listing of tradable symbols with O(1) lookups and prefix search over a sorted
+    list, plus a TTL cache of symbols that providers reported as unknown.
+
+    Without a listing every symbol is accepted unless it is in the negative cache.
+    """
+
+    def __init__(self, negative_ttl: float = SYMBOL_NEGATIVE_TTL):
+        self.negative_ttl = negative_ttl
+        self.listings: Dict[str, Tuple[str, str]] = {}  # symbol -> (name, exchange)
+        self.sorted_symbols: List[str] = []
+        self.invalid_until: Dict[str, float] = {}
+        self._loaded_file = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self) -> bool:
+        return bool(self.listings)
+
+    def load(self, file: TextIO) -> int:
+        """Replaces the listing with the active symbols of a LISTING_STATUS CSV."""
+        listings = {}
+        for row in csv.DictReader(file):
+            if row.get("status", "Active").lower() != "active" or not row.get("symbol"):
+                continue
+            listings[row["symbol"].upper()] = (row.get("name", ""), row.get("exchange", ""))
+        with self._lock:
+            self.listings = listings
+            self.sorted_symbols = sorted(listings)
+        return len(listings)
+
+    def load_file(self, path: str = SYMBOL_DIRECTORY_FILE) -> int:
+        with open(path, newline="", encoding="utf-8") as file:
+            return self.load(file)
+
+    def ensure_loaded(self) -> None:
+        """Loads the snapshot file once, if there is one."""
+        if self._loaded_file:
+            return
+        self._loaded_file = True
+        if os.path.exists(SYMBOL_DIRECTORY_FILE):
+            try:
+                print(f"{self.load_file()} symbols loaded from {SYMBOL_DIRECTORY_FILE}.")
+            except (OSError, csv.Error) as e:
+                print(f"Error while loading the symbol directory: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self.listings = {}
+            self.sorted_symbols = []
+            self.invalid_until.clear()
+
+    def remember_invalid(self, symbol: str) -> None:
+        with self._lock:
+            self.invalid_until[symbol.upper()] = time.monotonic() + self.negative_ttl
+
+    def rejection(self, symbol: str) -> Optional[str]:
+        """Why the symbol is known to be invalid, None if it may be valid."""
+        self.ensure_loaded()
+        symbol = symbol.upper()
+        invalid_until = self.invalid_until.get(symbol)
+        if invalid_until is not None:
+            if time.monotonic() < invalid_until:
+                return f"Error: The symbol '{symbol}' cannot be found."
+            with self._lock:
+                self.invalid_until.pop(symbol, None)
+        if self.listings and symbol not in self.listings:
+            return f"Error: The symbol '{symbol}' is not listed."
+        return None
+
+    def search(self, prefix: str, limit: int = SYMBOL_SEARCH_LIMIT) -> List[dict]:
+        """Listed symbols starting with the prefix, in alphabetical order."""
+        self.ensure_loaded()
+        prefix = prefix.upper()
+        symbols = self.sorted_symbols
+        start = bisect_left(symbols, prefix)
+        results = []
+        for symbol in symbols[start : start + limit]:
+            if not symbol.startswith(prefix):
+                break
+            name, exchange = self.listings[symbol]
+            results.append({"symbol": symbol, "name": name, "exchange": exchange})
+        return results
+
+
+symbol_directory = SymbolDirectory()
+
+
+if __name__ == "__main__":
+    # Refreshes the snapshot from Alpha Vantage: python -m stock_utils.symbolDirectory
+    from stock_utils.dataFetcher import get_listing_status
+
+    listing = get_listing_status()
+    os.makedirs(os.path.dirname(SYMBOL_DIRECTORY_FILE), exist_ok=True)
+    with open(SYMBOL_DIRECTORY_FILE, "w", encoding="utf-8") as file:
+        file.write(listing)
+    print(f"Symbol directory written to {SYMBOL_DIRECTORY_FILE}.")
@@ -1,9 +1,41 @@
 import unittest
+from unittest import mock
+import importlib.util
+import http.client
+import io
 import json
-from flask import Flask
+import shutil
+import tempfile
+import threading
+import time
+import requests
+from flask import Flask, jsonify
 from flask_sqlalchemy import SQLAlchemy
-from models import Stock, Indicator, db
-from routes import register_routes
+from models import Stock, Indicator, PriceBar, PriceBarVersion, db
+from routes import handle_limit_error, register_routes
+import config
+from config import (
+    add_indicator_to_stock,
+    add_stock_to_database,
+    compact_change_log,
+    get_changes,
+    market_data,
+    rebuild_stock_snapshots,
+    record_changes,
+)
+import analytics
+from export import EXPORT_COLUMNS
+from stock_utils.alertEngine import AlertEngine, AlertNotifier, ThresholdRule, alert_engine
+from stock_utils.dataFetcher import StockFundamentals, StockPriceResult
+from stock_utils.priceFetcher import PriceHistoryResult
+from stock_utils.marketData import MarketData, MarketDataProvider, YahooFinanceProvider
+from stock_utils.asyncFetcher import AsyncFetchEngine
+from stock_utils import resilience
+from stock_utils.resilience import CircuitOpenError, call_with_resilience, get_endpoint
+from stock_utils.barStore import IntradayBarStore, intraday_store
+from stock_utils.symbolDirectory import symbol_directory
+from authentication import auth, limits
+from authentication.limits import ConcurrencyLimiter, LimitError, RateLimiter, limit_concurrency
 
 # Define your Flask app and database configuration for testing
 app = Flask(__name__)
@@ -22,6 +54,29 @@ INDICATOR_1 = "PERatio"
 INDICATOR_2 = "200DayMovingAverage"
 
 
+class RecordingNotifier(AlertNotifier):
+    def __init__(self):
+        self.events = []
+
+    def notify(self, event):
+        self.events.append(event)
+
+
+class FakePriceProvider(MarketDataProvider):
+    def __init__(self, name, result, delay=0.0):
+        super().__init__()
+        self.name = name
+        self.result = result
+        self.delay = delay
+        self.calls = 0
+        self.default_hedge_delay = 0.05
+
+    def get_price(self, symbol):
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.result
+
+
 class StockAppTestCase(unittest.TestCase):
     def setUp(self):
         """Set up a test client and initialize the database."""
@@ -29,6 +84,11 @@ class StockAppTestCase(unittest.TestCase):
         self.app = app.test_client()
         self.app.testing = True
 
+        # Collect alerts instead of printing them
+        alert_engine.clear()
+        self.notifier = RecordingNotifier()
+        alert_engine.notifier = self.notifier
+
         # Set up the test database
         with app.app_context():
 
@@ -70,6 +130,7 @@ class StockAppTestCase(unittest.TestCase):
             db.session.add(indicator2_2)
 
             db.session.commit()
+            rebuild_stock_snapshots()
 
         register_routes(app)
 
@@ -114,6 +175,403 @@ class StockAppTestCase(unittest.TestCase):
         self.assertEqual(stock_info["current_price"], 150.0)
         self.assertEqual(stock_info["PERatio"], '30.0')
 
+    def test_screener(self):
+        """Test screening stocks with filters pushed down to SQL."""
+        response = self.app.get('/screener', query_string={"filter": "PERatio<40 AND current_price>100"})
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.data)
+        self.assertEqual(result["total"], 1)
+        self.assertEqual(result["results"][0]["symbol"], STOCK_1)
+        self.assertEqual(result["results"][0]["PERatio"], "30.0")
+
+    def test_screener_sort_and_paging(self):
+        """Test sorting by an indicator and paginating the screener results."""
+        response = self.app.get('/screener', query_string={"sort": "-PERatio", "limit": 1, "page": 2})
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.data)
+        self.assertEqual(result["total"], 2)
+        self.assertEqual([row["symbol"] for row in result["results"]], [STOCK_1])
+
+        # A page past the end still reports the total
+        response = self.app.get('/screener', query_string={"sort": "-PERatio", "limit": 1, "page": 5})
+        result = json.loads(response.data)
+        self.assertEqual(result["results"], [])
+        self.assertEqual(result["total"], 2)
+
+        # An older duplicate indicator row neither repeats a stock nor inflates the total
+        with app.app_context():
+            db.session.add(Indicator(
+                indicator_type=INDICATOR_1, value="10.0", stock_id=1, latest_trading_day="2023-12-29"
+            ))
+            db.session.add(Indicator(
+                indicator_type=INDICATOR_1, value="35.0", stock_id=1, latest_trading_day="2024-01-02"
+            ))
+            db.session.commit()
+        for page in (1, 5):
+            response = self.app.get('/screener', query_string={"filter": "PERatio<40", "page": page})
+            result = json.loads(response.data)
+            self.assertEqual(result["total"], 1)
+        response = self.app.get('/screener', query_string={"filter": "PERatio<40"})
+        self.assertEqual(json.loads(response.data)["results"][0]["PERatio"], "35.0")
+
+        response = self.app.get('/screener', query_string={"filter": "Unknown>1"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_snapshot_follows_writes(self):
+        """Test that updates and deletions are reflected in the dashboard snapshot."""
+        self.app.patch('/stocks/AMD', json={"current_price": 99.0})
+        self.app.delete('/indicators/200DayMovingAverage')
+
+        response = self.app.get('/stocks/AMD')
+        stock_info = json.loads(response.data)
+        self.assertEqual(stock_info["current_price"], 99.0)
+        self.assertEqual(stock_info["PERatio"], "50.0")
+        self.assertNotIn(INDICATOR_2, stock_info)
+
+        response_data = self.app.get("/").data.decode("utf-8")
+        self.assertNotIn(INDICATOR_2, response_data)
+
+    def test_portfolio_valuation(self):
+        """Test valuing a portfolio with P&L, weights and sector exposure."""
+        new_portfolio = {
+            "name": "core",
+            "positions": [
+                {"symbol": STOCK_1, "quantity": 10, "cost_basis": 100.0},
+                {"symbol": STOCK_2, "quantity": 5, "cost_basis": 140.0},
+            ],
+        }
+        response = self.app.post('/portfolios', json=new_portfolio)
+        self.assertEqual(response.status_code, 201)
+
+        response = self.app.get('/portfolios/valuation', query_string={"positions": "true"})
+        self.assertEqual(response.status_code, 200)
+        valuation = json.loads(response.data)["portfolios"][0]
+        self.assertEqual(valuation["market_value"], 2100.0)
+        self.assertEqual(valuation["unrealized_pnl"], 400.0)
+        self.assertAlmostEqual(valuation["positions"][0]["weight"], 1500.0 / 2100.0, places=5)
+        self.assertAlmostEqual(valuation["sector_exposure"]["Unknown"], 1.0)
+
+        response = self.app.post('/portfolios', json={"name": "bad", "positions": [{"symbol": "XYZ"}]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_analytics(self):
+        """Test correlation, volatility and drawdowns over stored daily bars."""
+        closes = [100.0, 102.0, 101.0, 105.0, 103.0, 99.0, 104.0, 108.0, 107.0, 110.0]
+        with app.app_context():
+            for stock_id, scale in ((1, 1.0), (2, 2.0)):
+                for day, close in enumerate(closes):
+                    db.session.add(
+                        PriceBar(stock_id=stock_id, date=f"2024-01-{day + 1:02d}", close=close * scale)
+                    )
+            analytics.invalidate_price_matrix_on_commit()
+            db.session.commit()
+
+        response = self.app.get('/analytics/correlation', query_string={"window": 5})
+        self.assertEqual(response.status_code, 200)
+        correlation = json.loads(response.data)
+        self.assertEqual(correlation["symbols"], [STOCK_1, STOCK_2])
+        self.assertAlmostEqual(correlation["matrix"][0][1], 1.0)
+
+        response = self.app.get('/analytics/volatility', query_string={"window": 5, "symbols": STOCK_2})
+        volatility = json.loads(response.data)["stocks"]
+        self.assertEqual(len(volatility), 1)
+        self.assertGreater(volatility[0]["volatility"], 0.0)
+
+        response = self.app.get('/analytics/drawdowns')
+        drawdown = json.loads(response.data)["stocks"][0]
+        self.assertAlmostEqual(drawdown["max_drawdown"], 99.0 / 105.0 - 1.0, places=5)
+        self.assertEqual(drawdown["trough_date"], "2024-01-06")
+
+        # The matrix is only rebuilt once a new bar arrives
+        with app.app_context():
+            matrix = analytics.price_matrix()
+            self.assertIs(analytics.price_matrix(), matrix)
+        self.app.patch('/stocks/AAPL', json={"current_price": 120.0})
+        with app.app_context():
+            self.assertIsNot(analytics.price_matrix(), matrix)
+            matrix = analytics.price_matrix()
+
+            # A bar written by another process is noticed through the shared version
+            db.session.execute(
+                PriceBar.__table__.update().where(PriceBar.date == "2024-01-10").values(close=50.0)
+            )
+            db.session.execute(
+                PriceBarVersion.__table__.update().values(version=PriceBarVersion.version + 1)
+            )
+            db.session.commit()
+            self.assertIsNot(analytics.price_matrix(), matrix)
+            self.assertIn(50.0, analytics.price_matrix().closes)
+
+        response = self.app.get('/analytics/correlation', query_string={"symbols": "XYZ"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export(self):
+        """Test streaming the indicators as CSV and NDJSON with filters."""
+        response = self.app.get('/export', query_string={"format": "csv"})
+        self.assertEqual(response.status_code, 200)
+        lines = response.data.decode("utf-8").splitlines()
+        self.assertEqual(lines[0], "symbol,current_price,indicator_type,value,numeric_value,latest_trading_day")
+        self.assertEqual(len(lines), 5)
+
+        response = self.app.get(
+            '/export', query_string={"format": "ndjson", "indicators": INDICATOR_1, "since": "2024-01-01"}
+        )
+        rows = [json.loads(line) for line in response.data.decode("utf-8").splitlines()]
+        self.assertEqual([row["symbol"] for row in rows], [STOCK_1, STOCK_2])
+        self.assertEqual(rows[1]["numeric_value"], 50.0)
+
+        response = self.app.get('/export', query_string={"format": "xlsx"})
+        self.assertEqual(response.status_code, 400)
+
+    @unittest.skipIf(importlib.util.find_spec("pyarrow") is None, "pyarrow is not installed")
+    def test_export_parquet(self):
+        """Test that the Parquet export reads back with the export schema and all rows."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        response = self.app.get('/export', query_string={"format": "parquet"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/vnd.apache.parquet")
+        table = pq.read_table(io.BytesIO(response.data))
+        self.assertEqual(table.schema.names, EXPORT_COLUMNS)
+        self.assertEqual(table.schema.field("numeric_value").type, pa.float64())
+        self.assertEqual(table.num_rows, 4)
+        self.assertEqual(table.column("symbol").to_pylist(), [STOCK_1, STOCK_1, STOCK_2, STOCK_2])
+
+    def test_intraday_bars(self):
+        """Test merging overlapping intraday fetches and rolling them up to 5 minutes."""
+        self.addCleanup(intraday_store.clear)
+        offline = mock.patch.object(
+            market_data, "get_intraday_history", return_value=PriceHistoryResult(error_message="offline")
+        )
+        offline.start()
+        self.addCleanup(offline.stop)
+
+        def fetch(minutes, close_offset=0.0):
+            return {
+                f"2024-01-05 10:{minute:02d}:00": {
+                    "1. open": str(100.0 + minute),
+                    "2. high": str(101.0 + minute),
+                    "3. low": str(99.0 + minute),
+                    "4. close": str(100.5 + minute + close_offset),
+                    "5. volume": "1000",
+                }
+                for minute in minutes
+            }
+
+        intraday_store.ingest_alpha_vantage(STOCK_1, fetch(range(0, 6)))
+        # Overlapping fetch, the re-fetched bar 10:05 replaces the stored one
+        intraday_store.ingest_alpha_vantage(STOCK_1, fetch(range(5, 10), close_offset=1.0))
+
+        response = self.app.get('/stocks/AAPL/intraday', query_string={"interval": "5m"})
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.data)
+        self.assertEqual(len(result["bars"]), 2)
+        self.assertEqual(result["bars"][0]["open"], 100.0)
+        self.assertEqual(result["bars"][0]["close"], 104.5)
+        self.assertEqual(result["bars"][1]["time"], "2024-01-05T10:05:00")
+        self.assertEqual(result["bars"][1]["high"], 110.0)
+        self.assertEqual(result["bars"][1]["volume"], 5000.0)
+        # Typical price (high + low + close) / 3 averages 100.1667 + 4.5, half the closes are 1.0 higher
+        self.assertAlmostEqual(result["vwap"], (300.5 + 3 * 4.5 + 0.5) / 3, places=6)
+
+        response = self.app.get('/stocks/AMD/intraday')
+        self.assertEqual(response.status_code, 404)
+
+        response = self.app.get('/stocks/AAPL/intraday', query_string={"limit": -1})
+        self.assertEqual(response.status_code, 400)
+
+    def test_intraday_endpoint_fetches_bars(self):
+        """Test that the intraday endpoint feeds the store from yfinance, at most once per
+        refresh interval."""
+        self.addCleanup(intraday_store.clear)
+        rows = [(f"2024-01-05 10:{minute:02d}:00", 1.0, 2.0, 0.5, 1.5, 100.0) for minute in range(3)]
+        with mock.patch.object(
+            market_data, "get_intraday_history", return_value=PriceHistoryResult(bars=rows)
+        ) as fetch:
+            response = self.app.get('/stocks/AMD/intraday', query_string={"limit": 2})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(json.loads(response.data)["bars"]), 2)
+            self.app.get('/stocks/AMD/intraday')
+            # Not a tracked stock, the endpoint does not fetch arbitrary symbols
+            self.app.get('/stocks/MSFT/intraday')
+        fetch.assert_called_once_with(STOCK_2)
+
+    def test_intraday_store_only_saves_new_bars(self):
+        """Test that a store that only loaded the files (like the gunicorn master) does not
+        overwrite the newer files of another process."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        rows = [(f"2024-01-05 10:{minute:02d}:00", 1.0, 2.0, 0.5, 1.5, 100.0) for minute in range(3)]
+
+        worker = IntradayBarStore(directory=directory)
+        worker.ingest_rows(STOCK_1, rows[:2])
+        worker.save_all()
+        master = IntradayBarStore(directory=directory)
+        master.load_all()
+
+        worker.ingest_rows(STOCK_1, rows[2:])
+        worker.save_all()
+        master.save_all()
+
+        restarted = IntradayBarStore(directory=directory)
+        restarted.load_all()
+        self.assertEqual(len(restarted.bars(STOCK_1)), 3)
+
+    def test_symbol_directory(self):
+        """Test prefix search and rejecting unlisted or known invalid symbols."""
+        self.addCleanup(symbol_directory.clear)
+        symbol_directory.load(
+            io.StringIO(
+                "symbol,name,exchange,assetType,ipoDate,delistingDate,status\n"
+                "AAPL,Apple Inc,NASDAQ,Stock,1980-12-12,null,Active\n"
+                "AAL,American Airlines Group Inc,NASDAQ,Stock,2005-09-27,null,Active\n"
+                "AMD,Advanced Micro Devices Inc,NASDAQ,Stock,1972-09-27,null,Active\n"
+                "GOOG,Alphabet Inc - Class C,NASDAQ,Stock,2014-03-27,null,Active\n"
+            )
+        )
+
+        response = self.app.get('/symbols', query_string={"prefix": "aa"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([s["symbol"] for s in json.loads(response.data)], ["AAL", "AAPL"])
+
+        # Out of range limits are clamped to 1..100
+        for limit in (0, -3):
+            response = self.app.get('/symbols', query_string={"prefix": "aa", "limit": limit})
+            self.assertEqual([s["symbol"] for s in json.loads(response.data)], ["AAL"])
+
+        response = self.app.post('/stocks', json={"symbol": "AAPLX"})
+        self.assertEqual(response.status_code, 400)
+
+        # Reported as unknown by a provider: rejected until the TTL expires
+        symbol_directory.remember_invalid("GOOG")
+        response = self.app.post('/stocks', json={"symbol": "GOOG"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("cannot be found", json.loads(response.data)["error"])
+
+        # A symbol no price provider knows is a 404 and is remembered as invalid
+        unknown = FakePriceProvider("unknown", StockPriceResult(error_message="none", not_found=True))
+        with mock.patch.object(market_data, "price_providers", [unknown]):
+            response = self.app.post('/stocks', json={"symbol": "AAL"})
+            self.assertEqual(response.status_code, 404)
+            response = self.app.post('/stocks', json={"symbol": "AAL"})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(unknown.calls, 1)
+
+    def test_change_feed(self):
+        """Test paging through the change log and compacting superseded entries."""
+        self.app.patch('/stocks/AAPL', json={"current_price": 160.0})
+        self.app.patch('/stocks/AAPL', json={"current_price": 170.0})
+        self.app.delete('/indicators/PERatio')
+
+        response = self.app.get('/changes', query_string={"since": 0, "limit": 2})
+        self.assertEqual(response.status_code, 200)
+        page = json.loads(response.data)
+        self.assertEqual([c["action"] for c in page["changes"]], ["stock_repriced", "stock_repriced"])
+        self.assertTrue(page["has_more"])
+
+        response = self.app.get('/changes', query_string={"since": page["next"]})
+        page = json.loads(response.data)
+        self.assertEqual(
+            [(c["action"], c["symbol"]) for c in page["changes"]],
+            [("indicator_deleted", STOCK_1), ("indicator_deleted", STOCK_2)],
+        )
+        self.assertFalse(page["has_more"])
+
+        # Only the latest change per stock and indicator survives compaction
+        with app.app_context():
+            self.assertEqual(compact_change_log(page["next"]), 1)
+            db.session.commit()
+        response = self.app.get('/changes')
+        changes = json.loads(response.data)["changes"]
+        self.assertEqual(len(changes), 3)
+        self.assertEqual(changes[0]["value"], "170.0")
+
+    def test_change_feed_resumes_across_compaction(self):
+        """Test that a client syncing after compaction still sees added and deleted stocks."""
+        with app.app_context():
+            add_stock_to_database("NVDA", StockPriceResult(price=100.0))
+            add_stock_to_database("TSLA", StockPriceResult(price=200.0))
+        self.app.patch('/stocks/NVDA', json={"current_price": 110.0})
+        self.app.patch('/stocks/NVDA', json={"current_price": 120.0})
+        self.app.patch('/stocks/TSLA', json={"current_price": 210.0})
+        self.app.delete('/stocks/TSLA')
+        with app.app_context():
+            add_stock_to_database("TSLA", StockPriceResult(price=220.0))
+            last_seq = get_changes(0, 100)[-1].seq
+            compact_change_log(last_seq)
+            db.session.commit()
+
+        changes = json.loads(self.app.get('/changes', query_string={"since": 0}).data)["changes"]
+        self.assertEqual(
+            [(c["action"], c["symbol"], c["value"]) for c in changes],
+            [
+                ("stock_added", "NVDA", "100.0"),
+                ("stock_repriced", "NVDA", "120.0"),
+                ("stock_deleted", "TSLA", None),
+                ("stock_added", "TSLA", "220.0"),
+            ],
+        )
+
+    def test_change_log_compacts_after_commit(self):
+        """Test that crossing a compaction boundary compacts once the writer committed,
+        not inside its transaction."""
+        with mock.patch.object(config, "CHANGE_LOG_COMPACT_EVERY", 4), \
+                mock.patch.object(config, "CHANGE_LOG_RETENTION", 1), \
+                mock.patch.object(config, "compact_change_log_in_background") as compact:
+            with app.app_context():
+                record_changes([("stock_repriced", STOCK_1, None, price) for price in (1.0, 2.0, 3.0)])
+                compact.assert_not_called()
+                record_changes([("stock_repriced", STOCK_2, None, price) for price in (4.0, 5.0)])
+                compact.assert_not_called()
+                db.session.commit()
+                self.assertEqual(compact.call_args.args[1], 5 - 1)
+                self.assertEqual(get_changes(0, 100)[-1].seq, 5)
+
+    def test_add_indicator_upserts(self):
+        """Test that storing an indicator again updates its row instead of adding one."""
+        with app.app_context():
+            stock = Stock.query.filter_by(symbol=STOCK_1).one()
+            for value in ("31.0", "32.0"):
+                result = StockFundamentals(
+                    symbol=STOCK_1, indicator_type=INDICATOR_1, value=value, latest_trading_day="2024-01-02"
+                )
+                self.assertIsNotNone(add_indicator_to_stock(stock, INDICATOR_1, result))
+            indicators = Indicator.query.filter_by(stock_id=stock.id, indicator_type=INDICATOR_1).all()
+            self.assertEqual([indicator.value for indicator in indicators], ["32.0"])
+            self.assertEqual(indicators[0].numeric_value, 32.0)
+            self.assertEqual(
+                [(c.action, c.value) for c in get_changes(0, 100)],
+                [("indicator_upserted", "31.0"), ("indicator_upserted", "32.0")],
+            )
+
+    def test_derived_ratios(self):
+        """Test recomputing PERatio from a new price and the stored EPS."""
+        with app.app_context():
+            db.session.add(
+                Indicator(indicator_type="EPS", value="5.0", stock_id=1, latest_trading_day="2024-01-01")
+            )
+            db.session.commit()
+
+        response = self.app.patch('/stocks/AAPL', json={"current_price": 200.0})
+        self.assertEqual(response.status_code, 200)
+
+        response = self.app.get('/stocks/AAPL')
+        self.assertEqual(json.loads(response.data)[INDICATOR_1], "40.00")
+        with app.app_context():
+            indicator = Indicator.query.filter_by(stock_id=1, indicator_type=INDICATOR_1).one()
+            self.assertEqual(indicator.numeric_value, 40.0)
+        response = self.app.get('/stocks/AMD')
+        self.assertEqual(json.loads(response.data)[INDICATOR_1], "50.0")
+
+        changes = json.loads(self.app.get('/changes').data)["changes"]
+        self.assertEqual(changes[-1]["action"], "indicator_upserted")
+        self.assertEqual(changes[-1]["value"], "40.00")
+
+        # The same price again changes nothing, so nothing is logged
+        self.app.patch('/stocks/AAPL', json={"current_price": 200.0})
+        self.assertEqual(len(json.loads(self.app.get('/changes').data)["changes"]), len(changes))
+
     def test_add_stock(self):
         new_stock = {"symbol": "GOOG"}
         response = self.app.post('/stocks', json=new_stock)
@@ -163,6 +621,318 @@ class StockAppTestCase(unittest.TestCase):
         stock_list = json.loads(response.data)
         self.assertNotIn(STOCK_1, stock_list)
 
+    def test_add_alert(self):
+        """Test adding an alert rule to a stock."""
+        new_alert = {"symbol": "AAPL", "indicator_type": "current_price", "operator": ">", "threshold": 180}
+        response = self.app.post('/alerts', json=new_alert)
+        self.assertEqual(response.status_code, 201)
+
+        response = self.app.get('/alerts')
+        alert_list = json.loads(response.data)
+        self.assertEqual(len(alert_list), 1)
+        self.assertEqual(alert_list[0]["symbol"], STOCK_1)
+        self.assertTrue(alert_list[0]["armed"])
+
+    def test_alert_fires_on_price_update(self):
+        """Test that a price update crossing a threshold notifies once."""
+        new_alert = {"symbol": "AAPL", "indicator_type": "current_price", "operator": ">", "threshold": 180}
+        self.app.post('/alerts', json=new_alert)
+
+        self.app.patch('/stocks/AAPL', json={"current_price": 200.0})
+        self.app.patch('/stocks/AAPL', json={"current_price": 210.0})
+        self.assertEqual(len(self.notifier.events), 1)
+        self.assertEqual(self.notifier.events[0].value, 200.0)
+
+        response = self.app.delete('/alerts/1')
+        self.assertEqual(response.status_code, 200)
+
+    def test_alert_engine_hysteresis(self):
+        """Test that a fired rule only re-arms after leaving its hysteresis band."""
+        notifier = RecordingNotifier()
+        engine = AlertEngine(notifier)
+        engine.add_rule(ThresholdRule(1, STOCK_2, INDICATOR_1, "<", 30.0, hysteresis=5.0))
+        engine.add_rule(ThresholdRule(2, STOCK_2, INDICATOR_1, ">", 60.0))
+
+        for value in (50.0, 29.0, 32.0, 28.0, 36.0, 25.0):
+            engine.update(STOCK_2, INDICATOR_1, value)
+
+        self.assertEqual([event.value for event in notifier.events], [29.0, 25.0])
+
+    def test_alert_engine_forgets_deleted_indicator(self):
+        """Test that a deleted indicator's last value does not carry over to a re-added one."""
+        notifier = RecordingNotifier()
+        engine = AlertEngine(notifier)
+        engine.add_rule(ThresholdRule(1, STOCK_2, INDICATOR_1, ">", 30.0))
+        engine.update(STOCK_2, INDICATOR_1, 40.0)
+
+        engine.forget(STOCK_2, INDICATOR_1)
+        self.assertTrue(engine.is_armed(1))
+        engine.update(STOCK_2, INDICATOR_1, 45.0)
+        self.assertEqual([event.value for event in notifier.events], [40.0, 45.0])
+        self.assertIsNone(notifier.events[1].previous_value)
+
+    def test_market_data_hedges_slow_provider(self):
+        """Test that a slow primary is hedged by the secondary provider."""
+        slow = FakePriceProvider("slow", StockPriceResult(price=1.0), delay=0.5)
+        fast = FakePriceProvider("fast", StockPriceResult(price=2.0))
+        market_data = MarketData([slow, fast], [])
+
+        start = time.perf_counter()
+        result = market_data.get_price(STOCK_1)
+        self.assertEqual(result.price, 2.0)
+        self.assertLess(time.perf_counter() - start, 0.4)
+
+    def test_market_data_waits_for_primary_over_secondary_not_found(self):
+        """Test that a 'not found' from either provider does not beat the other's price."""
+        self.addCleanup(symbol_directory.clear)
+        slow = FakePriceProvider("slow", StockPriceResult(price=1.0), delay=0.3)
+        missing = FakePriceProvider("missing", StockPriceResult(error_message="none", not_found=True))
+        market_data = MarketData([slow, missing], [])
+        self.assertEqual(market_data.get_price(STOCK_1).price, 1.0)
+        self.assertEqual(missing.calls, 1)
+
+        # A price the primary does not have is still asked from the secondary
+        market_data = MarketData([missing, slow], [])
+        self.assertEqual(market_data.get_price(STOCK_1).price, 1.0)
+        self.assertEqual(slow.calls, 2)
+
+        unknown = FakePriceProvider("unknown", StockPriceResult(error_message="none", not_found=True))
+        market_data = MarketData([missing, unknown], [])
+        self.assertTrue(market_data.get_price(STOCK_1).not_found)
+        self.assertEqual(unknown.calls, 1)
+
+    def test_market_data_skips_rate_limited_provider(self):
+        """Test that a rate limited provider is skipped while its breaker is open."""
+        limited = FakePriceProvider(
+            "limited", StockPriceResult(error_message="limit", rate_limited=True)
+        )
+        backup = FakePriceProvider("backup", StockPriceResult(price=3.0))
+        market_data = MarketData([limited, backup], [])
+
+        self.assertEqual(market_data.get_price(STOCK_1).price, 3.0)
+        self.assertEqual(market_data.get_price(STOCK_1).price, 3.0)
+        self.assertEqual(limited.calls, 1)
+        self.assertEqual(market_data.health()["limited"]["breaker"], "open")
+
+    def test_fetch_engine_runs_calls_concurrently(self):
+        """Test that the fetch engine overlaps blocking calls and keeps their order."""
+        def slow_double(value):
+            time.sleep(0.2)
+            return value * 2
+
+        engine = AsyncFetchEngine(max_concurrency=5)
+        start = time.perf_counter()
+        results = engine.map(slow_double, [(i,) for i in range(5)])
+        self.assertEqual(results, [0, 2, 4, 6, 8])
+        self.assertLess(time.perf_counter() - start, 0.6)
+
+    def test_resilience_retries_then_opens_breaker(self):
+        """Test that failures are retried and that repeatedly failing calls open the breaker."""
+        resilience.retry_budget.tokens = resilience.retry_budget.capacity
+        calls = []
+
+        def flaky(remaining):
+            calls.append(remaining)
+            return None
+
+        result = call_with_resilience("test.flaky", flaky, is_failure=lambda r: r is None)
+        self.assertIsNone(result)
+        self.assertEqual(len(calls), 3)
+        # The retries of one call count as one failure
+        self.assertEqual(get_endpoint("test.flaky").breaker.state, "closed")
+
+        for _ in range(2):
+            call_with_resilience("test.flaky", flaky, is_failure=lambda r: r is None)
+        self.assertEqual(get_endpoint("test.flaky").breaker.state, "open")
+
+        with self.assertRaises(CircuitOpenError):
+            call_with_resilience("test.flaky", flaky, is_failure=lambda r: r is None)
+        self.assertEqual(len(calls), 9)
+
+        response = self.app.get('/resilience')
+        stats = json.loads(response.data)
+        self.assertEqual(stats["endpoints"]["test.flaky"]["retries"], 6)
+        self.assertEqual(stats["endpoints"]["test.flaky"]["short_circuited"], 1)
+
+    def test_resilience_waits_out_rate_limit_before_opening_breaker(self):
+        """Test that a rate limit is retried after Retry-After without opening the breaker,
+        and that one that cannot be waited out opens it without sleeping."""
+        resilience.retry_budget.tokens = resilience.retry_budget.capacity
+        responses = iter([429, 200])
+        result = call_with_resilience(
+            "test.limited",
+            lambda remaining: next(responses),
+            is_failure=lambda status: status == 429,
+            retry_after=lambda status: 0.05,
+            is_rate_limited=lambda status: status == 429,
+        )
+        self.assertEqual(result, 200)
+        self.assertEqual(get_endpoint("test.limited").breaker.state, "closed")
+
+        start = time.perf_counter()
+        result = call_with_resilience(
+            "test.limited",
+            lambda remaining: 429,
+            is_failure=lambda status: status == 429,
+            retry_after=lambda status: 60.0,
+            is_rate_limited=lambda status: status == 429,
+            deadline=1.0,
+        )
+        self.assertEqual(result, 429)
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual(get_endpoint("test.limited").breaker.state, "open")
+
+    def test_resilience_failed_trial_reopens_breaker(self):
+        """Test that an unexpected exception in the half-open trial opens the breaker again
+        instead of leaving the trial running forever."""
+        endpoint = get_endpoint("test.broken")
+        endpoint.breaker.cooldown = 0.05
+        endpoint.breaker.record_failure(rate_limited=True)
+        time.sleep(0.06)
+        self.assertEqual(endpoint.breaker.state, "half_open")
+
+        def broken(remaining):
+            raise KeyError("price")
+
+        with self.assertRaises(KeyError):
+            call_with_resilience("test.broken", broken)
+        self.assertEqual(endpoint.breaker.state, "open")
+
+        time.sleep(0.06)
+        self.assertEqual(call_with_resilience("test.broken", lambda remaining: 1.0), 1.0)
+        self.assertEqual(endpoint.breaker.state, "closed")
+
+    def test_yfinance_outage_is_not_an_unknown_symbol(self):
+        """Test that an unreachable Yahoo is retried and held against the breaker, while
+        Yahoo's own 'not found' answer is final."""
+        resilience.retry_budget.tokens = resilience.retry_budget.capacity
+        endpoint = get_endpoint("yfinance.history")
+        retries, failures = endpoint.retries, endpoint.failures
+
+        outage = requests.exceptions.ConnectionError("unreachable")
+        with mock.patch.object(requests.Session, "request", side_effect=outage):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                YahooFinanceProvider().get_price_history(STOCK_1, "1mo")
+        self.assertEqual(endpoint.retries - retries, 2)
+        self.assertEqual(endpoint.failures - failures, 3)
+
+        not_found = requests.Response()
+        not_found.status_code = 404
+        not_found._content = json.dumps(
+            {"chart": {"result": None, "error": {"code": "Not Found", "description": "No data found"}}}
+        ).encode()
+        with mock.patch.object(requests.Session, "request", return_value=not_found):
+            result = YahooFinanceProvider().get_price_history("NOSUCHSYMBOL", "1mo")
+        self.assertTrue(result.not_found)
+        self.assertEqual(endpoint.retries - retries, 2)
+
+    def test_rate_limiter_rejects_after_burst(self):
+        """Test that a subject gets its burst per permission and then a 429 with Retry-After."""
+        limiter = RateLimiter({"post:indicators": (0.5, 2)})
+        limiter.check("client-a", "post:indicators")
+        limiter.check("client-a", "post:indicators")
+        with self.assertRaises(LimitError) as context:
+            limiter.check("client-a", "post:indicators")
+        self.assertEqual(context.exception.status_code, 429)
+        self.assertEqual(context.exception.retry_after, 2)
+
+        # Other subjects and other permissions have their own buckets
+        limiter.check("client-b", "post:indicators")
+        limiter.check("client-a", "get:stocks")
+
+    def test_concurrency_limit_rejects_with_retry_after(self):
+        """Test that an expensive route admits one request at a time and answers 503 when busy."""
+        limits.concurrency_limiters["test_slow"] = ConcurrencyLimiter(1, 1, wait_seconds=0.1)
+        started = threading.Event()
+        finish = threading.Event()
+
+        def slow():
+            started.set()
+            finish.wait(2)
+            return jsonify({"message": "done"})
+
+        app = Flask(__name__)
+        app.register_error_handler(LimitError, handle_limit_error)
+        app.route("/slow")(limit_concurrency("test_slow")(slow))
+        client = app.test_client()
+
+        worker = threading.Thread(target=client.get, args=("/slow",))
+        worker.start()
+        started.wait(2)
+        try:
+            # Waits in the queue for a slot, then gives up
+            start = time.perf_counter()
+            response = client.get("/slow")
+            self.assertEqual(response.status_code, 503)
+            self.assertGreaterEqual(time.perf_counter() - start, 0.1)
+            self.assertGreaterEqual(int(response.headers["Retry-After"]), 1)
+        finally:
+            finish.set()
+            worker.join()
+            del limits.concurrency_limiters["test_slow"]
+
+        self.assertEqual(client.get("/slow").status_code, 200)
+
+    def test_expired_jwks_served_while_refreshing(self):
+        """Test that expired signing keys keep being served while a slow refresh runs."""
+        fetching = threading.Event()
+        finish = threading.Event()
+        timeouts = []
+
+        def slow_urlopen(url, timeout=None):
+            timeouts.append(timeout)
+            fetching.set()
+            finish.wait(2)
+            return io.BytesIO(json.dumps({"keys": [{"kid": "new"}]}).encode())
+
+        original_urlopen = auth.urlopen
+        auth.urlopen = slow_urlopen
+        auth._jwks = {"keys": [{"kid": "old"}]}
+        auth._jwks_fetched_at = time.monotonic() - auth.JWKS_TTL - 1
+        try:
+            start = time.perf_counter()
+            self.assertEqual(auth.get_jwks(), {"keys": [{"kid": "old"}]})
+            fetching.wait(2)
+            self.assertEqual(auth.get_jwks(), {"keys": [{"kid": "old"}]})
+            self.assertLess(time.perf_counter() - start, 0.5)
+            finish.set()
+            with auth._jwks_ready:
+                auth._jwks_ready.wait_for(lambda: not auth._jwks_refreshing, 2)
+            self.assertEqual(auth.get_jwks(), {"keys": [{"kid": "new"}]})
+            self.assertEqual(timeouts, [auth.JWKS_TIMEOUT])
+        finally:
+            finish.set()
+            auth.urlopen = original_urlopen
+            auth._jwks = None
+            auth._jwks_fetched_at = 0.0
+
+    def test_jwks_refresh_survives_unexpected_errors(self):
+        """Test that a fetch failing with a non-OSError ends the refresh, and that callers
+        without keys get a 503 instead of waiting forever."""
+        def broken_urlopen(url, timeout=None):
+            raise http.client.IncompleteRead(b"")
+
+        original_urlopen = auth.urlopen
+        auth.urlopen = broken_urlopen
+        try:
+            with self.assertRaises(auth.AuthError) as context:
+                auth.get_jwks()
+            self.assertEqual(context.exception.status_code, 503)
+            self.assertFalse(auth._jwks_refreshing)
+
+            # Another request is still fetching: wait at most JWKS_TIMEOUT, then give up
+            auth._jwks_refreshing = True
+            start = time.perf_counter()
+            with mock.patch.object(auth, "JWKS_TIMEOUT", 0.1):
+                with self.assertRaises(auth.AuthError):
+                    auth.get_jwks()
+            self.assertLess(time.perf_counter() - start, 1.0)
+        finally:
+            auth.urlopen = original_urlopen
+            auth._jwks = None
+            auth._jwks_fetched_at = 0.0
+            auth._jwks_refreshing = False
+
 
 if __name__ == "__main__":
     unittest.main()